@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmarks for the backend, run them with invoke (see tasks.py). """
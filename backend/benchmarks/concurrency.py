@@ -0,0 +1,183 @@
+"""
+Compares the throughput and latency of the Flask app with the asyncio server
+mode (infovis21.asgi) for the same seeded workload of graph pans and selections
+at increasing numbers of concurrent clients. Both servers run against the
+configured MongoDB, which needs precomputed layers for the v2 graph.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+CONCURRENCY = [1, 8, 32, 64]
+N_REQUESTS = 400
+SERVERS = {
+    "flask": [sys.executable, "-m", "flask", "run", "--with-threads", "--port"],
+    "asgi": [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "infovis21.asgi:app",
+        "--log-level",
+        "warning",
+        "--port",
+    ],
+}
+
+
+def _get(url, timeout=60):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def workload(
+    base_url,
+    n=N_REQUESTS,
+    version="v2",
+    dimx="acousticness",
+    dimy="loudness",
+    typ="track",
+    limit=200,
+    select_share=0.2,
+    seed=0,
+):
+    """ Paths of a seeded session, panning and zooming the graph and selecting one
+    of the displayed nodes every now and then
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    graph_path = None
+    x, y, zoom = 0.5, 0.5, 0.2
+    for _ in range(n):
+        if graph_path and rng.random() < select_share:
+            graph = json.loads(_get(base_url + graph_path))
+            if len(graph["nodes"]) > 0:
+                node = graph["nodes"][rng.integers(len(graph["nodes"]))]["id"]
+                query = urllib.parse.urlencode(
+                    {"node": node, "viewport": graph["viewport"]}
+                )
+                paths.append(f"/{version}/select?{query}")
+                continue
+        x = float(np.clip(x + rng.normal(0, 0.05), 0, 1))
+        y = float(np.clip(y + rng.normal(0, 0.05), 0, 1))
+        zoom = float(np.clip(zoom + rng.normal(0, 0.05), 0, 1))
+        query = urllib.parse.urlencode(
+            {
+                "x": x,
+                "y": y,
+                "zoom": zoom,
+                "dimx": dimx,
+                "dimy": dimy,
+                "type": typ,
+                "limit": limit,
+            }
+        )
+        graph_path = f"/{version}/graph?{query}"
+        paths.append(graph_path)
+    return paths
+
+
+def load(base_url, paths, concurrency):
+    """ Request all paths with a pool of concurrent clients, returns the duration
+    in seconds, the latencies of the successful requests and the number of errors
+    """
+
+    def request(path):
+        start = time.perf_counter()
+        try:
+            _get(base_url + path)
+        except (urllib.error.URLError, OSError):
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(request, paths))
+    duration = time.perf_counter() - start
+    ok = np.array([t for t in latencies if t is not None])
+    return duration, ok, len(latencies) - len(ok)
+
+
+def start_server(name, port, timeout=120):
+    """ Start one of SERVERS on a port and wait until it answers """
+    env = dict(os.environ, FLASK_APP="infovis21.app")
+    process = subprocess.Popen(SERVERS[name] + [str(port)], env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _get(base_url + "/v1/dimensions", timeout=5)
+            return process, base_url
+        except (urllib.error.URLError, OSError):
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} server exited with {process.returncode}")
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"{name} server did not start within {timeout}s")
+
+
+def run(
+    concurrency=CONCURRENCY,
+    n=N_REQUESTS,
+    version="v2",
+    servers=("flask", "asgi"),
+    base_urls=None,
+    port=5100,
+    seed=0,
+):
+    """ Print a table with the throughput and latency percentiles per server and
+    concurrency. Servers are started on consecutive ports unless base_urls maps
+    their names to already running servers.
+    """
+    results = []
+    print(
+        f"{'server':>6} {'clients':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>6}"
+    )
+    for i, name in enumerate(servers):
+        process = None
+        if base_urls and name in base_urls:
+            base_url = base_urls[name]
+        else:
+            process, base_url = start_server(name, port + i)
+        try:
+            paths = workload(base_url, n=n, version=version, seed=seed)
+            # warm up the feature store, similarity index and connection pool
+            load(base_url, paths[:20], 4)
+            for clients in concurrency:
+                duration, latencies, errors = load(base_url, paths, clients)
+                p50, p95, p99 = (
+                    np.percentile(latencies, [50, 95, 99]) * 1000
+                    if len(latencies) > 0
+                    else (np.nan,) * 3
+                )
+                results.append(
+                    {
+                        "server": name,
+                        "clients": clients,
+                        "throughput": len(latencies) / duration,
+                        "p50": p50,
+                        "p95": p95,
+                        "p99": p99,
+                        "errors": errors,
+                    }
+                )
+                print(
+                    f"{name:>6} {clients:>7} {len(latencies) / duration:>8.1f} {p50:>6.1f}ms {p95:>6.1f}ms {p99:>6.1f}ms {errors:>6}"
+                )
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+    return results
+
+
+if __name__ == "__main__":
+    run()
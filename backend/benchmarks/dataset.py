@@ -0,0 +1,15 @@
+"""
+Synthetic datasets of the endpoint benchmarks. The catalogue is written by the
+generator of the ETL (infovis21.mongodb.synthetic), so that the benchmarks and
+synthetic-catalogue measure the same data, this only seeds a benchmark database.
+"""
+
+from infovis21.mongodb import synthetic
+
+
+def seed(n_tracks, seed=0):
+    """ Replace the catalogue of the current database with a synthetic one and
+    derive the api collections the endpoints read from it
+    """
+    synthetic.write(n_tracks, seed=seed)
+    synthetic.create_api_collections()
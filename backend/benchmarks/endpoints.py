@@ -0,0 +1,338 @@
+"""
+Latency percentiles and payload sizes of the api endpoints (/graph v1 and v2,
+/select, /search and /most_popular) on a synthetic dataset of a given number of
+tracks, see benchmarks.dataset. Every size gets its own database of the
+configured MongoDB (musex_bench_<tracks>_<seed>), the dataset and the layers of
+the v2 graph (precompute_nodes) are only written when the database is new.
+
+Requests go through the Flask test client, so routing, validation and the JSON
+encoding are measured but not the network. The results of a run are saved as
+JSON next to the baseline of that size and compared with it.
+"""
+
+import json
+import platform
+import subprocess
+import time
+import urllib.parse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import connection
+
+SIZES = [10_000, 170_000, 1_000_000]
+N_REQUESTS = 200
+ENDPOINTS = ["graph_v1", "graph_v2", "select", "search", "most_popular"]
+# the dimension pairs that are queried, only their layers are precomputed
+PAIRS = [("acousticness", "loudness"), ("danceability", "energy")]
+TYPES = ["genre", "artist", "track"]
+RESULTS_DIR = Path(__file__).resolve().parent.parent.parent / "data" / "benchmarks"
+# metrics that are compared with the baseline
+METRICS = ["p50", "p90", "p99", "bytes_mean"]
+# a metric regressed when it grew by more than this share of the baseline
+THRESHOLD = 0.2
+# differences below this are noise, whatever the share (milliseconds)
+MIN_DELTA_MS = 1.0
+DATASET_COLLECTION = "benchmark_dataset"
+# datasets of another version of the generator are written again
+DATASET_VERSION = 2
+
+
+def database_name(n_tracks, seed=0):
+    return f"musex_bench_{n_tracks}_{seed}"
+
+
+def prepare(n_tracks, seed=0, force=False, workers=None):
+    """ Switch to the database of a size, seeding it and precomputing the layers
+    first if needed. Returns how long that took, as stored with the dataset.
+    """
+    from benchmarks import dataset
+    from infovis21 import cache
+    from infovis21.mongodb import featurestore, popularity, precompute
+    from infovis21.mongodb import utils as dbutils
+
+    connection.configure(MONGO_DB=database_name(n_tracks, seed))
+    ma.reset_cache()
+    info = ma.db[DATASET_COLLECTION].find_one({"_id": "dataset"})
+    if (
+        force
+        or info is None
+        or info.get("tracks") != n_tracks
+        or info.get("version") != DATASET_VERSION
+    ):
+        ma.db[DATASET_COLLECTION].drop()
+        start = time.perf_counter()
+        dataset.seed(n_tracks, seed)
+        seeded = time.perf_counter() - start
+        jobs = []
+        for dimx, dimy in PAIRS:
+            jobs += precompute.plan_jobs(
+                [dimx], [dimy], TYPES, range(dbutils.N_ZOOM_LEVELS)
+            )
+        start = time.perf_counter()
+        precompute.run(jobs, workers=workers, resume=False)
+        info = {
+            "_id": "dataset",
+            "tracks": n_tracks,
+            "seed": seed,
+            "version": DATASET_VERSION,
+            "seed_seconds": seeded,
+            "precompute_seconds": time.perf_counter() - start,
+            "created_at": datetime.now(),
+        }
+        ma.db[DATASET_COLLECTION].insert_one(info)
+        ma.bump_dataset_version("benchmark dataset")
+    # in-memory state of the previous database
+    featurestore.reload()
+    popularity.reload()
+    cache.clear()
+    return {key: value for key, value in info.items() if key.endswith("_seconds")}
+
+
+def workload(n=N_REQUESTS, seed=0):
+    """ Seeded query strings per endpoint, around the positions of random tracks """
+    from infovis21.mongodb import featurestore
+
+    rng = np.random.default_rng(seed)
+    table = featurestore.get_table("track")
+    minmax = ma.dim_minmax
+    years = minmax["year"]["min"], minmax["year"]["max"]
+    paths = {endpoint: [] for endpoint in ENDPOINTS}
+    for _ in range(n):
+        row = rng.integers(len(table))
+        dimx, dimy = PAIRS[rng.integers(len(PAIRS))]
+        typ = TYPES[rng.integers(len(TYPES))]
+        zoom = float(rng.uniform(0, 0.9))
+        x, y = float(table.column(dimx)[row]), float(table.column(dimy)[row])
+        view = {"dimx": dimx, "dimy": dimy, "type": typ, "zoom": zoom, "limit": 200}
+        # v1 is queried in MongoDB space, v2 in the normalized space of the layers
+        v1 = {"x": x, "y": y, **view}
+        v2 = {
+            "x": (x - minmax[dimx]["min"])
+            / (minmax[dimx]["max"] - minmax[dimx]["min"]),
+            "y": (y - minmax[dimy]["min"])
+            / (minmax[dimy]["max"] - minmax[dimy]["min"]),
+            **view,
+        }
+        paths["graph_v1"].append("/v1/graph?" + urllib.parse.urlencode(v1))
+        paths["graph_v2"].append("/v2/graph?" + urllib.parse.urlencode(v2))
+
+        select = {**v1, "type": "track", "node": table.ids[row], "graph_limit": 200}
+        select.pop("limit")
+        paths["select"].append("/v1/select?" + urllib.parse.urlencode(select))
+
+        # a prefix of a name
+        name = table.names[row]
+        term = name[: rng.integers(3, len(name) + 1)]
+        search = {"dimx": dimx, "dimy": dimy, "type": "track", "searchterm": term}
+        paths["search"].append("/v1/search?" + urllib.parse.urlencode(search))
+
+        year_min = int(rng.integers(years[0], years[1] + 1))
+        year_max = int(rng.integers(year_min, years[1] + 1))
+        popular = {"year_min": year_min, "year_max": year_max, "type": typ}
+        popular["limit"] = 10
+        if rng.random() < 0.5:
+            popular["streamgraph"] = 1
+        paths["most_popular"].append(
+            "/v1/most_popular?" + urllib.parse.urlencode(popular)
+        )
+    return paths
+
+
+def summarize(latencies, sizes, first, errors):
+    """ Percentiles in milliseconds and payload sizes in bytes """
+    ms = np.array(latencies) * 1000
+    summary = {"n": len(ms), "errors": errors, "first_ms": first * 1000}
+    if len(ms) > 0:
+        p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+        summary.update(
+            {
+                "p50": p50,
+                "p90": p90,
+                "p99": p99,
+                "mean": ms.mean(),
+                "max": ms.max(),
+                "bytes_mean": float(np.mean(sizes)),
+                "bytes_max": int(np.max(sizes)),
+            }
+        )
+    return summary
+
+
+def measure(paths):
+    """ Request every path once in order, the first request of an endpoint builds
+    its in-memory indexes and is reported on its own
+    """
+    from infovis21 import cache, views
+
+    client = views.app.test_client()
+    latencies, sizes, errors, first = [], [], 0, None
+    for path in paths:
+        # /most_popular is cached, every request is measured uncached
+        cache.clear()
+        start = time.perf_counter()
+        response = client.get(path)
+        body = response.get_data()
+        duration = time.perf_counter() - start
+        if first is None:
+            first = duration
+            continue
+        if response.status_code != 200:
+            errors += 1
+            continue
+        latencies.append(duration)
+        sizes.append(len(body))
+    return summarize(latencies, sizes, first or 0.0, errors)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(
+    n_tracks, n=N_REQUESTS, seed=0, endpoints=ENDPOINTS, force=False, workers=None
+):
+    """ Benchmark the endpoints on the dataset of one size """
+    timings = prepare(n_tracks, seed=seed, force=force, workers=workers)
+    paths = workload(n=n + 1, seed=seed)
+    results = {
+        "meta": {
+            "tracks": n_tracks,
+            "seed": seed,
+            "requests": n,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            **timings,
+        },
+        "endpoints": dict(),
+    }
+    for endpoint in endpoints:
+        results["endpoints"][endpoint] = measure(paths[endpoint])
+    return results
+
+
+def baseline_path(n_tracks, results_dir=RESULTS_DIR):
+    return Path(results_dir) / f"endpoints-{n_tracks}.json"
+
+
+def save(results, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, default=float))
+
+
+def load(path):
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def compare(results, baseline, threshold=THRESHOLD, min_delta_ms=MIN_DELTA_MS):
+    """ (endpoint, metric, baseline, current, ratio) of every compared metric and
+    the regressions among them
+    """
+    rows, regressions = [], []
+    for endpoint, current in results["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if before is None:
+            continue
+        for metric in METRICS:
+            if metric not in current or metric not in before:
+                continue
+            ratio = current[metric] / before[metric] if before[metric] else np.inf
+            row = (endpoint, metric, before[metric], current[metric], ratio)
+            rows.append(row)
+            delta = current[metric] - before[metric]
+            if ratio > 1 + threshold and (
+                metric.startswith("bytes") or delta > min_delta_ms
+            ):
+                regressions.append(row)
+    return rows, regressions
+
+
+def print_results(results):
+    meta = results["meta"]
+    timings = ", ".join(
+        f"{key[: -len('_seconds')]} {value:.1f}s"
+        for key, value in meta.items()
+        if key.endswith("_seconds")
+    )
+    print(f"{meta['tracks']} tracks ({timings})")
+    print(
+        f"{'endpoint':>14} {'first':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'bytes':>9} {'errors':>6}"
+    )
+    for endpoint, s in results["endpoints"].items():
+        columns = [
+            f"{s[metric]:>6.1f}ms" if metric in s else f"{'-':>8}"
+            for metric in ["p50", "p90", "p99"]
+        ]
+        size = f"{s['bytes_mean']:>9.0f}" if "bytes_mean" in s else f"{'-':>9}"
+        print(
+            f"{endpoint:>14} {s['first_ms']:>7.1f}ms {' '.join(columns)} {size} {s['errors']:>6}"
+        )
+
+
+def print_comparison(rows, regressions):
+    print(
+        f"{'endpoint':>14} {'metric':>10} {'baseline':>10} {'current':>10} {'change':>8}"
+    )
+    for endpoint, metric, before, current, ratio in rows:
+        flag = " !" if (endpoint, metric, before, current, ratio) in regressions else ""
+        print(
+            f"{endpoint:>14} {metric:>10} {before:>10.1f} {current:>10.1f} {(ratio - 1) * 100:>+7.0f}%{flag}"
+        )
+
+
+def run(
+    sizes=SIZES,
+    n=N_REQUESTS,
+    seed=0,
+    endpoints=ENDPOINTS,
+    force=False,
+    save_baseline=False,
+    threshold=THRESHOLD,
+    results_dir=RESULTS_DIR,
+    workers=None,
+):
+    """ Benchmark every size, compare with its baseline and save the results.
+    The first run of a size becomes its baseline, save_baseline replaces it.
+    Returns the regressions per size.
+    """
+    regressions = dict()
+    for n_tracks in sizes:
+        results = run_size(
+            n_tracks, n=n, seed=seed, endpoints=endpoints, force=force, workers=workers
+        )
+        print_results(results)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        save(results, Path(results_dir) / f"endpoints-{n_tracks}-{stamp}.json")
+
+        path = baseline_path(n_tracks, results_dir)
+        baseline = load(path)
+        if baseline is not None and not save_baseline:
+            rows, regressed = compare(results, baseline, threshold=threshold)
+            print(f"compared with the baseline of {baseline['meta']['created_at']}")
+            print_comparison(rows, regressed)
+            if regressed:
+                regressions[n_tracks] = regressed
+        else:
+            save(results, path)
+            print(f"saved as the baseline {path}")
+        print()
+    return regressions
+
+
+if __name__ == "__main__":
+    run()
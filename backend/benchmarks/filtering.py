@@ -0,0 +1,67 @@
+"""
+Compares the KD-tree based min_distance_based_filtering with the grid hashed
+poisson_disk_filtering on synthetic, clustered points.
+"""
+
+import time
+
+import numpy as np
+
+from infovis21.mongodb import spatial
+from infovis21.mongodb import utils as dbutils
+
+SIZES = [10_000, 170_000, 1_000_000]
+
+
+def synthetic_points(n, seed=0):
+    """ Clustered points in [0, 1]^2, half of them in a few dense gaussian blobs """
+    rng = np.random.default_rng(seed)
+    centers = rng.random((8, 2))
+    blobs = centers[rng.integers(0, len(centers), n // 2)] + rng.normal(
+        0, 0.03, (n // 2, 2)
+    )
+    uniform = rng.random((n - n // 2, 2))
+    return np.clip(np.concatenate([blobs, uniform]), 0, 1)
+
+
+def _time(func, points, radius):
+    start = time.time()
+    kept, _, _ = func(points, radius=radius, verbosity=len(points) + 1)
+    return len(kept), time.time() - start
+
+
+def run(
+    sizes=SIZES, typ="track", zooms=(0, dbutils.N_ZOOM_LEVELS - 1), max_old=170_000
+):
+    """ Print a table with the durations of both implementations, the old one is
+    skipped for sizes above max_old because it grows quadratically.
+    """
+    results = []
+    print(
+        f"{'points':>10} {'zoom':>4} {'radius':>8} {'kept':>8} {'kdtree':>10} {'grid':>10}"
+    )
+    for n in sizes:
+        points = synthetic_points(n)
+        for zoom in zooms:
+            radius = dbutils.zoom_radius(typ, zoom)
+            kept, grid = _time(spatial.poisson_disk_filtering, points, radius)
+            old = None
+            if n <= max_old:
+                _, old = _time(dbutils.min_distance_based_filtering, points, radius)
+            results.append(
+                {
+                    "points": n,
+                    "zoom": zoom,
+                    "radius": radius,
+                    "kept": kept,
+                    "kdtree": old,
+                    "grid": grid,
+                }
+            )
+            old_str = f"{old:9.3f}s" if old is not None else f"{'skipped':>10}"
+            print(f"{n:>10} {zoom:>4} {radius:>8.5f} {kept:>8} {old_str} {grid:9.3f}s")
+    return results
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,96 @@
+"""
+Import time profile of the modules that the api servers load on startup,
+measured with python -X importtime in a fresh interpreter. The serving path
+should stay free of the plotting, ETL and machine learning libraries, those
+are only imported by the tasks that need them.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SERVING_MODULES = ["infovis21.views", "infovis21.asgi"]
+# libraries that the api does not need to serve requests
+HEAVY_MODULES = [
+    "matplotlib",
+    "seaborn",
+    "pandas",
+    "sklearn",
+    "scipy",
+    "spotipy",
+    "torch",
+    "umap",
+]
+# seconds, override with MUSEX_IMPORT_BUDGET
+BUDGET = float(os.environ.get("MUSEX_IMPORT_BUDGET", 1.5))
+
+
+def import_profile(module):
+    """ Import a module in a new interpreter, returns the total import time in
+    seconds, the per module (name, self, cumulative) times in seconds in import
+    order and the names of all loaded modules
+    """
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        # the backend folder, so that infovis21 can be imported
+        cwd=Path(__file__).parent.parent,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    total = sum(m[1] for m in modules)
+    loaded = json.loads(result.stdout.splitlines()[-1])
+    return total, modules, loaded
+
+
+def heavy_modules(loaded):
+    return sorted({name.split(".")[0] for name in loaded} & set(HEAVY_MODULES))
+
+
+def report(module, budget=BUDGET, top=15, repeat=3):
+    """ Print the slowest packages and modules of an import, the fastest of repeat
+    runs is reported. Returns whether the import stayed within the budget.
+    """
+    runs = [import_profile(module) for _ in range(repeat)]
+    total, modules, loaded = min(runs, key=lambda r: r[0])
+
+    packages = dict()
+    for name, self_time, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_time
+
+    print(f"import {module}: {total:.3f}s (budget {budget:.3f}s)")
+    print(f"{'package':>30} {'seconds':>8}")
+    for package, seconds in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+        print(f"{package:>30} {seconds:>8.3f}")
+    print(f"{'module':>30} {'self':>8} {'cumul.':>8}")
+    for name, self_time, cumulative in sorted(modules, key=lambda m: -m[1])[:top]:
+        print(f"{name:>30} {self_time:>8.3f} {cumulative:>8.3f}")
+
+    heavy = heavy_modules(loaded)
+    if heavy:
+        print("heavy modules on the serving path:", ", ".join(heavy))
+    return total <= budget
+
+
+def run(modules=SERVING_MODULES, budget=BUDGET, top=15, repeat=3):
+    """ Report all modules, returns the modules that exceeded the budget """
+    over = []
+    for module in modules:
+        if not report(module, budget=budget, top=top, repeat=repeat):
+            over.append(module)
+        print()
+    return over
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run() else 0)
@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from pymongo import AsyncMongoClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, Response
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags
+
+from infovis21 import columnar, previews, views
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import connection, tiles
+
+# Asyncio server mode, serves the same routes as the Flask app with
+# uvicorn infovis21.asgi:app
+#
+# MongoDB is queried with the non-blocking driver, so a worker keeps serving
+# other requests while it waits for the database. The query and result functions
+# of infovis21.views are shared with the Flask views. Work that holds the CPU
+# (the v1 graph, /select, loading the feature store) runs on a bounded thread
+# pool instead of the event loop. Responses are not cached by infovis21.cache.
+EXECUTOR_WORKERS = min(4, os.cpu_count() or 1)
+
+executor = ThreadPoolExecutor(
+    max_workers=EXECUTOR_WORKERS, thread_name_prefix="musex-cpu"
+)
+_client = None
+pool_metrics = connection.PoolMetrics()
+
+
+def client():
+    """ Async MongoDB client, created on first use inside the running event loop """
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(
+            connection.settings()["MONGO_URI"],
+            event_listeners=[pool_metrics],
+            **connection.client_options(),
+        )
+    return _client
+
+
+def async_collection(collection):
+    """ Async counterpart of a (synchronous) pymongo collection """
+    return client()[collection.database.name][collection.name]
+
+
+async def aggregate(collection, pipeline):
+    cursor = await async_collection(collection).aggregate(pipeline)
+    return await cursor.to_list(None)
+
+
+async def run_cpu(func, *args, **kwargs):
+    """ Run CPU heavy work on the bounded executor """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+class JSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return json.dumps(content, default=columnar._json_default).encode("utf-8")
+
+
+def respond(request, d):
+    """ Serialize a response dict in the format that the client asked for """
+    fmt = columnar.negotiate(
+        request.query_params.get("format"),
+        parse_accept_header(request.headers.get("accept"), MIMEAccept),
+    )
+    if fmt == "columnar":
+        response = Response(columnar.encode(d), media_type=columnar.MIMETYPE)
+    else:
+        response = JSONResponse(d)
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+def read_endpoint(query, result):
+    """ Endpoint for a query and result function pair of infovis21.views """
+
+    async def endpoint(request):
+        collection, pipeline, d = query(request.query_params)
+        return JSONResponse(result(d, await aggregate(collection, pipeline)))
+
+    return endpoint
+
+
+async def dimensions(request):
+    return JSONResponse(views.dimensions())
+
+
+async def most_popular(request):
+    q = views.most_popular_query(request.query_params)
+    return JSONResponse(await run_cpu(views.most_popular_result, q))
+
+
+async def search(request):
+    q = views.search_query(request.query_params)
+    return respond(request, await run_cpu(views.search_result, q))
+
+
+async def suggest(request):
+    q = views.suggest_query(request.query_params)
+    return JSONResponse(await run_cpu(views.suggest_result, q))
+
+
+async def select(request):
+    q = views.select_query(request.path_params["version"], request.query_params)
+    visible_ids = None
+    viewport = q["viewport"]
+    if viewport is not None and viewport["version"] == "v2":
+        nodes = await aggregate(
+            tiles.nodes_collection(), views.visible_nodes_pipeline(viewport)
+        )
+        visible_ids = [node["id"] for node in nodes]
+    return JSONResponse(await run_cpu(views.select_result, q, visible_ids))
+
+
+async def graph(request):
+    version = request.path_params["version"]
+    q = views.graph_query(version, request.query_params)
+    viewport = q.pop("viewport")
+    if version == "v2":
+        d = views.graph_header(**q)
+        bounds, node_pipeline, link_pipeline = views.graph_2_pipelines(**q)
+        nodes, links = await asyncio.gather(
+            aggregate(tiles.nodes_collection(), node_pipeline),
+            aggregate(tiles.links_collection(), link_pipeline),
+        )
+        links = tiles.crossing_links(links, q["dimx"], q["dimy"], *bounds)
+        d.update({"nodes": nodes, "links": links})
+    else:
+        d = await run_cpu(views.graph_impl_1, **q)
+    d["viewport"] = viewport
+    return respond(request, d)
+
+
+async def metrics(request):
+    """ Pool metrics of the async client and the synchronous one (feature store) """
+    return JSONResponse(
+        {"mongo": connection.metrics(), "mongo_async": pool_metrics.snapshot()}
+    )
+
+
+async def graph_tiles(request):
+    return JSONResponse(views.graph_tiles(request.query_params))
+
+
+async def graph_tile(request):
+    p = request.path_params
+    d, node_pipeline, link_pipeline = views.graph_tile_query(
+        p["dimx"], p["dimy"], p["typ"], p["z"], p["tx"], p["ty"]
+    )
+    d["nodes"], d["links"] = await asyncio.gather(
+        aggregate(tiles.nodes_collection(), node_pipeline),
+        aggregate(tiles.links_collection(), link_pipeline),
+    )
+    return respond(request, d)
+
+
+async def preview(request):
+    """ The cached mp3 preview of a track, with range requests. Servers that
+    support the pathsend extension send the file without copying it
+    """
+    track_id = request.path_params["track_id"]
+    path = views.cached_preview(track_id)
+    if path is None:
+        tracks = await aggregate(ma.coll_tracks, views.preview_url_pipeline(track_id))
+        # downloading is not CPU work, it does not take a slot of the executor
+        path = await asyncio.to_thread(views.fetch_preview, track_id, tracks)
+    stat_result = path.stat()
+    tag = previews.etag(stat_result)
+    headers = {
+        "Cache-Control": f"public, max-age={previews.MAX_AGE}, immutable",
+        "ETag": f'"{tag}"',
+    }
+    if parse_etags(request.headers.get("if-none-match")).contains(tag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        path, media_type=previews.MIMETYPE, headers=headers, stat_result=stat_result
+    )
+
+
+async def http_error(request, e):
+    """ Errors raised with flask.abort by the shared query functions """
+    return JSONResponse({"error": str(e)}, status_code=e.code)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+routes = [
+    Route("/{version}/dimensions", dimensions),
+    Route("/{version}/search", search),
+    Route("/{version}/suggest", suggest),
+    Route("/{version}/labels", read_endpoint(views.labels_query, views.labels_result)),
+    Route("/{version}/most_popular", most_popular),
+    Route(
+        "/{version}/artists", read_endpoint(views.artists_query, views.artists_result)
+    ),
+    Route("/{version}/genres", read_endpoint(views.genres_query, views.genres_result)),
+    Route("/{version}/years", read_endpoint(views.years_query, views.years_result)),
+    Route("/{version}/select", select),
+    Route("/{version}/graph", graph),
+    Route("/{version}/graph/tiles", graph_tiles),
+    Route("/{version}/metrics", metrics),
+    Route(
+        "/{version}/graph/tile/{dimx}/{dimy}/{typ}/{z:int}/{tx:int}/{ty:int}",
+        graph_tile,
+    ),
+    Route("/{version}/preview/{track_id}", preview),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"])],
+    exception_handlers={HTTPException: http_error},
+    lifespan=lifespan,
+)
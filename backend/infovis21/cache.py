@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+from infovis21.mongodb import MongoAccess as ma
+
+# Responses of read mostly views are cached per path and normalized query
+# parameters. The cache is bounded by an LRU and every entry remembers the dataset
+# version it was computed for, entries of an older version are never served.
+MAX_ENTRIES = 512
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+
+def dataset_version():
+    """ Current dataset version stamp, read from MongoDB at most every ma.VERSION_TTL.
+    The in-memory data the views render from follows it, see ma.current_dataset_version
+    """
+    return ma.current_dataset_version()
+
+
+def cache_key():
+    """ Path, query parameters and Accept header of the current request, independent
+    of the order of the parameters and ignoring empty ones
+    """
+    args = tuple(
+        sorted(
+            (key, tuple(value.strip() for value in values))
+            for key, values in request.args.lists()
+            if any(value.strip() for value in values)
+        )
+    )
+    # responses can be negotiated with the Accept header
+    return request.path, args, request.headers.get("Accept")
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def _lookup(key, version):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry["version"] != version:
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def _store(key, entry):
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def _response(entry):
+    response = Response(
+        entry["body"], status=entry["status"], mimetype=entry["mimetype"]
+    )
+    response.set_etag(entry["etag"])
+    response.last_modified = entry["last_modified"]
+    # clients may keep the response but have to revalidate it, which is cheap
+    response.cache_control.no_cache = True
+    response.vary.add("Accept")
+    return response.make_conditional(request)
+
+
+def cached(view):
+    """ Cache the responses of a view until the dataset version changes and answer
+    conditional requests (If-None-Match, If-Modified-Since) with 304
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        stamp = dataset_version()
+        key = cache_key()
+        entry = _lookup(key, stamp["version"])
+        if entry is None:
+            stats["misses"] += 1
+            response = view(*args, **kwargs)
+            if not isinstance(response, Response) or response.status_code != 200:
+                return response
+            body = response.get_data()
+            entry = {
+                "version": stamp["version"],
+                "body": body,
+                "status": response.status_code,
+                "mimetype": response.mimetype,
+                "etag": stamp["version"][:12] + "-" + hashlib.sha1(body).hexdigest(),
+                "last_modified": stamp["updated_at"],
+            }
+            _store(key, entry)
+        else:
+            stats["hits"] += 1
+
+        response = _response(entry)
+        if response.status_code == 304:
+            stats["not_modified"] += 1
+        return response
+
+    return wrapper
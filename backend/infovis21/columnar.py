@@ -0,0 +1,201 @@
+import json
+import math
+import struct
+
+import numpy as np
+from flask import Response, abort, jsonify, request
+
+# Compact binary encoding of the responses of /graph and /search, selected with
+# format=columnar or an Accept header that prefers MIMETYPE over JSON.
+#
+# Layout (little endian):
+#   b"MXC1" | uint32 header length | header (UTF-8 JSON) | padding | buffers
+#
+# Lists of objects (nodes, links, matches) become tables with one column per key.
+# Numbers are packed float32 arrays (NaN for missing values), strings are int32
+# indices into a shared string table (-1 for missing values) and lists of strings
+# are a uint32 offsets array plus an int32 values array, values of row i are
+# values[offsets[i]:offsets[i + 1]]. Everything else stays JSON in the header.
+# Buffers start at multiples of 4 bytes relative to the first buffer so that they
+# can be viewed as typed arrays directly.
+MIMETYPE = "application/vnd.musex.columnar"
+MAGIC = b"MXC1"
+FORMATS = ["json", "columnar"]
+
+
+class _Strings:
+    """ Shared string table, every distinct string is stored once """
+
+    def __init__(self):
+        self.strings = []
+        self.index = dict()
+
+    def get(self, value):
+        if value is None:
+            return -1
+        idx = self.index.get(value)
+        if idx is None:
+            idx = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return idx
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(
+        value, (bool, np.bool_)
+    )
+
+
+def _kind(values):
+    """ Column type for the values of a key, None values are allowed in all types """
+    present = [v for v in values if v is not None]
+    if all(_is_number(v) for v in present):
+        return "float32"
+    if all(isinstance(v, str) for v in present):
+        return "string"
+    if all(isinstance(v, list) and all(isinstance(s, str) for s in v) for v in present):
+        return "strings"
+    return "json"
+
+
+def _is_table(value):
+    return isinstance(value, list) and all(isinstance(v, dict) for v in value)
+
+
+def encode(d):
+    """ Encode a response dict, lists of objects are stored as columnar tables """
+    strings = _Strings()
+    buffers = []
+    offset = 0
+
+    def add_buffer(array):
+        nonlocal offset
+        data = array.tobytes()
+        buffers.append(data + b"\0" * (-len(data) % 4))
+        start = offset
+        offset += len(buffers[-1])
+        return {"offset": start, "length": len(array)}
+
+    meta, tables = dict(), dict()
+    for key, value in d.items():
+        if not _is_table(value) or len(value) == 0:
+            meta[key] = value
+            continue
+
+        keys = list(dict.fromkeys(k for row in value for k in row))
+        columns = []
+        for name in keys:
+            values = [row.get(name) for row in value]
+            kind = _kind(values)
+            column = {"name": name, "type": kind}
+            if kind == "float32":
+                column.update(
+                    add_buffer(
+                        np.array(
+                            [np.nan if v is None else v for v in values],
+                            dtype="<f4",
+                        )
+                    )
+                )
+            elif kind == "string":
+                column.update(
+                    add_buffer(np.array([strings.get(v) for v in values], dtype="<i4"))
+                )
+            elif kind == "strings":
+                lengths = [len(v or []) for v in values]
+                offsets = np.zeros(len(values) + 1, dtype="<u4")
+                offsets[1:] = np.cumsum(lengths)
+                flat = [strings.get(s) for v in values for s in v or []]
+                column["offsets"] = add_buffer(offsets)
+                column["values"] = add_buffer(np.array(flat, dtype="<i4"))
+            else:
+                column["values"] = values
+            columns.append(column)
+        tables[key] = {"length": len(value), "columns": columns}
+
+    header = json.dumps(
+        {"meta": meta, "strings": strings.strings, "tables": tables},
+        separators=(",", ":"),
+        default=_json_default,
+    ).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 4)
+    return b"".join([MAGIC, struct.pack("<I", len(header)), header] + buffers)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def decode(data):
+    """ Decode an encoded response back into the dict that encode was given,
+    numbers come back as (float32 precision) floats and missing lists of strings
+    as empty lists
+    """
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError("not a columnar response")
+    (length,) = struct.unpack_from("<I", data, len(MAGIC))
+    start = len(MAGIC) + 4
+    header = json.loads(data[start : start + length].decode("utf-8"))
+    body = memoryview(data)[start + length :]
+    strings = header["strings"]
+
+    def view(ref, dtype):
+        if ref["length"] == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.frombuffer(
+            body, dtype=dtype, count=ref["length"], offset=ref["offset"]
+        )
+
+    d = dict(header["meta"])
+    for key, table in header["tables"].items():
+        rows = [dict() for _ in range(table["length"])]
+        for column in table["columns"]:
+            name, kind = column["name"], column["type"]
+            if kind == "float32":
+                values = [
+                    None if math.isnan(v) else v for v in view(column, "<f4").tolist()
+                ]
+            elif kind == "string":
+                values = [strings[i] if i >= 0 else None for i in view(column, "<i4")]
+            elif kind == "strings":
+                offsets = view(column["offsets"], "<u4")
+                flat = [strings[i] for i in view(column["values"], "<i4")]
+                values = [flat[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            else:
+                values = column["values"]
+            for row, value in zip(rows, values):
+                row[name] = value
+        d[key] = rows
+    return d
+
+
+def negotiate(fmt, accept_mimetypes):
+    """ Response format for a format parameter and the parsed Accept header, the
+    format parameter wins over the Accept header and JSON is the default
+    """
+    if fmt:
+        if fmt not in FORMATS:
+            abort(400, description=f"format needs to be one of {FORMATS}")
+        return fmt
+    best = accept_mimetypes.best_match(["application/json", MIMETYPE])
+    return "columnar" if best == MIMETYPE else "json"
+
+
+def requested_format():
+    """ Response format of the current request, see negotiate """
+    return negotiate(request.args.get("format"), request.accept_mimetypes)
+
+
+def respond(d):
+    """ Serialize a response dict in the format that the client asked for """
+    fmt = requested_format()
+    if fmt == "columnar":
+        response = Response(encode(d), mimetype=MIMETYPE)
+    else:
+        response = jsonify(d)
+    response.vary.add("Accept")
+    return response
@@ -0,0 +1,117 @@
+import itertools
+
+import numpy as np
+
+from infovis21.mongodb import MongoAccess as ma
+
+LINK_MODES = ["clique", "star", "chain", "knn"]
+DEFAULT_LINK_MODE = "clique"
+DEFAULT_LINK_BUDGET = 10_000
+DEFAULT_KNN = 2
+KNN_CHUNK = 512
+
+
+def _clique(members, table, dimx, dimy, k, limit):
+    """ All pairs of members, the original behaviour """
+    return list(itertools.islice(itertools.combinations(members, 2), limit))
+
+
+def _star(members, table, dimx, dimy, k, limit):
+    """ Connect every member to the most popular member of the group """
+    popularity = table.column("popularity")[members]
+    order = np.argsort(-np.nan_to_num(popularity, nan=-np.inf), kind="stable")
+    center = members[order[0]]
+    return [(center, members[i]) for i in order[1:][:limit]]
+
+
+def _chain(members, table, dimx, dimy, k, limit):
+    """ Connect the members in the order of their dimx value """
+    order = np.argsort(table.column(dimx)[members], kind="stable")
+    chain = members[order]
+    return list(itertools.islice(zip(chain[:-1], chain[1:]), limit))
+
+
+def _knn(members, table, dimx, dimy, k, limit):
+    """ Connect every member to its k nearest neighbours inside the group """
+    k = min(k, len(members) - 1)
+    # compare positions in normalized space, the dimensions have different ranges
+    points = np.stack(
+        [
+            (table.column(dim)[members] - ma.dim_minmax[dim]["min"])
+            / ((ma.dim_minmax[dim]["max"] - ma.dim_minmax[dim]["min"]) or 1)
+            for dim in (dimx, dimy)
+        ],
+        axis=1,
+    ).astype(np.float32)
+    ranked = []
+    for start in range(0, len(points), KNN_CHUNK):
+        block = points[start : start + KNN_CHUNK]
+        dist = ((block[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+        dist[np.arange(len(block)), np.arange(start, start + len(block))] = np.inf
+        nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        for i, neighbours in enumerate(nearest):
+            for j in neighbours:
+                ranked.append((dist[i, j], start + i, j))
+    # closest pairs first, every undirected pair only once
+    edges, seen = [], set()
+    for _, i, j in sorted(ranked):
+        pair = (min(i, j), max(i, j))
+        if pair not in seen:
+            seen.add(pair)
+            edges.append((members[i], members[j]))
+    return edges[:limit]
+
+
+builders = {
+    "clique": _clique,
+    "star": _star,
+    "chain": _chain,
+    "knn": _knn,
+}
+
+
+def build_links(
+    groups,
+    table,
+    dimx,
+    dimy,
+    mode=DEFAULT_LINK_MODE,
+    budget=DEFAULT_LINK_BUDGET,
+    k=DEFAULT_KNN,
+):
+    """ Turn label groups (label -> rows of the feature table) into links.
+
+    Every group becomes a bounded structure depending on the mode. If there are
+    more links than the budget allows, the groups take turns so that every label
+    keeps its most important links. Returns the links and the number of links
+    elided compared to connecting all members of a label with each other.
+    """
+    build = builders[mode]
+    per_group = []
+    n_all_pairs = 0
+    for members in groups.values():
+        members = np.asarray(members)
+        n_all_pairs += len(members) * (len(members) - 1) // 2
+        if len(members) > 1:
+            # a single group can never contribute more links than the budget
+            per_group.append(build(members, table, dimx, dimy, k, budget))
+
+    # round robin over the groups, the first edges of each group are the important ones
+    ranked = [
+        (rank, group, edge)
+        for group, edges in enumerate(per_group)
+        for rank, edge in enumerate(edges)
+    ]
+    ranked.sort(key=lambda r: (r[0], r[1]))
+    if budget is not None:
+        ranked = ranked[:budget]
+
+    links = [
+        {
+            "src": table.ids[src],
+            "dest": table.ids[dest],
+            # "name": label["id"],
+        }
+        for _, _, (src, dest) in ranked
+    ]
+    return links, n_all_pairs - len(links)
@@ -0,0 +1,133 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+
+# Write operations of the ETL are buffered and sent to MongoDB in unordered
+# bulk writes of BATCH_SIZE operations instead of one round trip per document.
+BATCH_SIZE = 1000
+
+
+class BulkWriter:
+    """ Buffers insert, update and replace operations for one collection and
+    writes them with bulk_write whenever batch_size operations are buffered.
+    Use it as a context manager so that the last batch is written as well:
+
+        with BulkWriter(db["years_api"]) as writer:
+            for doc in docs:
+                writer.insert(doc)
+
+    With workers > 1 batches are written by that many threads, so that building
+    the next batch overlaps with writing the last ones (the order of the batches
+    is lost, seconds is the time spent writing summed over the threads).
+    """
+
+    def __init__(
+        self, collection, batch_size=BATCH_SIZE, ordered=False, verbose=True, workers=1
+    ):
+        if ordered and workers > 1:
+            raise ValueError("ordered writes can not be split over workers")
+        self.collection = collection
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.verbose = verbose
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(workers) if workers > 1 else None
+        self.pending = []
+        self._lock = threading.Lock()
+        self.ops = []
+        self.stats = {
+            "ops": 0,
+            "batches": 0,
+            "inserted": 0,
+            "matched": 0,
+            "modified": 0,
+            "upserted": 0,
+            "seconds": 0.0,
+        }
+
+    def add(self, op):
+        self.ops.append(op)
+        if len(self.ops) >= self.batch_size:
+            self.flush()
+
+    def insert(self, doc):
+        self.add(InsertOne(doc))
+
+    def update(self, filter, update, upsert=False):
+        self.add(UpdateOne(filter, update, upsert=upsert))
+
+    def replace(self, filter, doc, upsert=False):
+        self.add(ReplaceOne(filter, doc, upsert=upsert))
+
+    def _write(self, ops):
+        start = time.perf_counter()
+        result = self.collection.bulk_write(ops, ordered=self.ordered)
+        with self._lock:
+            self.stats["seconds"] += time.perf_counter() - start
+            self.stats["ops"] += len(ops)
+            self.stats["batches"] += 1
+            self.stats["inserted"] += result.inserted_count
+            self.stats["matched"] += result.matched_count
+            self.stats["modified"] += result.modified_count
+            self.stats["upserted"] += result.upserted_count
+
+    def flush(self):
+        """ Write the buffered operations """
+        if len(self.ops) == 0:
+            return
+        ops, self.ops = self.ops, []
+        if self.pool is None:
+            self._write(ops)
+            return
+        self.pending.append(self.pool.submit(self._write, ops))
+        # at most two batches per thread wait to be written
+        while len(self.pending) > 2 * self.workers:
+            self.pending.pop(0).result()
+
+    def _wait(self, raise_errors=True):
+        if self.pool is not None:
+            pending, self.pending = self.pending, []
+            try:
+                if raise_errors:
+                    for future in pending:
+                        future.result()
+                else:
+                    wait(pending)
+            finally:
+                self.pool.shutdown()
+
+    def close(self):
+        """ Write what is left and report the throughput, returns the stats """
+        self.flush()
+        self._wait()
+        if self.verbose:
+            s = self.stats
+            rate = s["ops"] / s["seconds"] if s["seconds"] > 0 else 0.0
+            print(
+                f"{self.collection.name}: {s['ops']} writes in {s['batches']} batches, "
+                f"{s['seconds']:.2f}s ({rate:.0f} writes/s)"
+            )
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # after an error only the operations that were written already count,
+        # errors of the workers must not hide the error that is raised
+        if exc_type is None:
+            self.close()
+        else:
+            self._wait(raise_errors=False)
+
+
+def insert_all(collection, docs, batch_size=BATCH_SIZE, verbose=True, workers=1):
+    """ Insert an iterable of documents in batches, returns the stats """
+    with BulkWriter(
+        collection, batch_size=batch_size, verbose=verbose, workers=workers
+    ) as writer:
+        for doc in docs:
+            writer.insert(doc)
+    return writer.stats
@@ -0,0 +1,332 @@
+import hashlib
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import bulk
+
+# The ETL as a graph of stages. A stage declares the collections it reads and
+# writes, inputs can also be files ("file:<path>"). A stage depends on the
+# stages that write its inputs and runs after them, stages that do not depend
+# on each other run concurrently.
+#
+# The content hashes of the inputs and outputs of every stage that finished are
+# kept in STATE_COLLECTION. A stage is skipped when its inputs and outputs did
+# not change since, so after a change only the stages downstream of it run, and
+# those whose inputs come out the same are skipped as well.
+STATE_COLLECTION = "etl_stages"
+WORKERS = 4
+
+RAN = "ran"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+class Stage:
+    """ fn() reads the inputs and (re)creates the outputs. An exclusive stage
+    runs while no other stage does, e.g. because it forks worker processes
+    """
+
+    def __init__(self, name, fn, inputs=(), outputs=(), exclusive=False):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.exclusive = exclusive
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+
+def dependencies(stages):
+    """ Names of the stages that every stage depends on """
+    producers = dict()
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(
+                    f"{output} is written by {producers[output]} and {stage.name}"
+                )
+            producers[output] = stage.name
+    return {
+        stage.name: {
+            producers[i]
+            for i in stage.inputs
+            if i in producers and producers[i] != stage.name
+        }
+        for stage in stages
+    }
+
+
+def plan(stages, targets=None):
+    """ The stages in dependency order, only the targets and the stages they
+    depend on if targets are given. Raises ValueError for cycles.
+    """
+    deps = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    if targets:
+        unknown = set(targets) - set(by_name)
+        if unknown:
+            raise ValueError(f"unknown stages: {', '.join(sorted(unknown))}")
+        needed, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo.extend(deps[name])
+        stages = [stage for stage in stages if stage.name in needed]
+
+    order, done = [], set()
+    while len(order) < len(stages):
+        ready = [s for s in stages if s.name not in done and deps[s.name] <= done]
+        if not ready:
+            left = sorted(s.name for s in stages if s.name not in done)
+            raise ValueError(f"cycle between the stages {', '.join(left)}")
+        for stage in ready:
+            order.append(stage)
+            done.add(stage.name)
+    return order
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def fingerprints(names):
+    """ Content hashes of collections (dbHash) and files, None for the ones that do not exist """
+    collections = [name for name in names if not name.startswith("file:")]
+    hashes = dict()
+    if collections:
+        hashes = ma.db.command("dbHash", collections=collections)["collections"]
+    return {
+        name: (
+            file_hash(name[len("file:") :])
+            if name.startswith("file:")
+            else hashes.get(name)
+        )
+        for name in names
+    }
+
+
+def run(stages, targets=None, workers=WORKERS, force=(), fingerprint=None, state=None):
+    """ Run the stages that are out of date, returns one report entry per stage.
+    force names stages that run even if they are up to date, True forces all.
+    """
+    fingerprint = fingerprint or fingerprints
+    state = state if state is not None else ma.db[STATE_COLLECTION]
+    order = plan(stages, targets)
+    deps = dependencies(order)
+    last = {doc["_id"]: doc for doc in state.find({})}
+
+    def execute(stage):
+        start = time.perf_counter()
+        inputs = fingerprint(stage.inputs)
+        previous = last.get(stage.name)
+        if (
+            force is not True
+            and stage.name not in force
+            and previous is not None
+            and previous.get("inputs") == inputs
+            and previous.get("outputs") == fingerprint(stage.outputs)
+        ):
+            return SKIPPED, time.perf_counter() - start
+        stage.fn()
+        doc = {
+            "inputs": inputs,
+            "outputs": fingerprint(stage.outputs),
+            "seconds": time.perf_counter() - start,
+            "finished_at": datetime.now(),
+        }
+        state.replace_one({"_id": stage.name}, doc, upsert=True)
+        return RAN, doc["seconds"]
+
+    start = time.perf_counter()
+    report = {stage.name: {"stage": stage.name, "status": None} for stage in order}
+    pending = list(order)
+    running = dict()
+
+    def finish(future):
+        name = running.pop(future)
+        entry = report[name]
+        try:
+            entry["status"], entry["seconds"] = future.result()
+        except Exception as e:
+            entry["status"], entry["error"] = FAILED, repr(e)
+        entry["finished"] = time.perf_counter() - start
+        print(f"{name}: {entry['status']} ({entry.get('seconds', 0):.1f}s)")
+
+    def exclusive():
+        return any(by_name[name].exclusive for name in running.values())
+
+    by_name = {stage.name: stage for stage in order}
+    with ThreadPoolExecutor(workers) as pool:
+        while pending or running:
+            for stage in list(pending):
+                statuses = {report[dep]["status"] for dep in deps[stage.name]}
+                if statuses & {FAILED, BLOCKED}:
+                    report[stage.name]["status"] = BLOCKED
+                    pending.remove(stage)
+                elif statuses <= {RAN, SKIPPED} and not exclusive():
+                    if stage.exclusive and running:
+                        continue
+                    running[pool.submit(execute, stage)] = stage.name
+                    pending.remove(stage)
+            if running:
+                for future in wait(running, return_when=FIRST_COMPLETED)[0]:
+                    finish(future)
+    entries = [report[stage.name] for stage in order]
+    print_report(entries, time.perf_counter() - start)
+    return entries
+
+
+def print_report(entries, wall):
+    """ Per stage timings, longest first """
+    print(f"{'stage':>30} {'status':>8} {'seconds':>8} {'done at':>8}")
+    for entry in sorted(entries, key=lambda e: -e.get("seconds", 0)):
+        print(
+            f"{entry['stage']:>30} {entry['status']:>8} "
+            f"{entry.get('seconds', 0):>8.1f} {entry.get('finished', 0):>8.1f}"
+        )
+    busy = sum(entry.get("seconds", 0) for entry in entries)
+    counts = {
+        status: sum(entry["status"] == status for entry in entries)
+        for status in [RAN, SKIPPED, FAILED, BLOCKED]
+    }
+    print(
+        f"{wall:.1f}s wall clock, {busy:.1f}s in stages, "
+        + ", ".join(f"{n} {status}" for status, n in counts.items())
+    )
+
+
+def etl_stages(csv="../data/kaggle/data.csv", workers=None):
+    """ The stages from the kaggle csv up to the precomputed layers """
+    # ETL only dependencies, the api does not need them
+    import dotenv
+
+    from infovis21.mongodb import enrich, incremental, popularity, precompute, tiles
+    from infovis21.mongodb import utils as dbutils
+
+    dotenv.load_dotenv()
+    db = ma.db
+    workers = workers or enrich.WORKERS
+    # the stages that fetch from Spotify share the rate limit
+    backoff = enrich.Backoff()
+
+    def tracks():
+        # rows of the csv that are new or changed lose their Spotify data,
+        # the others keep it so that only what changed is fetched again
+        df = ma.read_kaggle_csv(csv)
+        stored = {
+            doc["csv_id"]: doc.get("content_hash")
+            for doc in db["tracks"].find({}, {"csv_id": 1, "content_hash": 1})
+            if "csv_id" in doc
+        }
+        changed, removed = incremental.diff_tracks(
+            dict(zip(df["csv_id"], df["content_hash"])), stored
+        )
+        db["tracks"].delete_many({"csv_id": {"$in": changed + removed}})
+        db["tracks"].delete_many({"csv_id": {"$exists": False}})
+        rows = df[df["csv_id"].isin(changed)].to_dict("records")
+        bulk.insert_all(db["tracks"], rows)
+        db["tracks"].create_index("id")
+        db["tracks"].create_index("csv_id")
+        enrich.enrich_tracks(enrich.spotify_client(), db, workers, backoff)
+        ma.save_track_hashes()
+
+    def albums():
+        enrich.enrich_albums(enrich.spotify_client(), db, workers, backoff)
+        db["albums"].create_index("id")
+        ma.create_albums_merged()
+
+    def artists():
+        enrich.enrich_artists(enrich.spotify_client(), db, workers, backoff)
+        db["artists"].create_index("id")
+        ma.create_artists_with_genres()
+
+    def popularity_per_year():
+        for kind, out, use_super in incremental.POPULARITY_PER_YEAR:
+            compute = getattr(dbutils, f"compute_{kind}_popularity_per_year")
+            compute(out=out, use_super_genre=use_super)
+        dbutils.add_genre_super_info("genre", "genre", "name")
+        dbutils.add_genre_super_info("artist", "artist", "id")
+
+    def layers():
+        # the ledger of precompute decides which layers are out of date (source
+        # version) or missing from the tile store, the others are kept
+        types = ["genre", "artist", "track"]
+        zooms = range(dbutils.N_ZOOM_LEVELS)
+        jobs = precompute.plan_jobs(ma.dimensions, ma.dimensions, types, zooms)
+        precompute.run(jobs, resume=True)
+
+    per_year = [out for _, out, _ in incremental.POPULARITY_PER_YEAR]
+    api = ["tracks_api", "artists_api", "genres_api"]
+    return [
+        Stage("tracks", tracks, [f"file:{csv}"], ["tracks", "track_hashes"]),
+        Stage("albums", albums, ["tracks"], ["albums", "albums_merged"]),
+        Stage(
+            "tracks_spotipy_merged",
+            ma.create_tracks_spotipy_merged,
+            ["tracks"],
+            ["tracks_spotipy_merged"],
+        ),
+        Stage("artists", artists, ["tracks"], ["artists", "artists_with_genres"]),
+        Stage(
+            "tracks_with_genres",
+            ma.create_tracks_with_genres,
+            ["tracks_spotipy_merged", "artists_with_genres"],
+            ["tracks_with_genres"],
+        ),
+        Stage(
+            "tracks_full",
+            ma.create_tracks_full,
+            ["tracks_with_genres", "albums_merged"],
+            ["tracks_full"],
+        ),
+        Stage(
+            "artists_full",
+            ma.create_artists_full,
+            ["artists_with_genres", "tracks_full"],
+            ["artists_full"],
+        ),
+        Stage("genres_full", ma.create_genres_full, ["tracks_full"], ["genres_full"]),
+        Stage("years_full", ma.create_years_full, ["tracks_full"], ["years_full"]),
+        Stage("labels_full", ma.create_labels_full, ["tracks_full"], ["labels_full"]),
+        Stage("years_api", ma.create_years_api, ["years_full"], ["years_api"]),
+        Stage("genres_api", ma.create_genres_api, ["genres_full"], ["genres_api"]),
+        Stage("artists_api", ma.create_artists_api, ["artists_full"], ["artists_api"]),
+        Stage(
+            "tracks_api",
+            dbutils.update_tracks_api_to_include_artists,
+            ["tracks_full", "genres_full"],
+            ["tracks_api"],
+        ),
+        Stage("labels_api", ma.create_labels_api, ["labels_full"], ["labels_api"]),
+        Stage("dim_minmax", ma.update_dim_minmax, ["tracks_api"], ["dim_minmax"]),
+        Stage("popularity_per_year", popularity_per_year, api, per_year),
+        Stage(
+            "most_popular",
+            popularity.materialize,
+            per_year + ["tracks_api"],
+            ["most_popular_per_year", "popularity_per_year_matrix"],
+        ),
+        Stage(
+            "precompute",
+            layers,
+            api + ["dim_minmax"],
+            [
+                precompute.JOBS_COLLECTION,
+                tiles.NODES_COLLECTION,
+                tiles.LINKS_COLLECTION,
+            ],
+            exclusive=True,
+        ),
+    ]
@@ -0,0 +1,258 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+import requests
+import spotipy
+from pymongo import ReplaceOne, UpdateOne
+from spotipy.exceptions import SpotifyException
+from spotipy.oauth2 import SpotifyClientCredentials
+
+# Spotify data for the tracks of the kaggle dataset, their albums and artists.
+# Ids are fetched with the multi id endpoints by a pool of threads and every
+# batch is written with one bulk write as soon as it arrives. What has been
+# written is the checkpoint: a restarted run only fetches the ids that are not
+# enriched yet, ids that Spotify does not know are remembered in UNKNOWN_COLLECTION.
+BATCH_SIZES = {"tracks": 50, "albums": 20, "artists": 50}
+WORKERS = 4
+# retries of a request that was rate limited or failed on the server side
+MAX_RETRIES = 8
+# seconds, doubled for every retry when Spotify does not send Retry-After
+BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+UNKNOWN_COLLECTION = "spotify_unknown_ids"
+
+ALBUM_FIELDS = [
+    "id",
+    "album_type",
+    "genres",
+    "label",
+    "name",
+    "popularity",
+    "release_date",
+    "release_date_precision",
+    "total_tracks",
+    "type",
+]
+
+
+def spotify_client(prefix=None, auth=None, workers=WORKERS):
+    """ Spotify client without retries of its own, see Backoff. prefix and auth
+    (a bearer token) point it to another server, e.g. a stub in the tests
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if auth is None:
+        sp = spotipy.Spotify(
+            client_credentials_manager=SpotifyClientCredentials(),
+            requests_session=session,
+            requests_timeout=100,
+        )
+    else:
+        sp = spotipy.Spotify(auth=auth, requests_session=session, requests_timeout=100)
+    if prefix:
+        sp.prefix = prefix
+    return sp
+
+
+class Backoff:
+    """ Retries api calls that were rate limited or failed. The rate limit is per
+    application, so when Spotify answers 429 all threads wait for Retry-After
+    before their next request
+    """
+
+    def __init__(self, retries=MAX_RETRIES, backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.resume_at = 0.0
+        self.stats = {"requests": 0, "rate_limited": 0, "retried": 0}
+
+    def delay(self, attempt):
+        return min(self.max_backoff, self.backoff * 2**attempt) * random.uniform(0.5, 1)
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def call(self, fn, *args):
+        for attempt in range(self.retries + 1):
+            pause = self.resume_at - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            self._count("requests")
+            try:
+                return fn(*args)
+            except SpotifyException as e:
+                if attempt == self.retries:
+                    raise
+                if e.http_status == 429:
+                    self._count("rate_limited")
+                    retry_after = (e.headers or {}).get("Retry-After")
+                    delay = (
+                        float(retry_after)
+                        if retry_after is not None
+                        else self.delay(attempt)
+                    )
+                    with self._lock:
+                        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+                elif e.http_status >= 500:
+                    time.sleep(self.delay(attempt))
+                else:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.delay(attempt))
+            self._count("retried")
+
+
+def run_batches(kind, ids, fetch, write, workers=WORKERS, backoff=None):
+    """ Fetch the ids in batches of BATCH_SIZES[kind] with a pool of threads.
+    write(ids, items) is called in this thread for every batch as it arrives,
+    items are the results of fetch(ids) in the same order (None for unknown ids).
+    At most two batches per thread are in flight. Returns the number of batches.
+    """
+    backoff = backoff or Backoff()
+    size = BATCH_SIZES[kind]
+    batches = [ids[i : i + size] for i in range(0, len(ids), size)]
+    if len(batches) == 0:
+        return 0
+    print(f"fetching {len(ids)} {kind} in {len(batches)} batches")
+    start = time.time()
+    done = 0
+
+    def report(finished):
+        nonlocal done
+        for future in finished:
+            write(in_flight.pop(future), future.result())
+            done += 1
+            if done % 100 == 0 or done == len(batches):
+                rate = done / (time.time() - start)
+                eta = timedelta(seconds=round((len(batches) - done) / rate))
+                print(
+                    f"[{done}/{len(batches)}] {kind} ({rate * 60:.0f} batches/min, "
+                    f"ETA {eta}, {backoff.stats['rate_limited']} rate limited)"
+                )
+
+    in_flight = dict()
+    with ThreadPoolExecutor(workers) as pool:
+        for batch in batches:
+            in_flight[pool.submit(backoff.call, fetch, batch)] = batch
+            if len(in_flight) >= 2 * workers:
+                report(wait(in_flight, return_when=FIRST_COMPLETED)[0])
+        while in_flight:
+            report(wait(in_flight, return_when=FIRST_COMPLETED)[0])
+    return len(batches)
+
+
+def unknown_ids(db, kind):
+    return {
+        doc["id"]
+        for doc in db[UNKNOWN_COLLECTION].find({"kind": kind}, {"id": 1, "_id": 0})
+    }
+
+
+def _write(db, collection, kind, ops, unknown):
+    if ops:
+        db[collection].bulk_write(ops, ordered=False)
+    if unknown:
+        db[UNKNOWN_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"kind": kind, "id": _id},
+                    {"$set": {"kind": kind, "id": _id, "at": datetime.now()}},
+                    upsert=True,
+                )
+                for _id in unknown
+            ],
+            ordered=False,
+        )
+
+
+def enrich_tracks(sp, db, workers=WORKERS, backoff=None, tracks="tracks"):
+    """ Add the Spotify track as field spotipy to the tracks that do not have it yet """
+    ids = [
+        doc["id"]
+        for doc in db[tracks].find({"spotipy": {"$exists": False}}, {"id": 1, "_id": 0})
+    ]
+
+    def fetch(batch):
+        return sp.tracks(batch)["tracks"]
+
+    def write(batch, items):
+        ops = []
+        for _id, track in zip(batch, items):
+            if track is not None:
+                track.pop("available_markets", None)
+                track.get("album", {}).pop("available_markets", None)
+            # unknown tracks get spotipy: null, so they are not fetched again
+            ops.append(UpdateOne({"id": _id}, {"$set": {"spotipy": track}}))
+        _write(db, tracks, "tracks", ops, [])
+
+    return run_batches("tracks", ids, fetch, write, workers=workers, backoff=backoff)
+
+
+def album_doc(album):
+    """ The fields of an album that are kept, tracks and artists only by id """
+    doc = {key: album.get(key) for key in ALBUM_FIELDS}
+    doc["artists"] = [{"id": artist["id"]} for artist in album["artists"]]
+    doc["tracks"] = [{"id": track["id"]} for track in album["tracks"]["items"]]
+    return doc
+
+
+def enrich_albums(
+    sp, db, workers=WORKERS, backoff=None, tracks="tracks", albums="albums"
+):
+    """ Fetch the albums of the enriched tracks that are not in albums yet """
+    backoff = backoff or Backoff()
+    ids = set(db[tracks].distinct("spotipy.album.id")) - {None}
+    ids = sorted(ids - set(db[albums].distinct("id")) - unknown_ids(db, "albums"))
+
+    def fetch(batch):
+        albums = sp.albums(batch)["albums"]
+        for album in albums:
+            # the first page of the tracks is included, albums with more tracks are rare
+            page = album["tracks"] if album is not None else {"next": None}
+            while page["next"]:
+                page = backoff.call(sp.next, page)
+                album["tracks"]["items"].extend(page["items"])
+        return albums
+
+    def write(batch, items):
+        ops = [
+            ReplaceOne({"id": album["id"]}, album_doc(album), upsert=True)
+            for album in items
+            if album is not None
+        ]
+        unknown = [_id for _id, album in zip(batch, items) if album is None]
+        _write(db, albums, "albums", ops, unknown)
+
+    return run_batches("albums", ids, fetch, write, workers=workers, backoff=backoff)
+
+
+def enrich_artists(
+    sp, db, workers=WORKERS, backoff=None, tracks="tracks", artists="artists"
+):
+    """ Fetch the artists of the enriched tracks that are not in artists yet """
+    ids = set(db[tracks].distinct("spotipy.artists.id")) - {None}
+    ids = sorted(ids - set(db[artists].distinct("id")) - unknown_ids(db, "artists"))
+
+    def fetch(batch):
+        return sp.artists(batch)["artists"]
+
+    def write(batch, items):
+        ops = [
+            ReplaceOne({"id": artist["id"]}, artist, upsert=True)
+            for artist in items
+            if artist is not None
+        ]
+        unknown = [_id for _id, artist in zip(batch, items) if artist is None]
+        _write(db, artists, "artists", ops, unknown)
+
+    return run_batches("artists", ids, fetch, write, workers=workers, backoff=backoff)
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import numpy as np
+
+from infovis21.mongodb import MongoAccess as ma
+
+# side tables that are kept next to the numeric feature columns
+side_fields = [
+    "id",
+    "name",
+    "preview_url",
+    "genres",
+    "labels",
+    "artists",
+    "genre_super",
+    "genre_color",
+]
+
+
+class FeatureTable:
+    """ Columnar in-memory copy of one of the {genre,artist,track}_api collections """
+
+    def __init__(self, typ, docs):
+        self.typ = typ
+        n = len(docs)
+        self.ids = np.array([doc.get("id") for doc in docs], dtype=object)
+        self.names = np.array([doc.get("name") for doc in docs], dtype=object)
+        self.preview_urls = np.array(
+            [doc.get("preview_url") for doc in docs], dtype=object
+        )
+        self.colors = np.array([doc.get("genre_color") for doc in docs], dtype=object)
+        self.genre_super = np.array(
+            [doc.get("genre_super") for doc in docs], dtype=object
+        )
+        self.genres = [doc.get("genres") for doc in docs]
+        self.artists = [doc.get("artists") for doc in docs]
+        self.labels = [ma.single_to_list(doc.get("labels") or []) for doc in docs]
+
+        # one contiguous float32 column per dimension, missing values become NaN so
+        # that they never match a range filter (just like $gte/$lte in MongoDB)
+        self.columns = dict()
+        for dim in ma.dimensions:
+            self.columns[dim] = np.fromiter(
+                (np.nan if doc.get(dim) is None else doc[dim] for doc in docs),
+                dtype=np.float32,
+                count=n,
+            )
+
+        self.row_by_id = {_id: row for row, _id in enumerate(self.ids)}
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, dim):
+        return self.columns[dim]
+
+    def rows(self, ids):
+        """ Map node ids to row indices, unknown ids are skipped """
+        return np.array(
+            [self.row_by_id[_id] for _id in ids if _id in self.row_by_id],
+            dtype=np.int64,
+        )
+
+    def viewport(self, dimx, dimy, x_min, x_max, y_min, y_max):
+        """ Return the rows whose (dimx, dimy) values fall inside the given ranges """
+        xs, ys = self.columns[dimx], self.columns[dimy]
+        mask = (xs >= x_min) & (xs <= x_max) & (ys >= y_min) & (ys <= y_max)
+        return np.flatnonzero(mask)
+
+    def distances(self, rows, dimx, dimy, x, y):
+        """ Squared distance of the given rows to (x, y) in MongoDB space """
+        dx = self.columns[dimx][rows] - np.float32(x)
+        dy = self.columns[dimy][rows] - np.float32(y)
+        return dx * dx + dy * dy
+
+    def nearest(self, rows, dimx, dimy, x, y, k=None):
+        """ Order rows by distance to (x, y), only the k closest are sorted if k is given """
+        dist = self.distances(rows, dimx, dimy, x, y)
+        if k is not None and k < len(rows):
+            part = np.argpartition(dist, k)[:k]
+            order = part[np.argsort(dist[part], kind="stable")]
+        else:
+            order = np.argsort(dist, kind="stable")
+        return rows[order], dist[order]
+
+    def node(self, row, dimx, dimy, dist=None):
+        """ Build the node document that the graph endpoint returns for a row """
+        node = {
+            "id": self.ids[row],
+            "dimx": dimx,
+            "dimy": dimy,
+            "x": float(self.columns[dimx][row]),
+            "y": float(self.columns[dimy][row]),
+            "name": self.names[row],
+            "size": float(self.columns["popularity"][row]),
+            "preview_url": self.preview_urls[row],
+            "type": self.typ.capitalize(),
+            "genre": self.genres[row],
+            "color": self.colors[row],
+        }
+        if dist is not None:
+            node["dist"] = float(dist)
+        return node
+
+    def label_groups(self, rows):
+        """ Group the given rows by record label, keeps the order of rows """
+        groups = dict()
+        for row in rows:
+            for label in self.labels[row]:
+                groups.setdefault(label, []).append(row)
+        return groups
+
+
+# every table remembers the dataset version it was loaded for and is loaded again
+# on first use after the version changed, so all workers follow the ETL
+_lock = threading.Lock()
+_tables = dict()
+
+
+def load_table(typ):
+    """ Read a whole api collection from MongoDB into a FeatureTable """
+    projection = {field: 1 for field in side_fields}
+    projection.update({dim: 1 for dim in ma.dimensions})
+    projection["_id"] = 0
+    docs = list(ma.collections[typ].find({}, projection))
+    return FeatureTable(typ, docs)
+
+
+def get_table(typ):
+    """ Return the in-memory table for a node type, loading it on first use and
+    again when the dataset version changed
+    """
+    version = ma.current_dataset_version()["version"]
+    loaded = _tables.get(typ)
+    if loaded is None or loaded[0] != version:
+        with _lock:
+            loaded = _tables.get(typ)
+            if loaded is None or loaded[0] != version:
+                loaded = version, load_table(typ)
+                _tables[typ] = loaded
+    return loaded[1]
+
+
+def reload(typ=None):
+    """ Drop the cached tables (or only the one for typ) and reload them from MongoDB """
+    version = ma.current_dataset_version()["version"]
+    types = [typ] if typ else list(ma.collections.keys())
+    tables = {t: load_table(t) for t in types}
+    with _lock:
+        _tables.update({t: (version, table) for t, table in tables.items()})
+    return {t: len(table) for t, table in tables.items()}
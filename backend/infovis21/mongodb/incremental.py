@@ -0,0 +1,284 @@
+import time
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import bulk, enrich, popularity, precompute
+from infovis21.mongodb import utils as dbutils
+
+# Refresh the database from a new version of the kaggle csv without running the
+# whole ETL again. The rows of the csv are diffed against the content hashes of
+# the last load (ma.coll_track_hashes), only the new and changed tracks are
+# enriched, in staging collections, and only the artists, genres, years and
+# labels of the changed and removed tracks are aggregated again and merged into
+# the *_full and *_api collections with $merge.
+STAGING_TRACKS = "incremental_tracks"
+STAGING_ARTISTS = "incremental_artists"
+STAGING_ARTISTS_WITH_GENRES = "incremental_artists_with_genres"
+STAGING_TRACKS_FULL = "incremental_tracks_full"
+STAGING = [
+    STAGING_TRACKS,
+    STAGING_ARTISTS,
+    STAGING_ARTISTS_WITH_GENRES,
+    STAGING_TRACKS_FULL,
+]
+
+# fields of tracks_full that decide which aggregates a track is part of
+KEY_PROJECTION = {"id": 1, "artists.id": 1, "genres": 1, "year": 1, "labels": 1}
+
+# per year popularity collections and how they are computed, see tasks.py
+POPULARITY_PER_YEAR = [
+    ("artist", "super_artist_popularity_per_year", True),
+    ("artist", "artist_popularity_per_year", False),
+    ("genre", "super_genre_popularity_per_year", True),
+    ("genre", "genre_popularity_per_year", False),
+]
+
+
+def diff_tracks(incoming, stored):
+    """ incoming and stored map csv ids to content hashes, returns the sorted
+    ids of the new or changed tracks and of the removed tracks
+    """
+    changed = sorted(_id for _id, h in incoming.items() if stored.get(_id) != h)
+    removed = sorted(set(stored) - set(incoming))
+    return changed, removed
+
+
+def affected_keys(docs):
+    """ The track, artist, genre, year and label keys of tracks_full documents """
+    keys = {
+        "tracks": set(),
+        "artists": set(),
+        "genres": set(),
+        "years": set(),
+        "labels": set(),
+    }
+    for doc in docs:
+        keys["tracks"].add(doc.get("id"))
+        keys["artists"].update(artist.get("id") for artist in doc.get("artists") or [])
+        keys["genres"].update(doc.get("genres") or [])
+        keys["years"].add(doc.get("year"))
+        keys["labels"].add(doc.get("labels"))
+    return {name: sorted(values - {None}) for name, values in keys.items()}
+
+
+def stale_types(keys):
+    """ Node types whose precomputed layers are out of date """
+    return [typ for typ in ["genre", "artist", "track"] if keys[f"{typ}s"]]
+
+
+def merge_stage(into, when_matched="replace"):
+    return {
+        "$merge": {
+            "into": into,
+            "whenMatched": when_matched,
+            "whenNotMatched": "insert",
+        }
+    }
+
+
+def stored_hashes(db):
+    """ Content hashes of the last load. Databases that were loaded before the
+    hashes were kept fall back to the tracks collection of the ETL, without either
+    every track would count as changed and be fetched again, which raises instead
+    """
+    coll = ma.coll_track_hashes
+    if coll.estimated_document_count() > 0:
+        return {doc["_id"]: doc.get("content_hash") for doc in coll.find()}
+    query = {"csv_id": {"$exists": True}, "content_hash": {"$exists": True}}
+    if db["tracks"].find_one(query) is not None:
+        return {
+            doc["csv_id"]: doc["content_hash"]
+            for doc in db["tracks"].find(query, {"csv_id": 1, "content_hash": 1})
+        }
+    raise RuntimeError(
+        "the database has no content hashes of the csv rows it was loaded from, "
+        "run invoke load-kaggle once before refreshing it"
+    )
+
+
+def tracks_query(csv_ids):
+    # older loads did not keep the csv id, it is the Spotify id for most tracks
+    return {"$or": [{"csv_id": {"$in": csv_ids}}, {"id": {"$in": csv_ids}}]}
+
+
+def stage_tracks(db, df, changed, sp, workers, backoff):
+    """ Enrich the new and changed tracks in the staging collections, returns
+    the keys of their tracks_full documents
+    """
+    for name in STAGING:
+        db[name].drop()
+    rows = df[df["csv_id"].isin(changed)].to_dict("records")
+    bulk.insert_all(db[STAGING_TRACKS], rows)
+    db[STAGING_TRACKS].create_index("id")
+
+    enrich.enrich_tracks(sp, db, workers, backoff, tracks=STAGING_TRACKS)
+    # albums were merged with the album data of the tracks by the full load
+    enrich.enrich_albums(sp, db, workers, backoff, tracks=STAGING_TRACKS)
+    enrich.enrich_artists(
+        sp, db, workers, backoff, tracks=STAGING_TRACKS, artists=STAGING_ARTISTS
+    )
+
+    db[STAGING_ARTISTS].aggregate(
+        [
+            {"$match": {"$expr": {"$ne": [{"$size": "$genres"}, 0]}}},
+            {"$out": STAGING_ARTISTS_WITH_GENRES},
+        ]
+    )
+    db[STAGING_ARTISTS_WITH_GENRES].create_index("id")
+    db[STAGING_TRACKS].aggregate(
+        ma.spotipy_merge_stages()
+        + ma.genre_stages(STAGING_ARTISTS_WITH_GENRES)
+        + ma.label_stages("albums")
+        + [{"$out": STAGING_TRACKS_FULL}],
+        allowDiskUse=True,
+    )
+    return list(db[STAGING_TRACKS_FULL].find({}, KEY_PROJECTION))
+
+
+def refresh_artists(db, artist_ids):
+    """ Aggregate the artists again, from their fetched or current documents """
+    fetched = set(db[STAGING_ARTISTS_WITH_GENRES].distinct("id"))
+    current = db["artists_full"].find(
+        {"id": {"$in": sorted(set(artist_ids) - fetched)}}, {"_id": 0}
+    )
+    bulk.insert_all(db[STAGING_ARTISTS_WITH_GENRES], current, verbose=False)
+    db["artists_full"].delete_many({"id": {"$in": artist_ids}})
+    db[STAGING_ARTISTS_WITH_GENRES].aggregate(
+        [{"$match": {"id": {"$in": artist_ids}}}]
+        + ma.artist_stages()
+        + [{"$project": {"_id": 0}}, merge_stage("artists_full")]
+    )
+
+
+def refresh_groups(db, coll_name, field, keys, stages):
+    """ Aggregate the genres, years or labels with the given keys again. Their
+    documents are merged so that ids and genre_super survive, keys without
+    tracks are removed. Returns the keys that were removed.
+    """
+    db["tracks_full"].aggregate(
+        [{"$match": {field: {"$in": keys}}}]
+        + stages
+        + [{"$match": {"_id": {"$in": keys}}}, merge_stage(coll_name, "merge")],
+        allowDiskUse=True,
+    )
+    gone = sorted(
+        set(keys) - set(db["tracks_full"].distinct(field, {field: {"$in": keys}}))
+    )
+    db[coll_name].delete_many({"_id": {"$in": gone}})
+    return gone
+
+
+def refresh_api(db, full, api, key, keys, stages):
+    """ Replace the api documents of the given keys of a *_full collection """
+    db[api].delete_many({key: {"$in": keys}})
+    db[full].aggregate(
+        [{"$match": {"_id" if key == "name" else "id": {"$in": keys}}}]
+        + stages
+        + [{"$project": {"_id": 0}}, merge_stage(api)]
+    )
+
+
+def refresh(path="../data/kaggle/data.csv", workers=None, sp=None):
+    """ Apply a new version of the kaggle csv, returns what changed """
+    start = time.time()
+    db = ma.db
+    df = ma.read_kaggle_csv(path)
+    incoming = dict(zip(df["csv_id"], df["content_hash"]))
+    changed, removed = diff_tracks(incoming, stored_hashes(db))
+    print(f"{len(changed)} new or changed tracks, {len(removed)} removed tracks")
+    result = {"changed": len(changed), "removed": len(removed)}
+    if not changed and not removed:
+        return result
+
+    old_docs = list(
+        db["tracks_full"].find(tracks_query(changed + removed), KEY_PROJECTION)
+    )
+    new_docs = []
+    if changed:
+        workers = workers or enrich.WORKERS
+        sp = sp or enrich.spotify_client(workers=workers)
+        new_docs = stage_tracks(db, df, changed, sp, workers, enrich.Backoff())
+    keys = affected_keys(old_docs + new_docs)
+
+    db["tracks_full"].delete_many(tracks_query(changed + removed))
+    if new_docs:
+        db[STAGING_TRACKS_FULL].aggregate(
+            [{"$project": {"_id": 0}}, merge_stage("tracks_full")]
+        )
+
+    refresh_artists(db, keys["artists"])
+    gone = {
+        "genres": refresh_groups(
+            db, "genres_full", "genres", keys["genres"], ma.genre_group_stages()
+        ),
+        "years": refresh_groups(
+            db, "years_full", "year", keys["years"], ma.year_group_stages()
+        ),
+        "labels": refresh_groups(
+            db, "labels_full", "labels", keys["labels"], ma.label_group_stages()
+        ),
+    }
+    ma.create_ids(db["genres_full"], {"id": {"$exists": False}})
+    ma.create_ids(db["labels_full"], {"id": {"$exists": False}})
+
+    db["tracks_api"].delete_many({"id": {"$in": keys["tracks"]}})
+    db["tracks_full"].aggregate(
+        [
+            {"$match": {"id": {"$in": keys["tracks"]}}},
+            {"$set": {"labels": ["$labels"]}},
+            dbutils.tracks_api_project_stage,
+            {"$project": {"_id": 0}},
+            merge_stage("tracks_api"),
+        ]
+    )
+    refresh_api(
+        db, "artists_full", "artists_api", "id", keys["artists"], [ma.api_project_stage]
+    )
+    refresh_api(
+        db,
+        "genres_full",
+        "genres_api",
+        "name",
+        keys["genres"],
+        [{"$set": {"name": "$_id", "genres": ["$_id"]}}, ma.api_project_stage],
+    )
+    refresh_api(
+        db, "years_full", "years_api", "id", keys["years"], [ma.api_project_stage]
+    )
+    refresh_api(
+        db,
+        "labels_full",
+        "labels_api",
+        "name",
+        keys["labels"],
+        [{"$project": {"name": "$_id", "n_tracks": 1, "n_artists": 1}}],
+    )
+    dbutils.assign_super_genres("tracks_api", keys["tracks"])
+    dbutils.assign_super_genres("artists_api", keys["artists"])
+    dbutils.assign_super_genres(
+        "genres_api", db["genres_full"].distinct("id", {"_id": {"$in": keys["genres"]}})
+    )
+
+    for kind, out, use_super in POPULARITY_PER_YEAR:
+        compute = getattr(dbutils, f"compute_{kind}_popularity_per_year")
+        compute(out=out, use_super_genre=use_super, years=keys["years"])
+    popularity.materialize()
+    ma.update_dim_minmax()
+
+    # the precomputed layers of these types are computed again by the next
+    # (resumed) invoke precompute
+    stale = stale_types(keys)
+    db[precompute.JOBS_COLLECTION].delete_many({"type": {"$in": stale}})
+
+    with bulk.BulkWriter(ma.coll_track_hashes, verbose=False) as writer:
+        for _id in changed:
+            writer.replace({"_id": _id}, {"content_hash": incoming[_id]}, upsert=True)
+    ma.coll_track_hashes.delete_many({"_id": {"$in": removed}})
+    for name in STAGING:
+        db[name].drop()
+    ma.bump_dataset_version("incremental refresh")
+
+    result.update({name: len(values) for name, values in keys.items()})
+    result["removed_keys"] = {name: len(values) for name, values in gone.items()}
+    result["stale_types"] = stale
+    result["seconds"] = round(time.time() - start, 1)
+    return result
@@ -0,0 +1,205 @@
+import threading
+
+import numpy as np
+from bson import Binary
+
+from infovis21.mongodb import MongoAccess as ma
+
+# Most popular genres, artists and tracks per year for the word cloud and the
+# streamgraph (/most_popular). The ETL materializes, for every (type, use_super),
+# the TOP_K entries of every year and a dense year x key popularity matrix over
+# the keys that are in the top MATRIX_TOP_K of at least one year. The api keeps
+# them in memory and answers year ranges by slicing.
+TOP_K = 200
+MATRIX_TOP_K = 50
+ENTRY_FIELDS = ["name", "year", "popularity", "color", "super_genre", "genre"]
+
+# (type, use_super) -> collection the entries are computed from
+sources = {
+    ("genre", False): "coll_genre_pop",
+    ("genre", True): "coll_super_genre_pop",
+    ("artist", False): "coll_artist_pop",
+    ("artist", True): "coll_super_artist_pop",
+    ("track", False): "coll_tracks",
+    ("track", True): "coll_tracks",
+}
+
+
+def source_pipeline(typ):
+    """ Entries of the source collection sorted by year and popularity """
+    if typ == "track":
+        fields = {
+            "name": 1,
+            "year": 1,
+            "popularity": 1,
+            "color": "$genre_color",
+            "super_genre": "$genre_super",
+        }
+    else:
+        fields = {field: 1 for field in ENTRY_FIELDS}
+    return [
+        # genres that were added after the super genres were clustered have none
+        {"$match": {"year": {"$ne": None}, "name": {"$ne": None}}},
+        {"$project": {**fields, "_id": 0}},
+        {"$sort": {"year": 1, "popularity": -1}},
+    ]
+
+
+def build(typ, use_super, k=TOP_K, matrix_k=MATRIX_TOP_K):
+    """ Returns the per year documents with the top k entries and the matrix document """
+    cursor = getattr(ma, sources[(typ, use_super)]).aggregate(
+        source_pipeline(typ), allowDiskUse=True
+    )
+    year_docs, years, names, popularity, colors = [], [], [], [], dict()
+    for entry in cursor:
+        year = int(entry["year"])
+        if not year_docs or year_docs[-1]["year"] != year:
+            year_docs.append(
+                {"type": typ, "use_super": use_super, "year": year, "entries": []}
+            )
+        entries = year_docs[-1]["entries"]
+        if len(entries) < k:
+            entries.append({f: entry[f] for f in ENTRY_FIELDS if f in entry})
+        years.append(year)
+        names.append(entry.get("name"))
+        popularity.append(entry.get("popularity") or 0)
+        colors.setdefault(entry.get("name"), entry.get("color"))
+
+    keys = []
+    for doc in year_docs:
+        keys.extend(e["name"] for e in doc["entries"][:matrix_k])
+    keys = list(dict.fromkeys(keys))
+    key_index = {key: j for j, key in enumerate(keys)}
+    year_values = [doc["year"] for doc in year_docs]
+    matrix = np.zeros((len(year_values), len(keys)), dtype=np.float32)
+    rows = np.searchsorted(year_values, years)
+    for row, name, value in zip(rows, names, popularity):
+        j = key_index.get(name)
+        # names are not unique for tracks, keep the most popular one
+        if j is not None and value > matrix[row, j]:
+            matrix[row, j] = value
+
+    matrix_doc = {
+        "type": typ,
+        "use_super": use_super,
+        "years": year_values,
+        "keys": keys,
+        "colors": [colors.get(key) for key in keys],
+        "popularity": Binary(matrix.astype("<f4").tobytes()),
+    }
+    return year_docs, matrix_doc
+
+
+def materialize(k=TOP_K, matrix_k=MATRIX_TOP_K):
+    """ (Re)compute the top lists and matrices of all types, the collections are
+    replaced at once so readers never see a partial result
+    """
+    year_docs, matrix_docs = [], []
+    for typ, use_super in sources:
+        docs, matrix_doc = build(typ, use_super, k=k, matrix_k=matrix_k)
+        year_docs.extend(docs)
+        matrix_docs.append(matrix_doc)
+        print(f"{typ} (use_super={use_super}): {len(docs)} years")
+
+    for name, docs in [
+        ("coll_most_popular", year_docs),
+        ("coll_popularity_matrix", matrix_docs),
+    ]:
+        coll = getattr(ma, name)
+        tmp = ma.db[f"{coll.name}_tmp"]
+        tmp.drop()
+        if docs:
+            tmp.insert_many(docs)
+        tmp.create_index([("type", 1), ("use_super", 1), ("year", 1)])
+        tmp.rename(coll.name, dropTarget=True)
+    return {"years": len(year_docs), "matrices": len(matrix_docs)}
+
+
+class TopList:
+    """ Materialized top lists and popularity matrix of one (type, use_super) """
+
+    def __init__(self, year_docs, matrix_doc):
+        year_docs = sorted(year_docs, key=lambda doc: doc["year"])
+        self.years = np.array([doc["year"] for doc in year_docs], dtype=np.int64)
+        self.entries = [doc["entries"] for doc in year_docs]
+        self.keys = list(matrix_doc["keys"])
+        self.colors = list(matrix_doc["colors"])
+        matrix_years = np.array(matrix_doc["years"], dtype=np.int64)
+        matrix = np.frombuffer(matrix_doc["popularity"], dtype="<f4").reshape(
+            len(matrix_years), len(self.keys)
+        )
+        # align the matrix with the years of the top lists
+        self.popularity = np.zeros((len(self.years), len(self.keys)), dtype=np.float32)
+        found = np.isin(self.years, matrix_years)
+        self.popularity[found] = matrix[
+            np.searchsorted(matrix_years, self.years[found])
+        ]
+
+    def year_range(self, year_min, year_max):
+        lo = np.searchsorted(self.years, year_min, side="left")
+        hi = np.searchsorted(self.years, year_max, side="right")
+        return lo, hi
+
+    def top(self, year_min, year_max, limit=None):
+        """ The limit most popular entries of every year, by year """
+        lo, hi = self.year_range(year_min, year_max)
+        return [e for entries in self.entries[lo:hi] for e in entries[:limit]]
+
+    def streams(self, year_min, year_max, limit=None):
+        """ Returns the keys that are in the top limit (at most MATRIX_TOP_K) of a
+        year in the range, most popular first, and one row per year with the
+        popularity of every key
+        """
+        lo, hi = self.year_range(year_min, year_max)
+        block = self.popularity[lo:hi]
+        columns = np.flatnonzero(block.any(axis=0))
+        if limit is not None:
+            top = {
+                e["name"] for entries in self.entries[lo:hi] for e in entries[:limit]
+            }
+            columns = [j for j in columns if self.keys[j] in top]
+        columns = sorted(columns, key=lambda j: -block[:, j].sum())
+        rows = [
+            {"year": int(year), **{self.keys[j]: float(values[j]) for j in columns}}
+            for year, values in zip(self.years[lo:hi], block)
+        ]
+        return [self.keys[j] for j in columns], rows
+
+
+_lock = threading.Lock()
+_toplists = dict()
+
+
+def load_toplist(typ, use_super):
+    """ Read the materialized top lists, computes them if the ETL did not yet """
+    query = {"type": typ, "use_super": use_super}
+    matrix_doc = ma.coll_popularity_matrix.find_one(query, {"_id": 0})
+    if matrix_doc is None:
+        return TopList(*build(typ, use_super))
+    year_docs = list(ma.coll_most_popular.find(query, {"_id": 0}))
+    return TopList(year_docs, matrix_doc)
+
+
+def get_toplist(typ, use_super):
+    """ In-memory top lists of a (type, use_super), loaded on first use and again
+    when the dataset version changed, e.g. after materialize in another process
+    """
+    version = ma.current_dataset_version()["version"]
+    key = (version, typ, bool(use_super))
+    toplist = _toplists.get(key)
+    if toplist is None:
+        with _lock:
+            toplist = _toplists.get(key)
+            if toplist is None:
+                toplist = load_toplist(typ, bool(use_super))
+                # the lists of older versions are not served anymore
+                for old in [k for k in _toplists if k[0] != version]:
+                    del _toplists[old]
+                _toplists[key] = toplist
+    return toplist
+
+
+def reload():
+    """ Drop the in-memory top lists, they are loaded again on next use """
+    with _lock:
+        _toplists.clear()
@@ -0,0 +1,183 @@
+import itertools
+import multiprocessing
+import os
+import time
+from datetime import datetime, timedelta
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import tiles
+from infovis21.mongodb import utils as dbutils
+
+# one document per finished layer, so that an interrupted run can be resumed.
+# A layer only counts as finished for a run over the same data (the version of
+# its source, see source_version) with the same offset and limit, and while the
+# tile store still holds as many of its nodes and links as were written.
+JOBS_COLLECTION = "precompute_jobs"
+
+# sources are loaded once in the parent process and inherited by the forked workers
+_sources = dict()
+# type -> what the ledger entries of the current run are stamped with
+_stamps = dict()
+
+
+def job_id(dimx, dimy, typ, zoom):
+    return "_".join([dimx, dimy, typ, str(zoom)])
+
+
+def plan_jobs(x_dims, y_dims, types, zooms):
+    """ One job per (dimx, dimy, typ) pyramid with the zoom levels to compute,
+    (dimy, dimx) is served from the same layers so only one of them is planned
+    """
+    jobs = []
+    for dimx, dimy, typ in itertools.product(x_dims, y_dims, types):
+        dimx, dimy, _ = tiles.canonical_pair(dimx, dimy)
+        job = (dimx, dimy, typ, tuple(zooms))
+        if dimx != dimy and job not in jobs:
+            jobs.append(job)
+    return jobs
+
+
+def source_version(typ):
+    """ Content hash of what the layers of a type are computed from, changes when
+    the ETL changes the nodes or the dimension ranges
+    """
+    names = [ma.collections[typ].name, "dim_minmax"]
+    return ma.db.command("dbHash", collections=names)["md5"]
+
+
+def is_finished(entry, stamp):
+    """ Whether a ledger entry was written by a run with the same stamp """
+    return all(entry.get(key) == value for key, value in stamp.items())
+
+
+def stored_layers():
+    """ Layer id -> [nodes, links] in the tile store """
+    key = {"dimx": "$dimx", "dimy": "$dimy", "typ": "$type", "zoom": "$zoom"}
+    pipeline = [
+        {"$match": {"staged": {"$exists": False}}},
+        {"$group": {"_id": key, "n": {"$sum": 1}}},
+    ]
+    stored = dict()
+    for i, coll in enumerate([tiles.nodes_collection(), tiles.links_collection()]):
+        for doc in coll.aggregate(pipeline, allowDiskUse=True):
+            stored.setdefault(job_id(**doc["_id"]), [0, 0])[i] = doc["n"]
+    return stored
+
+
+def is_stored(entry, stored):
+    """ Whether the tile store holds the nodes and links a ledger entry wrote,
+    layers that were dropped or partly deleted since are computed again
+    """
+    return stored.get(entry["_id"], [0, 0]) == [entry.get("nodes"), entry.get("links")]
+
+
+def finished_jobs(stamps):
+    """ Ids of the layers that are finished for the stamps of their types """
+    stored = stored_layers()
+    return {
+        doc["_id"]
+        for doc in ma.db[JOBS_COLLECTION].find({})
+        if doc.get("type") in stamps
+        and is_finished(doc, stamps[doc["type"]])
+        and is_stored(doc, stored)
+    }
+
+
+def _init_worker():
+    # MongoClient is not fork safe, every worker gets its own connection pool
+    ma.connect()
+
+
+def _run_job(job):
+    dimx, dimy, typ, zooms = job
+    start = time.time()
+    counts = dbutils.precompute_pyramid(
+        dimx, dimy, typ, zooms=zooms, source=_sources[typ]
+    )
+    duration = time.time() - start
+    for zoom, (n_nodes, n_links) in counts.items():
+        ma.db[JOBS_COLLECTION].replace_one(
+            {"_id": job_id(dimx, dimy, typ, zoom)},
+            {
+                "dimx": dimx,
+                "dimy": dimy,
+                "type": typ,
+                "zoom": zoom,
+                "nodes": n_nodes,
+                "links": n_links,
+                **_stamps[typ],
+                "finished_at": datetime.now(),
+            },
+            upsert=True,
+        )
+    return job, counts, duration
+
+
+def run(jobs, workers=None, resume=True, offset=0, limit=None):
+    """ Precompute the given pyramids with a pool of worker processes.
+
+    Layers that were finished by an earlier run over the same data with the same
+    offset and limit are skipped unless resume is False, in which case the job
+    log is cleared first.
+    """
+    if not resume:
+        ma.db[JOBS_COLLECTION].drop()
+    for typ in {job[2] for job in jobs}:
+        _stamps[typ] = {
+            "source_version": source_version(typ),
+            "offset": int(offset or 0),
+            "limit": int(limit) if limit else None,
+        }
+    done = finished_jobs(_stamps)
+    todo = []
+    for dimx, dimy, typ, zooms in jobs:
+        zooms = tuple(z for z in zooms if job_id(dimx, dimy, typ, z) not in done)
+        if len(zooms) > 0:
+            todo.append((dimx, dimy, typ, zooms))
+    n_layers = sum(len(job[3]) for job in jobs)
+    n_todo = sum(len(job[3]) for job in todo)
+    print(f"{n_layers - n_todo} of {n_layers} layers already done")
+    if len(todo) == 0:
+        _stamps.clear()
+        return []
+
+    tiles.create_indexes()
+    for typ in sorted({job[2] for job in todo}):
+        print(f"loading {typ} source ...")
+        _sources[typ] = dbutils.load_precompute_source(typ, offset=offset, limit=limit)
+
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    print(f"precomputing {len(todo)} pyramids with {workers} workers")
+    start = time.time()
+    results = []
+
+    def report(result):
+        results.append(result)
+        (dimx, dimy, typ, zooms), counts, duration = result
+        elapsed = time.time() - start
+        rate = len(results) / elapsed
+        eta = timedelta(seconds=round((len(todo) - len(results)) / rate))
+        n_nodes = sum(n for n, _ in counts.values())
+        n_links = sum(n for _, n in counts.values())
+        print(
+            f"[{len(results)}/{len(todo)}] {'_'.join([dimx, dimy, typ])}: "
+            f"{len(zooms)} levels, {n_nodes} nodes, {n_links} links in {duration:.1f}s "
+            f"({rate * 60:.1f} pyramids/min, ETA {eta})"
+        )
+
+    if workers == 1:
+        for job in todo:
+            report(_run_job(job))
+    else:
+        # fork shares the loaded sources with the workers without copying them
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(workers, initializer=_init_worker) as pool:
+            for result in pool.imap_unordered(_run_job, todo):
+                report(result)
+
+    print(
+        f"finished {len(results)} pyramids in {timedelta(seconds=round(time.time() - start))}"
+    )
+    _sources.clear()
+    _stamps.clear()
+    return results
@@ -0,0 +1,174 @@
+import math
+import time
+
+import numpy as np
+
+# Uniform grid over the normalized [0, 1]^2 space in which the precomputed layers
+# are stored. Every zoom level gets its own resolution so that a viewport at that
+# zoom level overlaps only a handful of cells (between 2x2 and 3x3).
+
+
+def grid_size(zoom, n_zoom_levels):
+    """ Number of cells per axis for a zoom level """
+    zoom = min(max(int(zoom), 0), n_zoom_levels - 1)
+    return math.ceil(2 * n_zoom_levels / (n_zoom_levels - zoom))
+
+
+def cell_coords(values, n):
+    """ Column or row of the cells that contain the given normalized values """
+    return np.clip(np.floor(np.asarray(values) * n), 0, n - 1).astype(np.int64)
+
+
+def cell_ids(xs, ys, n):
+    """ Cell ids (row major) of the given points """
+    return cell_coords(ys, n) * n + cell_coords(xs, n)
+
+
+def cell_bounds(cell, n):
+    """ Return (x_min, x_max, y_min, y_max) of a cell """
+    cy, cx = divmod(int(cell), n)
+    return cx / n, (cx + 1) / n, cy / n, (cy + 1) / n
+
+
+def viewport_cells(x_min, x_max, y_min, y_max, n):
+    """ Ids of all cells that overlap the viewport """
+    cx_min, cx_max = cell_coords([x_min, x_max], n)
+    cy_min, cy_max = cell_coords([y_min, y_max], n)
+    return [
+        int(cy * n + cx)
+        for cy in range(cy_min, cy_max + 1)
+        for cx in range(cx_min, cx_max + 1)
+    ]
+
+
+def segments_intersect_box(x1, y1, x2, y2, x_min, x_max, y_min, y_max):
+    """ Vectorized Liang-Barsky test whether line segments cross an axis aligned box """
+    x1, y1, x2, y2 = [
+        np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (x1, y1, x2, y2)
+    ]
+    dx, dy = x2 - x1, y2 - y1
+    t0 = np.zeros_like(x1)
+    t1 = np.ones_like(x1)
+    inside = np.ones(x1.shape, dtype=bool)
+    for p, q in (
+        (-dx, x1 - x_min),
+        (dx, x_max - x1),
+        (-dy, y1 - y_min),
+        (dy, y_max - y1),
+    ):
+        parallel = p == 0
+        # a segment parallel to this edge is either completely in or out
+        inside &= ~(parallel & (q < 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.where(parallel, 0.0, q / np.where(parallel, 1.0, p))
+        entering = ~parallel & (p < 0)
+        leaving = ~parallel & (p > 0)
+        t0 = np.where(entering, np.maximum(t0, r), t0)
+        t1 = np.where(leaving, np.minimum(t1, r), t1)
+    return inside & (t0 <= t1)
+
+
+def segment_cells(x1, y1, x2, y2, n):
+    """ Ids of all cells that a single line segment passes through """
+    candidates = viewport_cells(min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2), n)
+    if len(candidates) == 1:
+        return candidates
+    bounds = np.array([cell_bounds(cell, n) for cell in candidates])
+    hits = segments_intersect_box(
+        np.full(len(candidates), x1),
+        np.full(len(candidates), y1),
+        np.full(len(candidates), x2),
+        np.full(len(candidates), y2),
+        bounds[:, 0],
+        bounds[:, 1],
+        bounds[:, 2],
+        bounds[:, 3],
+    )
+    return [cell for cell, hit in zip(candidates, hits) if hit]
+
+
+def poisson_disk_filtering(points, radius=0.1, verbosity=100_000):
+    """ Grid hashed greedy Poisson disk thinning, same contract as
+    utils.min_distance_based_filtering: returns the indices of the kept points,
+    the number of points discarded per grid cell of size 2 * radius and the
+    duration in seconds.
+
+    Kept points are more than radius apart and every other point is within
+    radius of a kept point. The hash grid has cells with a diagonal of radius,
+    so a cell holds at most one kept point and all points of a cell are covered
+    by it. Cells are visited in 3 x 3 phases, cells of the same phase are too far
+    apart to conflict and are decided at once with vectorized checks against the
+    kept points in their 5 x 5 neighbourhood.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    radius = abs(radius)
+    if radius == 0:
+        return set(range(n)), None, 0
+
+    start = time.time()
+    r2 = radius * radius
+    # shrink the cells a tiny bit so that rounding can not push cell mates apart
+    cell = radius / math.sqrt(2) * (1 - 1e-9)
+    size = math.ceil(1 / cell) + 1
+    pad = 2
+    cx = np.clip(np.floor(points[:, 0] / cell).astype(np.int64), 0, size - 1)
+    cy = np.clip(np.floor(points[:, 1] / cell).astype(np.int64), 0, size - 1)
+
+    # index of the kept point of every cell or -1, padded so that the 5 x 5
+    # neighbourhood lookups never go out of bounds
+    kept = np.full((size + 2 * pad, size + 2 * pad), -1, dtype=np.int64)
+    covered_by = np.full(n, -1, dtype=np.int64)
+
+    # points ordered by cell and index, so the first point of a cell is the one
+    # that would have been picked first by the greedy algorithm
+    order = np.lexsort((np.arange(n), cy * size + cx))
+    phase = (cy[order] % 3) * 3 + cx[order] % 3
+    offsets = [(dy, dx) for dy in range(-pad, pad + 1) for dx in range(-pad, pad + 1)]
+
+    for p in range(9):
+        idx = order[phase == p]
+        if len(idx) == 0:
+            continue
+        px, py = cx[idx] + pad, cy[idx] + pad
+        for dy, dx in offsets:
+            neighbour = kept[py + dy, px + dx]
+            has = (neighbour >= 0) & (covered_by[idx] < 0)
+            if not has.any():
+                continue
+            diff = points[idx[has]] - points[neighbour[has]]
+            close = (diff * diff).sum(axis=1) <= r2
+            covered_by[idx[has][close]] = neighbour[has][close]
+
+        free = idx[covered_by[idx] < 0]
+        if len(free) == 0:
+            continue
+        free_cells = cy[free] * size + cx[free]
+        _, first = np.unique(free_cells, return_index=True)
+        chosen = free[first]
+        kept[cy[chosen] + pad, cx[chosen] + pad] = chosen
+        # the remaining free points share a cell with a kept point
+        covered_by[free] = kept[cy[free] + pad, cx[free] + pad]
+        if verbosity and len(chosen) >= verbosity:
+            print(p + 1, "of 9 phases,", len(chosen), "points kept")
+
+    ans = np.sort(kept[kept >= 0])
+    covered_by[ans] = ans
+
+    # count the points that were absorbed by the kept points per coarse grid cell
+    coarse = 2 * radius
+    grid_size = (
+        math.ceil(1 / coarse) + 1,
+        math.ceil(1 / coarse) + 1,
+    )
+    gx = np.clip(
+        (points[covered_by, 0] // coarse).astype(np.int64), 0, grid_size[0] - 1
+    )
+    gy = np.clip(
+        (points[covered_by, 1] // coarse).astype(np.int64), 0, grid_size[1] - 1
+    )
+    discarded = np.zeros(shape=grid_size)
+    np.add.at(discarded, (gx, gy), 1)
+
+    end = time.time()
+    return ans.tolist(), discarded, end - start
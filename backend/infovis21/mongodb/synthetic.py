@@ -0,0 +1,588 @@
+import json
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import bulk, connection
+from infovis21.mongodb import utils as dbutils
+
+# Synthetic catalogue in the shape of tracks_full, artists_full, genres_full and
+# labels_full (and artists_with_genres, the input of the artists_full step), for
+# load and capacity tests at sizes beyond the kaggle data.
+#
+# The audio features follow a gaussian copula: a correlated normal vector is
+# drawn per track and every component is mapped to its feature through the
+# quantiles of that feature, which keeps the marginal distributions and the rank
+# correlations of the profile. The vector is the sum of a genre, an artist and a
+# track part with the same correlation, so tracks of an artist and artists of a
+# genre are close to each other without changing the overall distribution.
+#
+# Tracks per artist, artists per label and artists per genre follow power laws,
+# a few artists and labels have most of the tracks. Everything is derived from
+# the seed, chunk by chunk, so the same seed gives the same catalogue.
+#
+# A catalogue replaces the collections it writes, it goes to a database of its
+# own (musex_synthetic_<tracks>_<seed>) and never to the database configured
+# for the api unless that is asked for explicitly.
+FEATURES = ma.feature_fields + ["explicit"]
+INTEGER_FEATURES = ["duration_ms", "popularity", "key", "mode", "year", "explicit"]
+SUPER_GENRES = ["Classical", "Electronic", "Hiphop", "Rock", "Pop", "Indie"]
+
+# variance of the normal vector that genres and artists explain, the rest varies per track
+GENRE_SHARE = 0.2
+ARTIST_SHARE = 0.25
+# the item of rank i is drawn with probability ~ 1 / i^exponent
+ARTIST_EXPONENT = 0.7
+LABEL_EXPONENT = 0.8
+GENRE_EXPONENT = 0.8
+TRACKS_PER_ARTIST = 6
+TRACKS_PER_LABEL = 12
+# share of the tracks of an artist that is released on its main label
+MAIN_LABEL_SHARE = 0.8
+PREVIEW_SHARE = 0.7
+# members (track ids) that are kept per document, a document must stay below 16MB
+MAX_MEMBERS = 200_000
+CHUNK_SIZE = 100_000
+BATCH_SIZE = 5000
+WRITERS = 4
+
+# Quantiles (level -> value) and normal score correlations of the kaggle tracks,
+# invoke synthetic-profile fits them to the current tracks_full instead
+LEVELS = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+QUANTILES = {
+    "danceability": (LEVELS, [0, 0.13, 0.3, 0.415, 0.548, 0.668, 0.76, 0.89, 0.988]),
+    "duration_ms": (
+        LEVELS,
+        [5108, 60000, 130000, 169800, 207467, 262400, 330000, 620000, 5403500],
+    ),
+    "energy": (LEVELS, [0, 0.015, 0.1, 0.255, 0.471, 0.703, 0.86, 0.98, 1]),
+    "instrumentalness": (LEVELS, [0, 0, 0, 0, 0.0002, 0.1, 0.82, 0.96, 1]),
+    "liveness": (LEVELS, [0, 0.04, 0.08, 0.099, 0.136, 0.261, 0.4, 0.92, 1]),
+    "loudness": (LEVELS, [-60, -30, -19, -14.6, -10.6, -7.2, -5.2, -2.5, 3.855]),
+    "speechiness": (LEVELS, [0, 0.025, 0.03, 0.035, 0.045, 0.076, 0.2, 0.93, 0.97]),
+    "tempo": (LEVELS, [0, 60, 82, 93, 115, 135, 155, 195, 243.5]),
+    "valence": (LEVELS, [0, 0.03, 0.16, 0.32, 0.54, 0.75, 0.88, 0.97, 1]),
+    "popularity": (LEVELS, [0, 0, 1, 11, 33, 48, 58, 74, 100]),
+    "key": ([0, 1], [-0.49, 11.49]),
+    "mode": ([0, 0.3, 0.3001, 1], [0, 0, 1, 1]),
+    "acousticness": (
+        LEVELS,
+        [0, 0.00002, 0.0027, 0.09, 0.49, 0.89, 0.985, 0.995, 0.996],
+    ),
+    "year": (LEVELS, [1921, 1925, 1950, 1966, 1986, 2004, 2014, 2020, 2020]),
+    "explicit": ([0, 0.915, 0.9151, 1], [0, 0, 1, 1]),
+}
+CORRELATIONS = {
+    ("acousticness", "energy"): -0.75,
+    ("acousticness", "loudness"): -0.56,
+    ("acousticness", "popularity"): -0.57,
+    ("acousticness", "year"): -0.61,
+    ("acousticness", "danceability"): -0.27,
+    ("acousticness", "instrumentalness"): 0.33,
+    ("acousticness", "valence"): -0.18,
+    ("acousticness", "tempo"): -0.2,
+    ("danceability", "valence"): 0.56,
+    ("danceability", "energy"): 0.22,
+    ("danceability", "loudness"): 0.25,
+    ("danceability", "popularity"): 0.2,
+    ("danceability", "year"): 0.22,
+    ("danceability", "speechiness"): 0.24,
+    ("danceability", "instrumentalness"): -0.28,
+    ("energy", "loudness"): 0.78,
+    ("energy", "popularity"): 0.49,
+    ("energy", "year"): 0.53,
+    ("energy", "tempo"): 0.25,
+    ("energy", "valence"): 0.35,
+    ("energy", "instrumentalness"): -0.28,
+    ("energy", "liveness"): 0.13,
+    ("loudness", "popularity"): 0.46,
+    ("loudness", "year"): 0.49,
+    ("loudness", "instrumentalness"): -0.4,
+    ("loudness", "tempo"): 0.2,
+    ("loudness", "valence"): 0.3,
+    ("popularity", "year"): 0.86,
+    ("popularity", "instrumentalness"): -0.3,
+    ("instrumentalness", "valence"): -0.19,
+    ("instrumentalness", "year"): -0.27,
+    ("speechiness", "liveness"): 0.14,
+    ("explicit", "speechiness"): 0.4,
+    ("explicit", "year"): 0.3,
+    ("explicit", "popularity"): 0.2,
+}
+
+SYLLABLES = [
+    "ka", "lo", "mi", "ra", "no", "ve", "su", "ti", "da", "mor",
+    "len", "sha", "qui", "zor", "bel", "fin", "gra", "tho", "wen", "ix",
+]  # fmt: skip
+_base62 = np.frombuffer(
+    b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz", dtype=np.uint8
+)
+
+
+def nearest_correlation(matrix, eps=1e-6):
+    """ Closest positive definite correlation matrix, by clipping the eigenvalues """
+    values, vectors = np.linalg.eigh((matrix + matrix.T) / 2)
+    matrix = vectors @ np.diag(np.maximum(values, eps)) @ vectors.T
+    d = np.sqrt(np.diag(matrix))
+    return matrix / np.outer(d, d)
+
+
+def default_profile():
+    correlation = np.eye(len(FEATURES))
+    for (a, b), r in CORRELATIONS.items():
+        i, j = FEATURES.index(a), FEATURES.index(b)
+        correlation[i, j] = correlation[j, i] = r
+    return {
+        "quantiles": {f: [list(q) for q in QUANTILES[f]] for f in FEATURES},
+        "correlation": nearest_correlation(correlation).tolist(),
+    }
+
+
+def fit_profile(docs, levels=None):
+    """ Quantiles and normal score correlations of the features of track documents """
+    from scipy.special import ndtri
+
+    levels = levels or [i / 100 for i in range(101)]
+    values = np.array(
+        [[float(doc.get(f) or 0) for f in FEATURES] for doc in docs], dtype=np.float64
+    )
+    ranks = values.argsort(axis=0).argsort(axis=0)
+    scores = ndtri((ranks + 0.5) / len(values))
+    correlation = np.nan_to_num(np.corrcoef(scores, rowvar=False))
+    np.fill_diagonal(correlation, 1)
+    return {
+        "quantiles": {
+            f: [levels, np.quantile(values[:, i], levels).tolist()]
+            for i, f in enumerate(FEATURES)
+        },
+        "correlation": nearest_correlation(correlation).tolist(),
+    }
+
+
+def save_profile(profile, path):
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=1)
+
+
+def load_profile(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def power_law_cdf(rng, n, exponent):
+    """ Cumulative sampling weights of n items, the weight of the item of rank i is
+    1 / i^exponent and the ranks are shuffled
+    """
+    cdf = np.cumsum(rng.permutation(1 / np.arange(1, n + 1) ** exponent))
+    return cdf / cdf[-1]
+
+
+def draw(rng, cdf, size):
+    """ Items drawn with the weights of a power_law_cdf """
+    return np.minimum(np.searchsorted(cdf, rng.random(size)), len(cdf) - 1)
+
+
+def base62(values, width):
+    """ Fixed width base 62 strings of non negative integers """
+    values = np.asarray(values, dtype=np.int64).copy()
+    digits = np.empty((len(values), width), dtype=np.uint8)
+    for i in range(width - 1, -1, -1):
+        digits[:, i] = _base62[values % 62]
+        values //= 62
+    return digits.view(f"S{width}").ravel().astype(str)
+
+
+def names(rng, n, words=2):
+    syllables = np.array(SYLLABLES)
+    picks = syllables[rng.integers(0, len(syllables), (n, words, 3))]
+    joined = np.char.add(np.char.add(picks[..., 0], picks[..., 1]), picks[..., 2])
+    joined = np.char.capitalize(joined)
+    out = joined[:, 0]
+    for w in range(1, words):
+        out = np.char.add(np.char.add(out, " "), joined[:, w])
+    return out.tolist()
+
+
+def ragged(groups, members, n_groups):
+    """ Members per group as (order, ptr), members[order[ptr[g]:ptr[g + 1]]] are the
+    members of group g in the order they were given
+    """
+    order = np.argsort(groups, kind="stable")
+    ptr = np.zeros(n_groups + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum(np.bincount(groups, minlength=n_groups))
+    return members[order], ptr
+
+
+class Catalogue:
+    """ The structure of a synthetic catalogue (genres, artists, labels and which
+    artist and label every track has), the tracks themselves are generated in
+    chunks by tracks()
+    """
+
+    def __init__(self, n_tracks, seed=0, profile=None):
+        self.n_tracks = n_tracks
+        self.seed = seed
+        self.profile = profile or default_profile()
+        rng = np.random.default_rng([seed, 0])
+        self.cholesky = np.linalg.cholesky(np.array(self.profile["correlation"]))
+
+        # the number of genres grows slower than the number of tracks
+        self.n_genres = max(int(60 * n_tracks ** (1 / 3)), 20)
+        self.n_artists = max(n_tracks // TRACKS_PER_ARTIST, 10)
+        self.n_labels = max(n_tracks // TRACKS_PER_LABEL, 5)
+
+        self.genre_names = [
+            f"{name.lower()} {i}" for i, name in enumerate(names(rng, self.n_genres, 1))
+        ]
+        self.genre_super = rng.integers(0, len(SUPER_GENRES), self.n_genres)
+        genre_latent = self.correlated(rng, self.n_genres) * np.sqrt(GENRE_SHARE)
+
+        # 1 or more genres per artist, the first one decides where the artist is
+        genre_cdf = power_law_cdf(rng, self.n_genres, GENRE_EXPONENT)
+        n_genres = np.minimum(1 + rng.poisson(1.2, self.n_artists), 8)
+        self.artist_genre_ptr = np.zeros(self.n_artists + 1, dtype=np.int64)
+        self.artist_genre_ptr[1:] = np.cumsum(n_genres)
+        self.artist_genres = draw(rng, genre_cdf, self.artist_genre_ptr[-1])
+        primary = self.artist_genres[self.artist_genre_ptr[:-1]]
+        self.artist_latent = genre_latent[primary] + self.correlated(
+            rng, self.n_artists
+        ) * np.sqrt(ARTIST_SHARE)
+        self.artist_names = names(rng, self.n_artists)
+        self.artist_popularity = rng.integers(0, 101, self.n_artists)
+        self.label_cdf = power_law_cdf(rng, self.n_labels, LABEL_EXPONENT)
+        self.artist_label = draw(rng, self.label_cdf, self.n_artists)
+        self.label_names = [f"{name} Records" for name in names(rng, self.n_labels)]
+
+        self.track_artist = draw(
+            rng, power_law_cdf(rng, self.n_artists, ARTIST_EXPONENT), n_tracks
+        )
+        self.track_label = np.where(
+            rng.random(n_tracks) < MAIN_LABEL_SHARE,
+            self.artist_label[self.track_artist],
+            draw(rng, self.label_cdf, n_tracks),
+        )
+        self.has_preview = rng.random(n_tracks) < PREVIEW_SHARE
+        # about 10 tracks per album, numbered per artist
+        order = np.argsort(self.track_artist, kind="stable")
+        first = np.searchsorted(self.track_artist[order], self.track_artist[order])
+        self.track_album = np.empty(n_tracks, dtype=np.int64)
+        self.track_album[order] = (np.arange(n_tracks) - first) // 10
+
+        seed_digit = base62([seed % 62], 1)[0]
+        self.track_ids = self.ids(rng, "t", n_tracks, seed_digit)
+        self.artist_ids = self.ids(rng, "a", self.n_artists, seed_digit)
+        self.genre_ids = self.ids(rng, "g", self.n_genres, seed_digit)
+        self.label_ids = self.ids(rng, "l", self.n_labels, seed_digit)
+
+    @staticmethod
+    def ids(rng, kind, n, seed_digit):
+        """ 22 character ids like Spotify's, unique by the row and in random order """
+        noise = base62(rng.integers(0, 62**10, n), 10)
+        rows = base62(np.arange(n), 10)
+        ids = np.char.add(np.char.add(np.char.add(kind, noise), rows), seed_digit)
+        # python strings, numpy ones are not encoded by bson
+        return np.array(ids.tolist(), dtype=object)
+
+    def correlated(self, rng, n):
+        return rng.standard_normal((n, len(FEATURES))) @ self.cholesky.T
+
+    def genres_of(self, artist):
+        start, end = self.artist_genre_ptr[artist], self.artist_genre_ptr[artist + 1]
+        return self.artist_genres[start:end]
+
+    def features(self, latent):
+        """ Feature columns from normal vectors, through the quantiles of the profile """
+        from scipy.special import ndtr
+
+        u = ndtr(latent)
+        columns = dict()
+        for i, feature in enumerate(FEATURES):
+            levels, values = self.profile["quantiles"][feature]
+            column = np.interp(u[:, i], levels, values)
+            if feature in INTEGER_FEATURES:
+                column = np.rint(column).astype(np.int64)
+            columns[feature] = column
+        return columns
+
+    def tracks(self, chunk_size=CHUNK_SIZE):
+        """ (rows, feature columns) of the tracks, chunk by chunk. The features
+        depend on the chunk size as well as the seed.
+        """
+        for chunk, start in enumerate(range(0, self.n_tracks, chunk_size)):
+            rows = np.arange(start, min(start + chunk_size, self.n_tracks))
+            rng = np.random.default_rng([self.seed, 1, chunk])
+            latent = self.artist_latent[self.track_artist[rows]] + self.correlated(
+                rng, len(rows)
+            ) * np.sqrt(1 - GENRE_SHARE - ARTIST_SHARE)
+            yield rows, self.features(latent)
+
+    def track_documents(self, rows, columns):
+        rng = np.random.default_rng([self.seed, 2, int(rows[0])])
+        track_names = names(rng, len(rows))
+        ids = self.track_ids[rows].tolist()
+        artists = self.track_artist[rows].tolist()
+        labels = self.track_label[rows].tolist()
+        previews = self.has_preview[rows].tolist()
+        albums = self.track_album[rows].tolist()
+        values = {feature: column.tolist() for feature, column in columns.items()}
+        for i, track_id in enumerate(ids):
+            artist = artists[i]
+            doc = {
+                "id": track_id,
+                "name": track_names[i],
+                "uri": f"spotify:track:{track_id}",
+                "artists": [
+                    {
+                        "id": self.artist_ids[artist],
+                        "name": self.artist_names[artist],
+                        "type": "artist",
+                    }
+                ],
+                "albums": f"{self.artist_ids[artist]}-{albums[i]}",
+                "genres": [self.genre_names[g] for g in self.genres_of(artist)],
+                "labels": self.label_names[labels[i]],
+                "preview_url": _preview_url(track_id) if previews[i] else None,
+                "release_date": str(values["year"][i]),
+            }
+            for feature in FEATURES:
+                doc[feature] = values[feature][i]
+            yield doc
+
+
+def _preview_url(track_id):
+    return f"https://p.scdn.co/mp3-preview/{track_id}"
+
+
+class Aggregates:
+    """ Feature sums of the artists and genres over the generated tracks """
+
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+        n_features = len(FEATURES)
+        self.artist_sums = np.zeros((catalogue.n_artists, n_features))
+        self.genre_sums = np.zeros((catalogue.n_genres, n_features))
+        self.genre_counts = np.zeros(catalogue.n_genres, dtype=np.int64)
+
+    def add(self, rows, columns):
+        c = self.catalogue
+        values = np.stack([columns[f] for f in FEATURES], axis=1).astype(np.float64)
+        artists = c.track_artist[rows]
+        np.add.at(self.artist_sums, artists, values)
+        tracks, genres = genre_pairs(c, artists)
+        np.add.at(self.genre_sums, genres, values[tracks])
+        self.genre_counts += np.bincount(genres, minlength=c.n_genres)
+
+
+def genre_pairs(c, artists):
+    """ (i, genre) of every genre of artists[i], a track counts for every genre of its artist """
+    n_genres = np.diff(c.artist_genre_ptr)[artists]
+    rows = np.repeat(np.arange(len(artists)), n_genres)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_genres) - n_genres, n_genres)
+    return rows, c.artist_genres[c.artist_genre_ptr[artists[rows]] + offsets]
+
+
+def distinct_pairs(a, b, n_b):
+    """ The distinct (a, b) pairs sorted by a then b """
+    keys = np.unique(a.astype(np.int64) * n_b + b)
+    return keys // n_b, keys % n_b
+
+
+def first_preview(c, tracks):
+    with_preview = tracks[c.has_preview[tracks]]
+    return _preview_url(c.track_ids[with_preview[0]]) if len(with_preview) else None
+
+
+def averages(sums, counts, row):
+    values = sums[row] / max(counts[row], 1)
+    return {feature: values[i].item() for i, feature in enumerate(FEATURES)}
+
+
+def artist_documents(c, aggregates):
+    """ The documents of artists_with_genres and artists_full, only artists with tracks """
+    counts = np.bincount(c.track_artist, minlength=c.n_artists)
+    track_order, track_ptr = ragged(c.track_artist, np.arange(c.n_tracks), c.n_artists)
+    label_artist, label = distinct_pairs(c.track_artist, c.track_label, c.n_labels)
+    label_ptr = np.searchsorted(label_artist, np.arange(c.n_artists + 1))
+    for artist in np.flatnonzero(counts).tolist():
+        base = {
+            "id": c.artist_ids[artist],
+            "name": c.artist_names[artist],
+            "genres": [c.genre_names[g] for g in c.genres_of(artist)],
+            "popularity": int(c.artist_popularity[artist]),
+            "followers": {"total": int(c.artist_popularity[artist]) ** 3},
+            "type": "artist",
+            "uri": f"spotify:artist:{c.artist_ids[artist]}",
+        }
+        tracks = track_order[track_ptr[artist] : track_ptr[artist + 1]]
+        full = {
+            **base,
+            "tracks_id": c.track_ids[tracks[:MAX_MEMBERS]].tolist(),
+            "labels": [
+                c.label_names[i]
+                for i in label[label_ptr[artist] : label_ptr[artist + 1]]
+            ],
+            "preview_url": first_preview(c, tracks),
+            **averages(aggregates.artist_sums, counts, artist),
+        }
+        yield base, full
+
+
+def genre_documents(c, aggregates):
+    tracks, genres = genre_pairs(c, c.track_artist)
+    track_order, track_ptr = ragged(genres, tracks, c.n_genres)
+    genre_of_label, label = distinct_pairs(genres, c.track_label[tracks], c.n_labels)
+    label_ptr = np.searchsorted(genre_of_label, np.arange(c.n_genres + 1))
+    for genre in np.flatnonzero(aggregates.genre_counts).tolist():
+        members = track_order[track_ptr[genre] : track_ptr[genre + 1]]
+        super_genre = SUPER_GENRES[c.genre_super[genre]]
+        yield {
+            "_id": c.genre_names[genre],
+            "id": c.genre_ids[genre],
+            "tracks_id": c.track_ids[members[:MAX_MEMBERS]].tolist(),
+            "labels": [
+                c.label_names[i] for i in label[label_ptr[genre] : label_ptr[genre + 1]]
+            ],
+            "preview_url": first_preview(c, members),
+            "genre_super": super_genre,
+            "genre_color": dbutils.label_to_color(super_genre),
+            **averages(aggregates.genre_sums, aggregates.genre_counts, genre),
+        }
+
+
+def label_documents(c):
+    track_order, track_ptr = ragged(c.track_label, np.arange(c.n_tracks), c.n_labels)
+    label_of_artist, artist = distinct_pairs(c.track_label, c.track_artist, c.n_artists)
+    artist_ptr = np.searchsorted(label_of_artist, np.arange(c.n_labels + 1))
+    tracks, genres = genre_pairs(c, c.track_artist)
+    label_of_genre, genre = distinct_pairs(c.track_label[tracks], genres, c.n_genres)
+    genre_ptr = np.searchsorted(label_of_genre, np.arange(c.n_labels + 1))
+    for label in np.flatnonzero(np.diff(track_ptr)).tolist():
+        members = track_order[track_ptr[label] : track_ptr[label + 1]]
+        artists = artist[artist_ptr[label] : artist_ptr[label + 1]]
+        yield {
+            "_id": c.label_names[label],
+            "id": c.label_ids[label],
+            "track_set": c.track_ids[members[:MAX_MEMBERS]].tolist(),
+            "artist_set": c.artist_ids[artists[:MAX_MEMBERS]].tolist(),
+            "genres": [
+                c.genre_names[g] for g in genre[genre_ptr[label] : genre_ptr[label + 1]]
+            ],
+            "preview_url": first_preview(c, members),
+            "n_tracks": len(members),
+            "n_artists": len(artists),
+        }
+
+
+def database_name(n_tracks, seed=0):
+    return f"musex_synthetic_{n_tracks}_{seed}"
+
+
+def use_database(name):
+    """ Switch to another database, forgetting what was read from the current one """
+    connection.configure(MONGO_DB=name)
+    ma.reset_cache()
+
+
+def check_database(db, allow_production=False):
+    """ Raise ValueError for the database configured for the api, which holds the
+    real catalogue, unless allow_production
+    """
+    if db.name == connection.configured("MONGO_DB") and not allow_production:
+        raise ValueError(
+            f"{db.name} is the database of the api, synthetic catalogues are only "
+            "written to it with allow_production"
+        )
+
+
+def write(
+    n_tracks,
+    seed=0,
+    profile=None,
+    chunk_size=CHUNK_SIZE,
+    batch_size=BATCH_SIZE,
+    writers=WRITERS,
+    allow_production=False,
+):
+    """ Replace tracks_full, artists_with_genres, artists_full, genres_full and
+    labels_full of the current database with a synthetic catalogue, returns the
+    number of documents per collection
+    """
+    db = ma.db
+    check_database(db, allow_production)
+    start = time.time()
+    catalogue = Catalogue(n_tracks, seed=seed, profile=profile)
+    aggregates = Aggregates(catalogue)
+    collections = [
+        "tracks_full",
+        "artists_with_genres",
+        "artists_full",
+        "genres_full",
+        "labels_full",
+    ]
+    for name in collections:
+        db[name].drop()
+
+    def writer(name):
+        return bulk.BulkWriter(
+            db[name], batch_size=batch_size, verbose=False, workers=writers
+        )
+
+    with writer("tracks_full") as tracks:
+        for rows, columns in catalogue.tracks(chunk_size):
+            aggregates.add(rows, columns)
+            for doc in catalogue.track_documents(rows, columns):
+                tracks.insert(doc)
+            done = int(rows[-1]) + 1
+            rate = done / (time.time() - start)
+            eta = timedelta(seconds=round((n_tracks - done) / rate))
+            print(f"[{done}/{n_tracks}] tracks ({rate:.0f}/s, ETA {eta})")
+    with writer("artists_with_genres") as bases, writer("artists_full") as fulls:
+        for base, full in artist_documents(catalogue, aggregates):
+            bases.insert(base)
+            fulls.insert(full)
+    with writer("genres_full") as genres:
+        for doc in genre_documents(catalogue, aggregates):
+            genres.insert(doc)
+    with writer("labels_full") as labels:
+        for doc in label_documents(catalogue):
+            labels.insert(doc)
+    counts = {
+        name: w.stats["inserted"]
+        for name, w in zip(collections, [tracks, bases, fulls, genres, labels])
+    }
+
+    db["tracks_full"].create_index("id")
+    db["tracks_full"].create_index("artists.id")
+    for name in collections[1:]:
+        db[name].create_index("id")
+    print(
+        f"wrote {', '.join(f'{n} {name}' for name, n in counts.items())} "
+        f"to {db.name} in {timedelta(seconds=round(time.time() - start))}"
+    )
+    return counts
+
+
+def create_api_collections(allow_production=False):
+    """ The api collections from the *_full collections, the steps of the ETL
+    after the super genres were assigned
+    """
+    from infovis21.mongodb import incremental, popularity
+
+    check_database(ma.db, allow_production)
+    ma.create_years_full()
+    ma.create_years_api()
+    ma.create_genres_api()
+    ma.create_artists_api()
+    ma.create_labels_api()
+    dbutils.update_tracks_api_to_include_artists()
+    dbutils.assign_super_genres("artists_api")
+    dbutils.assign_super_genres("genres_api")
+    ma.update_dim_minmax()
+    for kind, out, use_super in incremental.POPULARITY_PER_YEAR:
+        compute = getattr(dbutils, f"compute_{kind}_popularity_per_year")
+        compute(out=out, use_super_genre=use_super)
+    dbutils.add_genre_super_info("genre", "genre", "name")
+    dbutils.add_genre_super_info("artist", "artist", "id")
+    popularity.materialize()
@@ -0,0 +1,302 @@
+import uuid
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import spatial
+from infovis21.mongodb import utils as dbutils
+
+# All precomputed layers live in two collections instead of one collection per
+# (dimx, dimy, typ, zoom) layer. Documents are keyed by their layer and the tile
+# (a cell of spatial.grid_size(zoom)) that contains them. A layer is stored only
+# once per unordered dimension pair, (dimy, dimx) is served from (dimx, dimy)
+# by swapping the axes.
+#
+# A layer is rewritten next to its old documents: the new ones are inserted as
+# staged, which readers skip (see live_key), and replace the old ones only when
+# all of them are written, so the api never serves a layer that is half written.
+NODES_COLLECTION = "tile_nodes"
+LINKS_COLLECTION = "tile_links"
+
+# node fields that the graph endpoint can return, everything else is not stored
+node_fields = [
+    "id",
+    "name",
+    "preview_url",
+    "genre_color",
+    "artists",
+    "popularity",
+    "genres",
+    "genre_super",
+]
+link_fields = ["src", "dest", "color", "name"]
+
+_swap = {"x": "y", "y": "x", "x1": "y1", "y1": "x1", "x2": "y2", "y2": "x2"}
+
+
+def nodes_collection():
+    return ma.db[NODES_COLLECTION]
+
+
+def links_collection():
+    return ma.db[LINKS_COLLECTION]
+
+
+def canonical_pair(dimx, dimy):
+    """ Return the stored (dimx, dimy) pair and whether the axes are swapped """
+    if dimx <= dimy:
+        return dimx, dimy, False
+    return dimy, dimx, True
+
+
+def layer_key(dimx, dimy, typ, zoom):
+    """ Filter for all documents of a stored layer """
+    return {"dimx": dimx, "dimy": dimy, "type": typ, "zoom": int(zoom)}
+
+
+def live_key(dimx, dimy, typ, zoom):
+    """ Filter for the documents of a stored layer that are served, without the
+    staged documents of a rewrite in progress
+    """
+    return {**layer_key(dimx, dimy, typ, zoom), "staged": {"$exists": False}}
+
+
+def create_indexes():
+    """ Indexes of the tile store, created once before layers are written """
+    key = [("dimx", ma.ASC), ("dimy", ma.ASC), ("type", ma.ASC), ("zoom", ma.ASC)]
+    nodes_collection().create_index(key + [("tile", ma.ASC)])
+    # multikey index, a link is listed under every tile that it passes through
+    links_collection().create_index(key + [("tiles", ma.ASC)])
+
+
+def node_document(dimx, dimy, typ, zoom, node, n_tiles):
+    """ Stored form of a precomputed node, x and y must be normalized """
+    doc = {field: node.get(field) for field in node_fields}
+    tx, ty = spatial.cell_coords([node["x"], node["y"]], n_tiles)
+    doc.update(layer_key(dimx, dimy, typ, zoom))
+    doc.update(
+        {
+            "x": node["x"],
+            "y": node["y"],
+            "tx": int(tx),
+            "ty": int(ty),
+            "tile": int(ty * n_tiles + tx),
+        }
+    )
+    return doc
+
+
+def link_document(dimx, dimy, typ, zoom, link, n_tiles):
+    """ Stored form of a precomputed link with the tiles that it passes through """
+    doc = {field: link.get(field) for field in link_fields}
+    doc.update(layer_key(dimx, dimy, typ, zoom))
+    doc.update({dim: link[dim] for dim in ("x1", "y1", "x2", "y2")})
+    doc["tiles"] = spatial.segment_cells(
+        link["x1"], link["y1"], link["x2"], link["y2"], n_tiles
+    )
+    return doc
+
+
+def swap_axes(doc):
+    """ Swap the x and y coordinates of a node or link document in place """
+    values = {key: doc[key] for key in _swap if key in doc}
+    for key, value in values.items():
+        doc[_swap[key]] = value
+    if "tx" in doc:
+        doc["tx"], doc["ty"] = doc["ty"], doc["tx"]
+    return doc
+
+
+def write_layer(dimx, dimy, typ, zoom, nodes, links):
+    """ Replace a layer, the nodes and links must use the axes of (dimx, dimy) """
+    sdimx, sdimy, swapped = canonical_pair(dimx, dimy)
+    if swapped:
+        nodes = [swap_axes(dict(node)) for node in nodes]
+        links = [swap_axes(dict(link)) for link in links]
+    n_tiles = spatial.grid_size(zoom, dbutils.N_ZOOM_LEVELS)
+    key = layer_key(sdimx, sdimy, typ, zoom)
+    generation = uuid.uuid4().hex
+    staged = {"generation": generation, "staged": True}
+
+    if len(nodes) > 0:
+        nodes_collection().insert_many(
+            [
+                {**node_document(sdimx, sdimy, typ, zoom, node, n_tiles), **staged}
+                for node in nodes
+            ],
+            ordered=False,
+        )
+    if len(links) > 0:
+        links_collection().insert_many(
+            [
+                {**link_document(sdimx, sdimy, typ, zoom, link, n_tiles), **staged}
+                for link in links
+            ],
+            ordered=False,
+        )
+    # serve the new generation, then drop the old one and what an interrupted
+    # rewrite left behind
+    for coll in [nodes_collection(), links_collection()]:
+        coll.update_many({**key, "generation": generation}, {"$unset": {"staged": ""}})
+    for coll in [nodes_collection(), links_collection()]:
+        coll.delete_many({**key, "generation": {"$ne": generation}})
+
+
+def drop_layer(dimx, dimy, typ, zoom):
+    sdimx, sdimy, _ = canonical_pair(dimx, dimy)
+    key = layer_key(sdimx, sdimy, typ, zoom)
+    nodes_collection().delete_many(key)
+    links_collection().delete_many(key)
+
+
+def _project(projection, swapped):
+    """ Point $x/$y style references of a projection to the stored axes """
+    if not swapped:
+        return projection
+    return {
+        key: (
+            "$" + _swap[value[1:]]
+            if isinstance(value, str) and value[1:] in _swap
+            else value
+        )
+        for key, value in projection.items()
+    }
+
+
+def nodes_pipeline(
+    dimx, dimy, typ, zoom, x_min, x_max, y_min, y_max, projection, limit=None
+):
+    """ Pipeline for the nodes of a layer inside the viewport, the projection and
+    the bounds are given in the axes of (dimx, dimy)
+    """
+    sdimx, sdimy, swapped = canonical_pair(dimx, dimy)
+    if swapped:
+        x_min, x_max, y_min, y_max = y_min, y_max, x_min, x_max
+    tiles = spatial.viewport_cells(
+        x_min, x_max, y_min, y_max, spatial.grid_size(zoom, dbutils.N_ZOOM_LEVELS)
+    )
+    match = live_key(sdimx, sdimy, typ, zoom)
+    match.update(
+        {
+            "tile": {"$in": tiles},
+            "x": {"$gte": x_min, "$lte": x_max},
+            "y": {"$gte": y_min, "$lte": y_max},
+        }
+    )
+    pipeline = [{"$match": match}]
+    if limit:
+        # sorted so that the same nodes are returned for the same viewport
+        pipeline += [{"$sort": {"id": ma.ASC}}, {"$limit": int(limit)}]
+    pipeline.append({"$project": _project(projection, swapped)})
+    return pipeline
+
+
+def find_nodes(
+    dimx, dimy, typ, zoom, x_min, x_max, y_min, y_max, projection, limit=None
+):
+    """ Nodes of a layer inside the viewport, see nodes_pipeline """
+    pipeline = nodes_pipeline(
+        dimx, dimy, typ, zoom, x_min, x_max, y_min, y_max, projection, limit=limit
+    )
+    return list(nodes_collection().aggregate(pipeline))
+
+
+# the coordinates of the candidate links are needed for the exact test
+_link_coords = {"_x1": "$x1", "_y1": "$y1", "_x2": "$x2", "_y2": "$y2"}
+
+
+def links_pipeline(dimx, dimy, typ, zoom, x_min, x_max, y_min, y_max, projection):
+    """ Pipeline for the candidate links of a layer that pass through the tiles of
+    the viewport, same conventions as nodes_pipeline. The candidates have to be
+    filtered with crossing_links.
+    """
+    sdimx, sdimy, swapped = canonical_pair(dimx, dimy)
+    if swapped:
+        x_min, x_max, y_min, y_max = y_min, y_max, x_min, x_max
+    tiles = spatial.viewport_cells(
+        x_min, x_max, y_min, y_max, spatial.grid_size(zoom, dbutils.N_ZOOM_LEVELS)
+    )
+    match = live_key(sdimx, sdimy, typ, zoom)
+    match["tiles"] = {"$in": tiles}
+    return [
+        {"$match": match},
+        {"$project": {**_project(projection, swapped), **_link_coords}},
+    ]
+
+
+def crossing_links(links, dimx, dimy, x_min, x_max, y_min, y_max):
+    """ Keep the candidate links that really cross the viewport """
+    if len(links) == 0:
+        return links
+    if canonical_pair(dimx, dimy)[2]:
+        x_min, x_max, y_min, y_max = y_min, y_max, x_min, x_max
+    x1, y1, x2, y2 = zip(
+        *[(link["_x1"], link["_y1"], link["_x2"], link["_y2"]) for link in links]
+    )
+    crossing = spatial.segments_intersect_box(
+        x1, y1, x2, y2, x_min, x_max, y_min, y_max
+    )
+    result = []
+    for link, keep in zip(links, crossing):
+        if keep:
+            for key in _link_coords:
+                del link[key]
+            result.append(link)
+    return result
+
+
+def find_links(dimx, dimy, typ, zoom, x_min, x_max, y_min, y_max, projection):
+    """ Links of a layer that cross the viewport, same conventions as find_nodes """
+    bounds = (x_min, x_max, y_min, y_max)
+    pipeline = links_pipeline(dimx, dimy, typ, zoom, *bounds, projection)
+    links = list(links_collection().aggregate(pipeline))
+    return crossing_links(links, dimx, dimy, *bounds)
+
+
+def tile_bounds(zoom, tx, ty):
+    """ Return (x_min, x_max, y_min, y_max) of a tile in the normalized space """
+    n_tiles = spatial.grid_size(zoom, dbutils.N_ZOOM_LEVELS)
+    return spatial.cell_bounds(ty * n_tiles + tx, n_tiles)
+
+
+def viewport_tiles(zoom, x_min, x_max, y_min, y_max):
+    """ (tx, ty) of all tiles of a zoom level that overlap the viewport """
+    n_tiles = spatial.grid_size(zoom, dbutils.N_ZOOM_LEVELS)
+    return [
+        tuple(reversed(divmod(tile, n_tiles)))
+        for tile in spatial.viewport_cells(x_min, x_max, y_min, y_max, n_tiles)
+    ]
+
+
+def tile_pipelines(dimx, dimy, typ, zoom, tx, ty, node_projection, link_projection):
+    """ Pipelines for the nodes inside a tile and the links passing through it, in
+    the axes of (dimx, dimy). The content only depends on the arguments and is
+    sorted, so responses for a tile can be cached. A link that crosses several
+    tiles is part of all of them.
+    """
+    sdimx, sdimy, swapped = canonical_pair(dimx, dimy)
+    if swapped:
+        tx, ty = ty, tx
+    tile = ty * spatial.grid_size(zoom, dbutils.N_ZOOM_LEVELS) + tx
+
+    match = live_key(sdimx, sdimy, typ, zoom)
+    nodes = [
+        {"$match": {**match, "tile": tile}},
+        {"$sort": {"id": ma.ASC}},
+        {"$project": _project(node_projection, swapped)},
+    ]
+    links = [
+        {"$match": {**match, "tiles": tile}},
+        {"$sort": {"src": ma.ASC, "dest": ma.ASC, "name": ma.ASC}},
+        {"$project": _project(link_projection, swapped)},
+    ]
+    return nodes, links
+
+
+def find_tile(dimx, dimy, typ, zoom, tx, ty, node_projection, link_projection):
+    """ Nodes and links of a tile, see tile_pipelines """
+    nodes, links = tile_pipelines(
+        dimx, dimy, typ, zoom, tx, ty, node_projection, link_projection
+    )
+    return (
+        list(nodes_collection().aggregate(nodes)),
+        list(links_collection().aggregate(links)),
+    )
@@ -3,13 +3,10 @@ import math
 import time
 from pprint import pprint
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import seaborn as sns
-from sklearn.neighbors import KDTree
 
 from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import bulk, spatial, tiles
 
 
 def add_genre_super_info(base_coll_name, local_field, foreign_field):
@@ -39,51 +36,25 @@ def add_genre_super_info(base_coll_name, local_field, foreign_field):
     ma.db[f"{base_coll_name}s_api"].drop_index("name_1")
 
 
-def update_tracks_api_to_include_artists():
-    def label_to_color(label):
-        if label == "Classical":
-            return "#9370db"  # purple
-        if label == "Electronic":
-            return "#32cd32"  # green
-        if label == "Hiphop":
-            return "#ffbf00"  # orange
-        if label == "Rock":
-            return "#ff0000"  # red
-        if label == "Pop":
-            return "#ff69b4"  # pink
-        if label == "Indie":
-            return "#1e90ff"  # blue
-
-    project_stage = {
-        "$project": {
-            "id": 1,
-            "name": 1,
-            "preview_url": 1,
-            "genres": 1,
-            "labels": 1,
-            "danceability": 1,
-            "duration_ms": 1,
-            "energy": 1,
-            "instrumentalness": 1,
-            "liveness": 1,
-            "loudness": 1,
-            "speechiness": 1,
-            "tempo": 1,
-            "valence": 1,
-            "popularity": 1,
-            "key": 1,
-            "mode": 1,
-            "acousticness": 1,
-            "year": 1,
-            "artists": 1,
-        }
-    }
-    ma.db["tracks_api"].drop()
-    ma.db["tracks_full"].aggregate(
-        [{"$set": {"labels": ["$labels"]}}, project_stage, {"$out": "tracks_api"},]
-    )
-
-    ma.db["tracks_api"].create_index("id")
+def label_to_color(label):
+    if label == "Classical":
+        return "#9370db"  # purple
+    if label == "Electronic":
+        return "#32cd32"  # green
+    if label == "Hiphop":
+        return "#ffbf00"  # orange
+    if label == "Rock":
+        return "#ff0000"  # red
+    if label == "Pop":
+        return "#ff69b4"  # pink
+    if label == "Indie":
+        return "#1e90ff"  # blue
+
+
+def assign_super_genres(coll_name, ids=None):
+    """ Sets genre_super and genre_color of the documents of an *_api collection
+    (only those with the given ids) to the most frequent super genre of their genres
+    """
     pipeline = [
         {"$unwind": "$genres"},
         {
@@ -117,15 +88,58 @@ def update_tracks_api_to_include_artists():
             }
         },
     ]
-    res = list(ma.db[f"tracks_api"].aggregate(pipeline, allowDiskUse=True))
-    for doc in res:
-        label = sorted(doc["genre_info"], key=lambda k: k["genre_super_freq"])[-1][
-            "genre_super"
+    if ids is not None:
+        pipeline.insert(0, {"$match": {"id": {"$in": list(ids)}}})
+    res = ma.db[coll_name].aggregate(pipeline, allowDiskUse=True)
+    with bulk.BulkWriter(ma.db[coll_name]) as writer:
+        for doc in res:
+            label = sorted(doc["genre_info"], key=lambda k: k["genre_super_freq"])[-1][
+                "genre_super"
+            ]
+            writer.update(
+                {"id": doc["_id"]},
+                {"$set": {"genre_super": label, "genre_color": label_to_color(label)}},
+            )
+
+
+tracks_api_project_stage = {
+    "$project": {
+        "id": 1,
+        "name": 1,
+        "preview_url": 1,
+        "genres": 1,
+        "labels": 1,
+        "danceability": 1,
+        "duration_ms": 1,
+        "energy": 1,
+        "instrumentalness": 1,
+        "liveness": 1,
+        "loudness": 1,
+        "speechiness": 1,
+        "tempo": 1,
+        "valence": 1,
+        "popularity": 1,
+        "key": 1,
+        "mode": 1,
+        "acousticness": 1,
+        "year": 1,
+        "artists": 1,
+    }
+}
+
+
+def update_tracks_api_to_include_artists():
+    ma.db["tracks_api"].drop()
+    ma.db["tracks_full"].aggregate(
+        [
+            {"$set": {"labels": ["$labels"]}},
+            tracks_api_project_stage,
+            {"$out": "tracks_api"},
         ]
-        ma.db[f"tracks_api"].update_one(
-            {"id": doc["_id"]},
-            {"$set": {"genre_super": label, "genre_color": label_to_color(label)}},
-        )
+    )
+
+    ma.db["tracks_api"].create_index("id")
+    assign_super_genres("tracks_api")
 
 
 def normalize(dim, value, _min=0.0, _max=1.0):
@@ -142,22 +156,7 @@ def create_vector(node):
 
 def create_vector_sim(node):
     """ extract feature vector from a document for similiarity calculation"""
-    dimensions = [
-        "danceability",
-        # "duration_ms",
-        "energy",
-        "speechiness",
-        # "tempo",
-        "valence",
-        # "popularity",
-        # "key",
-        # "mode",
-        "acousticness",
-        "instrumentalness",
-        # "liveness",
-        # "loudness",
-    ]
-    return np.array([node[dim] for dim in dimensions])
+    return np.array([node[dim] for dim in ma.similarity_dimensions])
 
 
 def _precomputed_collection(dimx, dimy, typ, zoom, *args):
@@ -202,113 +201,237 @@ BASE_RADI = {
 }
 
 
-def precompute_nodes(dimx, dimy, typ, zoom, offset=0, limit=None, plot=False):
-    print("-" * 50)
-    nodes_out = precomputed_nodes_collection(dimx, dimy, typ, zoom)
-    links_out = precomputed_links_collection(dimx, dimy, typ, zoom)
-    discarded_out = precomputed_discarded_collection(dimx, dimy, typ, zoom)
-
+def zoom_radius(typ, zoom):
+    """ Minimum distance between the nodes of a layer """
     base_radius = BASE_RADI[typ]
     # ZOOM_LEVELS = [base_radius / (2 ** i) for i in range(N_ZOOM_LEVELS - 0)]
     ZOOM_LEVELS = [scale_func(base_radius, i) for i in range(N_ZOOM_LEVELS - 0)]
     # if ZOOM + [0.0]
-    radius = ZOOM_LEVELS[zoom]
-    print("precomputing", dimx, dimy, typ, zoom, ZOOM_LEVELS[zoom])
+    return ZOOM_LEVELS[zoom]
 
+
+def load_precompute_source(typ, offset=0, limit=None):
+    """ Load everything precompute_nodes needs from the database in one go.
+
+        The source only depends on the node type, so it can be shared by all
+        (dimx, dimy, zoom) layers of that type.
+    """
     pipeline = [
         {"$match": {}},
-        {"$sort": {"$id": ma.DESC}},
+        {"$sort": {"id": ma.DESC}},
         {"$skip": int(offset)},
     ]
     if limit is not None:
         pipeline.append({"$limit": int(limit)})
 
-    # load all nodes from the database
+    # load all nodes from the database, one node per id
     nodes_data = dict()
-    for idx, elem in enumerate(
-        ma.collections[typ].aggregate(pipeline, allowDiskUse=True)
-    ):
-        x, y = normalize(dimx, elem.get(dimx)), normalize(dimy, elem.get(dimy))
-        nodes_data[elem.get("id")] = (np.array([x, y]), elem.get("id"), elem)
-        # pprint(elem)
-    print("got %d nodes" % len(nodes_data))
-
-    # filter nodes based on distance
-    points, _, _ = zip(*nodes_data.values())
-    filtered, discarded, duration = min_distance_based_filtering(points, radius=radius)
-    filtered_nodes = [list(nodes_data.values())[idx] for idx in filtered]
-    preprocessed_nodes = [
-        {**node, **{"x": pos[0], "y": pos[1]}} for pos, _, node in filtered_nodes
-    ]
-    # pprint(nodes[:10])
-
-    filtered_points, filtered_node_ids, _ = zip(*filtered_nodes)
-    print(
-        "reduced from %d to %d in %f sec"
-        % (len(nodes_data), len(filtered_nodes), duration)
-    )
-
-    # plot filtered nodes
-    if False and plot:
-        dims = ["x", "y"]
-        sns.scatterplot(data=pd.DataFrame(points, columns=dims), x="x", y="y")
-        plt.show()
-        sns.scatterplot(data=pd.DataFrame(filtered_nodes, columns=dims), x="x", y="y")
-        plt.show()
+    for elem in ma.collections[typ].aggregate(pipeline, allowDiskUse=True):
+        nodes_data[elem.get("id")] = elem
+    docs = list(nodes_data.values())
+
+    columns = dict()
+    for dim in ma.dimensions:
+        columns[dim] = np.array(
+            [np.nan if doc.get(dim) is None else doc[dim] for doc in docs],
+            dtype=np.float64,
+        )
 
-    # compute all visible links with their coordinates so that they can be queried
-    # more efficiently
+    # the record labels and their members, used to compute the links
     pipeline = [
         {"$unwind": "$labels"},
         {"$group": {"_id": "$labels", "members": {"$addToSet": "$id"}}},
         {"$project": {"id": "$_id", "members": "$members",}},
     ]
+    music_labels = list(ma.collections[typ].aggregate(pipeline, allowDiskUse=True))
+
+    # members of label i are label_members[label_ptr[i]:label_ptr[i + 1]], stored as
+    # positions in docs so that links can be computed with array operations
+    ids = list(nodes_data.keys())
+    position = {_id: idx for idx, _id in enumerate(ids)}
+    members = [
+        [position[_id] for _id in music_label["members"] if _id in position]
+        for music_label in music_labels
+    ]
+    label_ptr = np.zeros(len(members) + 1, dtype=np.int64)
+    label_ptr[1:] = np.cumsum([len(m) for m in members])
+    label_members = np.array(list(itertools.chain(*members)), dtype=np.int64)
+
+    return {
+        "typ": typ,
+        "docs": docs,
+        "ids": ids,
+        "columns": columns,
+        "labels": music_labels,
+        "label_ptr": label_ptr,
+        "label_members": label_members,
+    }
 
+
+def source_points(source, dimx, dimy):
+    """ Positions of all nodes of a source in the normalized [0, 1]^2 space """
+    return np.stack(
+        [
+            normalize(dimx, source["columns"][dimx]),
+            normalize(dimy, source["columns"][dimy]),
+        ],
+        axis=1,
+    )
+
+
+def layer_links(source, points, filtered):
+    """ Links between the kept nodes, a label is drawn as a link if exactly two of
+    its members are kept
+    """
+    kept = np.zeros(len(points), dtype=bool)
+    kept[filtered] = True
+    label_ptr, label_members = source["label_ptr"], source["label_members"]
+    member_kept = kept[label_members]
+    label_of_member = np.repeat(np.arange(len(label_ptr) - 1), np.diff(label_ptr))
+    n_kept = np.bincount(
+        label_of_member, weights=member_kept, minlength=len(label_ptr) - 1
+    )
+
+    ids = source["ids"]
     preprocessed_links = []
-    filtered_node_ids = set(filtered_node_ids)
-    for idx, music_label in enumerate(ma.collections[typ].aggregate(pipeline)):
-        members = set(music_label["members"])
-        link_nodes = members.intersection(filtered_node_ids)
-        if len(link_nodes) == 2:
-            src_id, dest_id = link_nodes
-            (src_pos, src, _), (dest_pos, dest, _) = (
-                nodes_data.get(src_id),
-                nodes_data.get(dest_id),
-            )
-            preprocessed_links.append(
-                {
-                    "src": src_id,
-                    "dest": dest_id,
-                    "color": music_label.get("genre_color"),
-                    "name": music_label.get("id"),
-                    "x1": src_pos[0],
-                    "y1": src_pos[1],
-                    "x2": dest_pos[0],
-                    "y2": dest_pos[1],
-                }
+    for label_idx in np.flatnonzero(n_kept == 2):
+        music_label = source["labels"][label_idx]
+        members = label_members[label_ptr[label_idx] : label_ptr[label_idx + 1]]
+        src, dest = members[
+            member_kept[label_ptr[label_idx] : label_ptr[label_idx + 1]]
+        ]
+        preprocessed_links.append(
+            {
+                "src": ids[src],
+                "dest": ids[dest],
+                "color": music_label.get("genre_color"),
+                "name": music_label.get("id"),
+                "x1": float(points[src][0]),
+                "y1": float(points[src][1]),
+                "x2": float(points[dest][0]),
+                "y2": float(points[dest][1]),
+            }
+        )
+    return preprocessed_links
+
+
+def compute_pyramid(source, dimx, dimy, typ, min_zoom=0, plot=False):
+    """ Thin out the nodes of a source for all zoom levels from the finest down to
+    min_zoom. Every level is derived from the nodes kept by the next finer level,
+    so the levels nest and a node stays visible when zooming in. Returns the kept
+    node positions per zoom level.
+    """
+    docs = source["docs"]
+    print("got %d nodes" % len(docs))
+    # the points are computed once and shared by all zoom levels
+    points = source_points(source, dimx, dimy)
+
+    levels = dict()
+    survivors = np.arange(len(points))
+    for zoom in reversed(range(min_zoom, N_ZOOM_LEVELS)):
+        radius = zoom_radius(typ, zoom)
+        print("precomputing", dimx, dimy, typ, zoom, radius)
+        # filter nodes based on distance
+        filtered, discarded, duration = spatial.poisson_disk_filtering(
+            points[survivors], radius=radius
+        )
+        survivors = survivors[np.asarray(sorted(filtered), dtype=np.int64)]
+        levels[zoom] = survivors
+        print("reduced to %d in %f sec" % (len(survivors), duration))
+
+        # plot filtered nodes
+        if plot:
+            # plotting libraries are slow to import and only needed here
+            import matplotlib.pyplot as plt
+            import pandas as pd
+            import seaborn as sns
+
+            dims = ["x", "y"]
+            sns.scatterplot(data=pd.DataFrame(points, columns=dims), x="x", y="y")
+            plt.show()
+            sns.scatterplot(
+                data=pd.DataFrame(points[survivors], columns=dims), x="x", y="y"
             )
+            plt.show()
+    return points, levels
 
-    # plot filtered nodes
-    if plot:
-        import networkx as nx
-
-        G = nx.Graph()
-        G.add_nodes_from(filtered_node)
-        dims = ["x", "y"]
-        sns.scatterplot(data=pd.DataFrame(points, columns=dims), x="x", y="y")
-        plt.show()
-        sns.scatterplot(data=pd.DataFrame(filtered_nodes, columns=dims), x="x", y="y")
-        plt.show()
 
+def compute_layer(source, points, filtered):
+    """ Node documents and links of one layer """
+    docs = source["docs"]
+    preprocessed_nodes = [
+        {**docs[idx], **{"x": float(points[idx][0]), "y": float(points[idx][1])}}
+        for idx in filtered
+    ]
+    # compute all visible links with their coordinates so that they can be queried
+    # more efficiently
+    preprocessed_links = layer_links(source, points, filtered)
     print("computed %d links" % len(preprocessed_links))
+    return preprocessed_nodes, preprocessed_links
+
 
-    nodes_out.drop()
-    if len(preprocessed_nodes) > 0:
-        nodes_out.insert_many(preprocessed_nodes)
-    links_out.drop()
-    if len(preprocessed_links) > 0:
-        links_out.insert_many(preprocessed_links)
-    discarded_out.drop()
+def write_layer(dimx, dimy, typ, zoom, nodes, links):
+    """ Replace a layer in the tile store """
+    tiles.write_layer(dimx, dimy, typ, zoom, nodes, links)
+
+
+def precompute_pyramid(
+    dimx, dimy, typ, zooms=None, offset=0, limit=None, plot=False, source=None
+):
+    """ Precompute the given zoom levels (default: all) of a dimension pair, the
+    source can be passed in to avoid reloading it
+    """
+    print("-" * 50)
+    zooms = sorted(zooms if zooms is not None else range(N_ZOOM_LEVELS))
+    if source is None:
+        source = load_precompute_source(typ, offset=offset, limit=limit)
+    points, levels = compute_pyramid(
+        source, dimx, dimy, typ, min_zoom=zooms[0], plot=plot
+    )
+    counts = dict()
+    for zoom in zooms:
+        nodes, links = compute_layer(source, points, levels[zoom])
+        write_layer(dimx, dimy, typ, zoom, nodes, links)
+        counts[zoom] = (len(nodes), len(links))
+    return counts
+
+
+def precompute_nodes(
+    dimx, dimy, typ, zoom, offset=0, limit=None, plot=False, source=None
+):
+    """ Precompute one layer, the finer levels are computed as well (but not
+    written) so that the layer nests with the rest of the pyramid
+    """
+    counts = precompute_pyramid(
+        dimx,
+        dimy,
+        typ,
+        zooms=[zoom],
+        offset=offset,
+        limit=limit,
+        plot=plot,
+        source=source,
+    )
+    return counts[zoom]
+
+
+def migrate_precomputed_layer(dimx, dimy, typ, zoom, drop=False, copy=True):
+    """ Copy a layer from its old per layer collections into the tile store,
+    the old collections are dropped if drop is set
+    """
+    old = [
+        precomputed_nodes_collection(dimx, dimy, typ, zoom),
+        precomputed_links_collection(dimx, dimy, typ, zoom),
+        precomputed_discarded_collection(dimx, dimy, typ, zoom),
+    ]
+    nodes = list(old[0].find({}, {"_id": 0})) if copy else []
+    links = list(old[1].find({}, {"_id": 0})) if copy else []
+    if len(nodes) > 0:
+        tiles.write_layer(dimx, dimy, typ, zoom, nodes, links)
+    if drop:
+        for coll in old:
+            coll.drop()
+    return len(nodes), len(links)
 
 
 def min_distance_based_filtering(points, radius=0.1, verbosity=100_000):
@@ -319,6 +442,8 @@ def min_distance_based_filtering(points, radius=0.1, verbosity=100_000):
     if radius == 0:
         return points_idx, None, 0
 
+    from sklearn.neighbors import KDTree
+
     start = time.time()
     tree = KDTree(points)
 
@@ -404,9 +529,11 @@ def compute_track_api(out="tracks_api"):
 
 
 def compute_artist_popularity_per_year(
-    out="artist_popularity_per_year", use_super_genre=True
+    out="artist_popularity_per_year", use_super_genre=True, years=None
 ):
-    ma.db[out].drop()
+    """ Popularity per year of the artists (or super genres) of the tracks,
+    recomputes only the given years if years is not None
+    """
     pipeline = [
         {
             "$project": {
@@ -449,8 +576,15 @@ def compute_artist_popularity_per_year(
             }
         },
         {"$sort": {"year": 1, "popularity": -1}},
-        {"$out": out},
     ]
+    if years is None:
+        ma.db[out].drop()
+        pipeline.append({"$out": out})
+    else:
+        years = list(years)
+        ma.db[out].delete_many({"year": {"$in": years}})
+        pipeline.insert(0, {"$match": {"year": {"$in": years}}})
+        pipeline.append({"$merge": {"into": out, "whenNotMatched": "insert"}})
     ma.coll_tracks.aggregate(
         pipeline, allowDiskUse=True,
     )
@@ -458,9 +592,11 @@ def compute_artist_popularity_per_year(
 
 
 def compute_genre_popularity_per_year(
-    out="genre_popularity_per_year", use_super_genre=True
+    out="genre_popularity_per_year", use_super_genre=True, years=None
 ):
-    db[out].drop()
+    """ Popularity per year of the genres (or super genres) of the tracks,
+    recomputes only the given years if years is not None
+    """
     pipeline = [
         {
             "$project": {
@@ -498,8 +634,15 @@ def compute_genre_popularity_per_year(
             }
         },
         {"$sort": {"year": 1, "popularity": -1}},
-        {"$out": out},
     ]
+    if years is None:
+        ma.db[out].drop()
+        pipeline.append({"$out": out})
+    else:
+        years = list(years)
+        ma.db[out].delete_many({"year": {"$in": years}})
+        pipeline.insert(0, {"$match": {"year": {"$in": years}}})
+        pipeline.append({"$merge": {"into": out, "whenNotMatched": "insert"}})
     ma.coll_tracks.aggregate(
         pipeline, allowDiskUse=True,
     )
@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Cache of the 30 second mp3 previews of the tracks, <track id>.mp3 in CACHE_DIR.
+# The manifest in the cache has one JSON line per preview with its size and
+# sha1, or per track that has no preview. Lines are appended as downloads
+# finish, so an interrupted download keeps everything it wrote, and files are
+# only moved into place once they are complete.
+CACHE_DIR = Path(
+    os.environ.get(
+        "MUSEX_PREVIEW_CACHE_DIR",
+        Path(__file__).resolve().parent.parent.parent / "data" / "cache" / "previews",
+    )
+)
+MANIFEST = "manifest.jsonl"
+WORKERS = 8
+CHUNK_SIZE = 64 * 1024
+# seconds
+TIMEOUT = 30
+# retries of a download that failed on the server side or the connection
+RETRIES = 3
+
+# The api serves the cached previews at /<version>/preview/<track id>. A preview
+# of a track never changes, clients may keep it for a year without asking again.
+MAX_AGE = 365 * 24 * 3600
+MIMETYPE = "audio/mpeg"
+# Spotify ids are base 62, anything else is not looked up (nor used as a path)
+_track_id = re.compile(r"^[0-9A-Za-z]{1,64}$")
+
+
+def preview_path(track_id, cache_dir=CACHE_DIR):
+    return Path(cache_dir) / f"{track_id}.mp3"
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """ The previews in a cache directory, the last line of a track id wins """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.path = Path(cache_dir) / MANIFEST
+        self.entries = dict()
+        self._file = None
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of a run that was killed while writing it
+                        continue
+                    if entry.get("removed"):
+                        self.entries.pop(entry["id"], None)
+                    else:
+                        self.entries[entry["id"]] = entry
+
+    def _append(self, entry):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def add(self, entry):
+        self._append(entry)
+        self.entries[entry["id"]] = entry
+
+    def remove(self, track_id):
+        self._append({"id": track_id, "removed": True})
+        self.entries.pop(track_id, None)
+
+    def compact(self):
+        """ Rewrite the manifest with one line per track """
+        self.close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".part")
+        with os.fdopen(fd, "w") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def file_entry(track_id, path, url=None):
+    return {
+        "id": track_id,
+        "url": url,
+        "size": path.stat().st_size,
+        "sha1": file_sha1(path),
+        "at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def is_valid(entry, path, checksum=False):
+    """ Whether the file of a manifest entry is complete, checksum compares the sha1 as well """
+    try:
+        if path.stat().st_size != entry.get("size"):
+            return False
+    except FileNotFoundError:
+        return False
+    return not checksum or file_sha1(path) == entry.get("sha1")
+
+
+def http_session(workers=WORKERS, retries=RETRIES):
+    """ Session with a connection pool for every worker that retries failed downloads """
+    import requests
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=workers, pool_maxsize=workers, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_preview(session, url, path, timeout=TIMEOUT):
+    """ Download to a temporary file next to path and move it into place when
+    it is complete, returns its size and sha1
+    """
+    with session.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        fd, tmp = tempfile.mkstemp(
+            dir=path.parent, prefix=f".{path.stem}.", suffix=".part"
+        )
+        try:
+            h, size = hashlib.sha1(), 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    h.update(chunk)
+                    size += len(chunk)
+            expected = response.headers.get("Content-Length")
+            if expected is not None and "Content-Encoding" not in response.headers:
+                if int(expected) != size:
+                    raise IOError(f"{url}: got {size} of {expected} bytes")
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return size, h.hexdigest()
+
+
+def resolve_urls(track_ids, sp, manifest, workers=WORKERS, backoff=None):
+    """ Preview urls of the tracks, 50 tracks per Spotify request. Tracks
+    without a preview are added to the manifest as missing.
+    """
+    from infovis21.mongodb import enrich
+
+    urls = dict()
+
+    def write(batch, tracks):
+        for track_id, track in zip(batch, tracks):
+            url = track.get("preview_url") if track is not None else None
+            if url:
+                urls[track_id] = url
+            else:
+                manifest.add({"id": track_id, "missing": True})
+
+    enrich.run_batches(
+        "tracks",
+        list(track_ids),
+        lambda batch: sp.tracks(batch)["tracks"],
+        write,
+        workers=workers,
+        backoff=backoff,
+    )
+    return urls
+
+
+def download(
+    track_ids,
+    sp=None,
+    cache_dir=CACHE_DIR,
+    workers=WORKERS,
+    session=None,
+    verify=False,
+    backoff=None,
+):
+    """ Download the previews of the tracks that are not in the cache yet.
+    verify compares the sha1 of the cached files with the manifest and
+    downloads the ones that do not match again. Returns the counts per outcome.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # left over by a run that was killed
+    for part in cache_dir.glob(".*.part"):
+        part.unlink()
+    manifest = Manifest(cache_dir)
+    stats = {"cached": 0, "missing": 0, "downloaded": 0, "failed": 0, "bytes": 0}
+
+    todo = []
+    for track_id in dict.fromkeys(track_ids):
+        entry = manifest.entries.get(track_id)
+        path = preview_path(track_id, cache_dir)
+        if entry is not None and entry.get("missing"):
+            stats["missing"] += 1
+        elif entry is not None and is_valid(entry, path, checksum=verify):
+            stats["cached"] += 1
+        elif entry is None and path.exists():
+            # downloaded before the manifest was kept
+            manifest.add(file_entry(track_id, path))
+            stats["cached"] += 1
+        else:
+            if entry is not None:
+                manifest.remove(track_id)
+            todo.append(track_id)
+    print(f"{stats['cached']} previews cached, {len(todo)} to download")
+
+    try:
+        if todo:
+            if sp is None:
+                from infovis21.mongodb import enrich
+
+                sp = enrich.spotify_client(workers=workers)
+            urls = resolve_urls(todo, sp, manifest, workers=workers, backoff=backoff)
+            stats["missing"] += len(todo) - len(urls)
+
+            session = session or http_session(workers)
+            start = time.time()
+            with ThreadPoolExecutor(workers) as pool:
+                futures = {
+                    pool.submit(
+                        fetch_preview, session, url, preview_path(track_id, cache_dir)
+                    ): (track_id, url)
+                    for track_id, url in urls.items()
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    track_id, url = futures[future]
+                    try:
+                        size, sha1 = future.result()
+                    except Exception as e:
+                        print(f"failed to download the preview of {track_id}: {e!r}")
+                        stats["failed"] += 1
+                        continue
+                    manifest.add(
+                        {
+                            "id": track_id,
+                            "url": url,
+                            "size": size,
+                            "sha1": sha1,
+                            "at": datetime.now().isoformat(timespec="seconds"),
+                        }
+                    )
+                    stats["downloaded"] += 1
+                    stats["bytes"] += size
+                    if done % 500 == 0 or done == len(futures):
+                        rate = done / (time.time() - start)
+                        eta = timedelta(seconds=round((len(futures) - done) / rate))
+                        print(
+                            f"[{done}/{len(futures)}] previews "
+                            f"({rate:.1f}/s, {stats['bytes'] / 2**20:.0f} MiB, ETA {eta})"
+                        )
+    finally:
+        manifest.close()
+    manifest.compact()
+    return stats
+
+
+def valid_track_id(track_id):
+    return _track_id.match(track_id or "") is not None
+
+
+def etag(stat_result):
+    """ Entity tag of a cached file from its size and modification time """
+    return f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+
+
+def append_manifest(entry, cache_dir=CACHE_DIR):
+    """ Add an entry to the manifest with a single append, so that api workers
+    that fetch previews at the same time do not mix up their lines
+    """
+    line = (json.dumps(entry) + "\n").encode()
+    fd = os.open(Path(cache_dir) / MANIFEST, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+_lock = threading.Lock()
+# track id -> lock, so that a missing preview is only fetched once per process
+_fetching = dict()
+_session = None
+
+
+def fetch_and_cache(track_id, url, cache_dir=CACHE_DIR):
+    """ Fetch a preview that is not cached yet into the cache, returns its path """
+    global _session
+    path = preview_path(track_id, cache_dir)
+    with _lock:
+        lock = _fetching.setdefault(track_id, threading.Lock())
+        if _session is None:
+            _session = http_session()
+    try:
+        with lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                size, sha1 = fetch_preview(_session, url, path)
+                append_manifest(
+                    {
+                        "id": track_id,
+                        "url": url,
+                        "size": size,
+                        "sha1": sha1,
+                        "at": datetime.now().isoformat(timespec="seconds"),
+                    },
+                    cache_dir,
+                )
+    finally:
+        with _lock:
+            _fetching.pop(track_id, None)
+    return path
@@ -0,0 +1,185 @@
+import threading
+import unicodedata
+
+import numpy as np
+
+from infovis21.mongodb import featurestore
+
+# Name search over the in-memory feature store, rebuilt whenever the feature
+# store reloads (after the ETL changed the dataset version).
+#
+# Names are normalized (case, accents and punctuation are ignored) and indexed
+# twice: a trigram index for typo tolerant substring matches and a sorted list
+# of words for prefix matches, which is all that autocomplete needs.
+# Matches are ranked by how well they match, more popular nodes win ties.
+MATCH_EXACT = 4.0
+MATCH_PREFIX = 3.0
+MATCH_WORD_PREFIX = 2.0
+MATCH_SUBSTRING = 1.0
+# weight of the normalized popularity in the score, smaller than the gap
+# between two kinds of matches
+POPULARITY_WEIGHT = 0.5
+# share of the trigrams of the query that a fuzzy match needs to have
+MIN_TRIGRAM_SHARE = 0.5
+# candidates that are checked for exact, prefix and substring matches per result
+CANDIDATES_PER_RESULT = 10
+
+
+# every ASCII character that is not a letter or digit becomes a space
+_ascii_separators = str.maketrans(
+    {chr(c): " " for c in range(128) if not chr(c).isalnum()}
+)
+
+
+def normalize(text):
+    """ Lower case, without accents, words separated by single spaces """
+    text = str(text or "")
+    if text.isascii():
+        return " ".join(text.lower().translate(_ascii_separators).split())
+    text = unicodedata.normalize("NFKD", text).casefold()
+    text = "".join(
+        c if c.isalnum() else " " for c in text if not unicodedata.combining(c)
+    )
+    return " ".join(text.split())
+
+
+def trigram_codes(texts):
+    """ Return the (codes, text indices) of all trigrams of the texts, repeated
+    trigrams of a text are repeated as well. Texts are padded with a space on
+    both sides so that the start and end of their words count as well. A trigram
+    is encoded as the 21 bit code points of its characters in one int64.
+    """
+    padded = "".join(f" {text} \0" for text in texts)
+    chars = np.frombuffer(padded.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    lengths = np.array([len(text) + 3 for text in texts], dtype=np.int64)
+    owner = np.repeat(np.arange(len(texts)), lengths)
+    codes = (chars[:-2] << 42) | (chars[1:-1] << 21) | chars[2:]
+    # trigrams that touch the separator between two texts
+    valid = (chars[:-2] != 0) & (chars[1:-1] != 0) & (chars[2:] != 0)
+    return codes[valid], owner[:-2][valid]
+
+
+class SearchIndex:
+    """ Trigram and word prefix index over the names of one node type """
+
+    def __init__(self, table):
+        self.table = table
+        self.names = [normalize(name) for name in table.names]
+        popularity = np.nan_to_num(table.column("popularity").astype(np.float64))
+        self.popularity = popularity / (popularity.max(initial=0) or 1)
+
+        # rows with trigram gram_keys[i] are gram_rows[offsets[i]:offsets[i + 1]]
+        codes, rows = trigram_codes(self.names)
+        self.gram_keys, grams = np.unique(codes, return_inverse=True)
+        n = max(len(self.names), 1)
+        # distinct (trigram, row) pairs, sorted by trigram and row
+        pairs = np.sort(grams.astype(np.int64) * n + rows)
+        pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+        self.gram_rows = (pairs % n).astype(np.int32)
+        counts = np.bincount(pairs // n, minlength=len(self.gram_keys))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.n_grams = np.bincount(self.gram_rows, minlength=len(self.names))
+
+        # sorted words, for prefix matches
+        words, word_rows = [], []
+        for row, name in enumerate(self.names):
+            for word in set(name.split()):
+                words.append(word)
+                word_rows.append(row)
+        words = np.array(words, dtype=str)
+        order = np.argsort(words, kind="stable")
+        self.words = words[order]
+        self.word_rows = np.array(word_rows, dtype=np.int32)[order]
+
+    def postings(self, query):
+        """ Rows per trigram of a normalized query, for the trigrams in the index """
+        codes = np.unique(trigram_codes([query])[0])
+        idx = np.searchsorted(self.gram_keys, codes)
+        found = idx < len(self.gram_keys)
+        found[found] = self.gram_keys[idx[found]] == codes[found]
+        return [
+            self.gram_rows[self.offsets[i] : self.offsets[i + 1]] for i in idx[found]
+        ], len(codes)
+
+    def quality(self, row, query):
+        name = self.names[row]
+        if name == query:
+            return MATCH_EXACT
+        if name.startswith(query):
+            return MATCH_PREFIX
+        if f" {query}" in f" {name}":
+            return MATCH_WORD_PREFIX
+        if query in name:
+            return MATCH_SUBSTRING
+        return 0.0
+
+    def _rank(self, rows, query, limit, fuzzy=None, coverage=None):
+        """ Return the (rows, scores) of the best limit rows, best first """
+        if len(rows) == 0:
+            return rows, np.zeros(0)
+        # cheap preselection, the exact match quality is only computed for the
+        # candidates. Names that contain all trigrams of the query come first.
+        prescore = POPULARITY_WEIGHT * self.popularity[rows]
+        if fuzzy is not None:
+            prescore = prescore + fuzzy + 2 * coverage
+        n_candidates = limit * CANDIDATES_PER_RESULT
+        if len(rows) > n_candidates:
+            best = np.argpartition(-prescore, n_candidates)[:n_candidates]
+            rows = rows[best]
+            fuzzy = fuzzy[best] if fuzzy is not None else None
+        quality = np.array([self.quality(row, query) for row in rows])
+        if fuzzy is not None:
+            # fuzzy matches rank below every substring match
+            quality = np.where(quality > 0, quality, fuzzy * MATCH_SUBSTRING)
+        scores = quality + POPULARITY_WEIGHT * self.popularity[rows]
+        order = np.lexsort((rows, -scores))[:limit]
+        return rows[order], scores[order]
+
+    def prefix(self, query, limit=10):
+        """ Rows with a word that starts with the query, for autocomplete """
+        query = normalize(query)
+        if not query:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        first = query.split()[0]
+        lo, hi = np.searchsorted(self.words, [first, first + "\uffff"])
+        rows = np.unique(self.word_rows[lo:hi])
+        if " " in query:
+            rows = np.array(
+                [row for row in rows if f" {query}" in f" {self.names[row]}"],
+                dtype=np.int32,
+            )
+        return self._rank(rows, query, limit)
+
+    def search(self, query, limit=20):
+        """ Rows whose names contain the query or share most of its trigrams """
+        query = normalize(query)
+        if len(query) < 3:
+            return self.prefix(query, limit=limit)
+        grams, n_query = self.postings(query)
+        if len(grams) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        rows, shared = np.unique(np.concatenate(grams), return_counts=True)
+        # a substring inside a word misses the two padded trigrams of the query
+        needed = max(1, min(np.ceil(MIN_TRIGRAM_SHARE * n_query), n_query - 2))
+        keep = shared >= needed
+        rows, shared = rows[keep], shared[keep]
+        # Dice coefficient of the trigram sets
+        fuzzy = 2 * shared / (n_query + self.n_grams[rows])
+        return self._rank(rows, query, limit, fuzzy=fuzzy, coverage=shared / n_query)
+
+
+_lock = threading.Lock()
+_indexes = dict()
+
+
+def get_index(typ):
+    """ Search index for a node type, rebuilt whenever the feature store reloads """
+    table = featurestore.get_table(typ)
+    index = _indexes.get(typ)
+    if index is None or index.table is not table:
+        with _lock:
+            index = _indexes.get(typ)
+            if index is None or index.table is not table:
+                index = SearchIndex(table)
+                _indexes[typ] = index
+    return index
@@ -0,0 +1,130 @@
+import threading
+
+import numpy as np
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import featurestore
+
+# catalogues with at least this many nodes get a partitioned (IVF) index for
+# queries over the whole catalogue, smaller ones are always scanned completely
+IVF_MIN_ROWS = 500_000
+IVF_PROBES = 8
+ASSIGN_CHUNK = 65_536
+
+
+def normalize_rows(matrix):
+    """ Scale every row to unit length, rows without any signal stay zero """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _assign(matrix, centroids):
+    """ Index of the most similar centroid for every row, computed in chunks """
+    assignment = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), ASSIGN_CHUNK):
+        block = matrix[start : start + ASSIGN_CHUNK]
+        assignment[start : start + ASSIGN_CHUNK] = np.argmax(
+            block @ centroids.T, axis=1
+        )
+    return assignment
+
+
+def spherical_kmeans(matrix, n_clusters, n_iter=10, sample_size=100_000, seed=0):
+    """ Cluster unit vectors by cosine similarity, trained on a random sample """
+    rng = np.random.default_rng(seed)
+    sample = matrix
+    if len(matrix) > sample_size:
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = ~sums.any(axis=1)
+        # re-seed empty clusters with random sample points
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """ Inverted file index: rows are bucketed by their closest centroid """
+
+    def __init__(self, matrix, n_lists=None, seed=0):
+        n_lists = n_lists or max(1, int(np.sqrt(len(matrix))))
+        self.centroids = spherical_kmeans(matrix, min(n_lists, len(matrix)), seed=seed)
+        assignment = _assign(matrix, self.centroids)
+        # rows of list i are order[offsets[i]:offsets[i + 1]]
+        self.order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def candidates(self, query, n_probe=IVF_PROBES):
+        """ Rows in the n_probe lists whose centroids are closest to the query """
+        scores = self.centroids @ query
+        n_probe = min(n_probe, len(scores))
+        lists = np.argpartition(scores, -n_probe)[-n_probe:]
+        return np.concatenate(
+            [self.order[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+        )
+
+
+class SimilarityIndex:
+    """ Pre-normalized float32 matrix of the similarity dimensions of one node type """
+
+    def __init__(self, table, ivf_min_rows=IVF_MIN_ROWS):
+        self.table = table
+        raw = np.stack(
+            [table.column(dim) for dim in ma.similarity_dimensions], axis=1
+        ).astype(np.float32)
+        self.raw = np.nan_to_num(raw)
+        self.matrix = np.ascontiguousarray(normalize_rows(self.raw), dtype=np.float32)
+        self.ivf = IVFIndex(self.matrix) if len(table) >= ivf_min_rows else None
+
+    def query(self, rows):
+        """ Query vector for a selection, the normalized mean of the selected nodes """
+        return normalize_rows(self.raw[rows].mean(axis=0, keepdims=True))[0]
+
+    def topk(self, selected_rows, k, candidates=None, n_probe=IVF_PROBES):
+        """ Return the (rows, cosine similarities) of the k nodes most similar to the
+        selection, best first. Candidates can be restricted to an array of rows,
+        otherwise the whole catalogue is searched.
+        """
+        query = self.query(selected_rows)
+        if candidates is None and self.ivf is not None:
+            candidates = self.ivf.candidates(query, n_probe=n_probe)
+
+        if candidates is None:
+            # a single matrix-vector product over the whole catalogue
+            candidates = np.arange(len(self.matrix))
+            scores = self.matrix @ query
+            scores[selected_rows] = -np.inf
+        else:
+            candidates = candidates[~np.isin(candidates, selected_rows)]
+            scores = self.matrix[candidates] @ query
+        if len(candidates) == 0:
+            return candidates, scores
+
+        k = min(k, len(scores))
+        best = np.argpartition(scores, -k)[-k:]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        best = best[np.isfinite(scores[best])]
+        return candidates[best], scores[best]
+
+
+_lock = threading.Lock()
+_indexes = dict()
+
+
+def get_index(typ):
+    """ Similarity index for a node type, rebuilt whenever the feature store reloads """
+    table = featurestore.get_table(typ)
+    index = _indexes.get(typ)
+    if index is None or index.table is not table:
+        with _lock:
+            index = _indexes.get(typ)
+            if index is None or index.table is not table:
+                index = SimilarityIndex(table)
+                _indexes[typ] = index
+    return index
@@ -1,18 +1,21 @@
 import base64
-import itertools
+import json
 import sys
+import zlib
 from datetime import datetime
-from operator import itemgetter
 from pprint import pprint
 from typing import Collection, List
 
 import numpy as np
-from flask import abort, jsonify, request
+from flask import abort, jsonify, request, send_file
 from flask_cors import cross_origin
-from sklearn.metrics.pairwise import cosine_similarity
 
+from infovis21 import cache, columnar
+from infovis21 import links as linkutils
+from infovis21 import previews, search, similarity
 from infovis21.app import app
 from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import connection, featurestore, popularity, spatial, tiles
 from infovis21.mongodb import utils as dbutils
 
 vis_min, vis_max = (
@@ -24,10 +27,6 @@ zoom_min, zoom_max = (
     1,
 )
 
-dim_minmax = ma.get_dim_minmax()
-
-graph_state = list()
-
 
 def get_collection(type_str):
     type_str = type_str.lower()
@@ -51,86 +50,147 @@ def not_found(e):
     return jsonify(error=str(e)), 404
 
 
+def run_query(query, result):
+    """ Run a read query with the arguments of the current request """
+    collection, pipeline, d = query(request.args)
+    return result(d, list(collection.aggregate(pipeline)))
+
+
+def dimensions():
+    return {
+        k: {**v, **ma.dim_minmax.get(k, {})}
+        for k, v in ma.dimension_descriptions.items()
+    }
+
+
 @app.route("/<version>/dimensions")
 @cross_origin()
+@cache.cached
 def _dimensions(version):
     """ Return a list of all dimensions of the dataset """
-    return jsonify(
-        {
-            k: {**v, **dim_minmax.get(k, {})}
-            for k, v in ma.dimension_descriptions.items()
-        }
-    )
+    return jsonify(dimensions())
 
 
-@app.route("/<version>/search")
-def search(version):
-    coll_type = request.args.get("type")
+# The read endpoints are split into a query function that turns the request
+# arguments into a collection, a pipeline and the response fields known upfront,
+# and a result function that adds the documents found. The Flask views below and
+# the ASGI app in infovis21.asgi run the same queries.
+
+
+SEARCH_LIMIT = 20
+SUGGEST_LIMIT = 8
+MAX_SEARCH_LIMIT = 100
+
+
+def search_limit(args, default):
+    return min(int_arg(args, "limit", default, minimum=1), MAX_SEARCH_LIMIT)
+
+
+def search_query(args):
+    """ Parse and validate the arguments of /search """
+    coll_type = args.get("type")
     if coll_type is None or len(coll_type) < 1:
         return abort(400, description="missing type parameter (artist/track/genre)")
-    dimx = request.args.get("dimx")
-    dimy = request.args.get("dimy")
+    dimx = args.get("dimx")
+    dimy = args.get("dimy")
     if dimx is None or dimy is None:
         return abort(400, description="missing dimension parameters dimx and dimy")
+    if dimx not in ma.dimensions or dimy not in ma.dimensions:
+        return abort(400, description=f"dimensions need to be one of {ma.dimensions}")
 
-    searchterm = request.args.get("searchterm")
+    searchterm = args.get("searchterm")
     if searchterm is None or len(searchterm) < 1:
         return abort(404, description="not found")
 
-    collection = get_collection(coll_type)
-    d = {}
-    if not (searchterm and coll_type and dimx and dimy):
-        return abort(
-            400,
-            description="a searchterm and type are required, e.g. /search?searchterm=Marvin%20Sease&type=artist&dimx=acousticness&dimy=tempo",
-        )
-    pipeline = [
-        {
-            "$match": {
-                "$expr": {
-                    "$regexMatch": {
-                        "input": "$name",
-                        # "regex": f"/{searchterm}/",
-                        "regex": searchterm,
-                        "options": "i",  # case insensitive match
-                    }
-                }
-            }
-        },
-        # {'$match': {'name': searchterm}},
+    get_collection(coll_type)  # validates the node type
+    return {
+        "typ": coll_type.lower(),
+        "dimx": dimx,
+        "dimy": dimy,
+        "searchterm": searchterm,
+        "limit": search_limit(args, SEARCH_LIMIT),
+    }
+
+
+def search_result(q):
+    """ Best matches for the search term, see infovis21.search """
+    dimx, dimy, typ = q["dimx"], q["dimy"], q["typ"]
+    index = search.get_index(typ)
+    table = index.table
+    rows, scores = index.search(q["searchterm"], limit=q["limit"])
+    matches = [
         {
-            "$project": {
-                "id": "$id",
-                # returning nodes in MongoDB space, cannot really perform interpolation in aggregation stage but if needed can be done in coll.update_one() for loop
-                "dimx": dimx,
-                "dimy": dimy,
-                "x": f"${dimx}",
-                "y": f"${dimy}",
-                "name": "$name",
-                "size": "$popularity",
-                "preview_url": "$preview_url",
-                # can be one of Genre, Artist or Track (does this need to be capitalized)
-                "type": coll_type.capitalize(),
-                "genres": "genres",
-                "color": "$genre_color",
-                "_id": 0,
-            }
-        },
+            "id": table.ids[row],
+            # returning nodes in normalized frontend visualization space
+            "dimx": dimx,
+            "dimy": dimy,
+            "x": mongo_to_vis(dimx, table.column(dimx)[row]),
+            "y": mongo_to_vis(dimy, table.column(dimy)[row]),
+            "name": table.names[row],
+            "size": float(table.column("popularity")[row]),
+            "preview_url": table.preview_urls[row],
+            # can be one of Genre, Artist or Track
+            "type": typ.capitalize(),
+            "genres": table.genres[row],
+            "color": table.colors[row],
+            "score": float(score),
+        }
+        for row, score in zip(rows, scores)
     ]
+    return {"limit": q["limit"], "matches": matches}
 
-    matches = list(collection.aggregate(pipeline))
-    for m in matches:
-        m["x"] = mongo_to_vis(dimx, m["x"])
-        m["y"] = mongo_to_vis(dimy, m["y"])
-    d.update({"matches": matches})
-    return jsonify(d)
 
+@app.route("/<version>/search")
+def _search(version):
+    """ Return the nodes whose names match the searchterm, best matches first """
+    return columnar.respond(search_result(search_query(request.args)))
 
-@app.route("/<version>/labels")
+
+def suggest_query(args):
+    """ Parse and validate the arguments of /suggest """
+    prefix = args.get("q", "")
+    typ = args.get("type")
+    if typ:
+        get_collection(typ)  # validates the node type
+    return {
+        "q": prefix,
+        "types": [typ.lower()] if typ else list(ma.collections.keys()),
+        "limit": search_limit(args, SUGGEST_LIMIT),
+    }
+
+
+def suggest_result(q):
+    """ Names that start with the typed prefix (word by word), best first """
+    ranked = []
+    for typ in q["types"]:
+        index = search.get_index(typ)
+        rows, scores = index.prefix(q["q"], limit=q["limit"])
+        ranked.extend((score, typ, index.table, row) for row, score in zip(rows, scores))
+    ranked.sort(key=lambda r: -r[0])
+    return {
+        "q": q["q"],
+        "suggestions": [
+            {
+                "id": table.ids[row],
+                "name": table.names[row],
+                "type": typ.capitalize(),
+                "popularity": float(table.column("popularity")[row]),
+            }
+            for _, typ, table, row in ranked[: q["limit"]]
+        ],
+    }
+
+
+@app.route("/<version>/suggest")
 @cross_origin()
-def _labels(version):
+def _suggest(version):
+    """ Autocomplete for the search box, cheap enough to be called on every keystroke """
+    return jsonify(suggest_result(suggest_query(request.args)))
+
+
+def labels_query(args):
     """ Return a list of all labels and the number of songs and artists in their portfolio """
-    limit = request.args.get("limit")
+    limit = args.get("limit")
     d = {}
     pipeline = [
         {
@@ -147,87 +207,74 @@ def _labels(version):
         d["limit"] = topk
         pipeline.append({"$sort": {"total_songs": ma.DESC}})
         pipeline.append({"$limit": topk})
+    return ma.coll_labels, pipeline, d
 
-    d.update({"labels": list(ma.coll_labels.aggregate(pipeline))})
-    return jsonify(d)
 
+def labels_result(d, labels):
+    d.update({"labels": labels})
+    return d
 
-@app.route("/<version>/most_popular")
+
+@app.route("/<version>/labels")
 @cross_origin()
-def _most_popular(version):
-    """ Return a list of most popular genre|artist|track per year """
+@cache.cached
+def _labels(version):
+    """ Return a list of all labels and the number of songs and artists in their portfolio """
+    return jsonify(run_query(labels_query, labels_result))
+
+
+def most_popular_query(args):
+    """ Parse and validate the arguments of /most_popular """
 
-    limit = request.args.get("limit")
-    year_min = request.args.get("year_min")
-    year_max = request.args.get("year_max")
-    coll_type = request.args.get("type")
-    use_super = request.args.get("use_super", False)
-    streamgraph = request.args.get("streamgraph", False)
+    limit = args.get("limit")
+    year_min = args.get("year_min")
+    year_max = args.get("year_max")
+    coll_type = args.get("type")
 
     if not year_min or not year_max or not coll_type:
         return abort(
             400,
             description="must specify year_min, year_max, and type e.g. /most_popular?year_min=2020&year_max=2020&type=artist&limit=10",
         )
+    if coll_type not in ("genre", "artist", "track"):
+        return abort(400, description="invalid node type not: genre, artist, track")
 
     d = {
         "year_min": int(year_min),
         "year_max": int(year_max),
+        "type": str(coll_type),
+        "use_super": bool(args.get("use_super", False)),
+        "streamgraph": bool(args.get("streamgraph", False)),
     }
-    pipeline = [
-        {
-            "$project": {
-                "popularity": 1,
-                "_id": 0,
-                "year": 1,
-                "super_genre": 1,
-                "genre": 1,
-                "name": 1,
-                "color": 1,
-            }
-        },
-        {
-            "$match": {
-                "$and": [{"year": {"$gte": d["year_min"], "$lte": d["year_max"]}},]
-            }
-        },
-        {"$group": {"_id": "$year", "entries": {"$push": "$$ROOT"}}},
-        {"$sort": {"popularity": -1}},
-    ]
-
     if limit:
         d["limit"] = int(limit)
-        pipeline.append({"$limit": d["limit"]},)
-    if coll_type:
-        d["type"] = str(coll_type)
-
-    if d["type"] == "genre":
-        collection = ma.coll_super_genre_pop if use_super else ma.coll_genre_pop
-    elif d["type"] == "artist":
-        collection = ma.coll_super_artist_pop if use_super else ma.coll_artist_pop
-    elif d["type"] == "track":
-        collection = ma.coll_tracks
-    else:
-        return abort(400, description="invalid node type not: genre, artist, track")
+    return d
+
 
-    popular = list(collection.aggregate(pipeline))
-    keys = [k["name"] for k in popular[0]["entries"]]
-    if streamgraph:
-        popular = [
-            {**{"year": i["_id"]}, **{k["name"]: k["popularity"] for k in i["entries"]}}
-            for i in popular
-        ]
+def most_popular_result(d):
+    """ Slices the materialized top lists, see infovis21.mongodb.popularity """
+    toplist = popularity.get_toplist(d["type"], d.pop("use_super"))
+    limit = d.get("limit")
+    if d.pop("streamgraph"):
+        keys, popular = toplist.streams(d["year_min"], d["year_max"], limit=limit)
     else:
-        popular = popular[0]["entries"]
+        popular = toplist.top(d["year_min"], d["year_max"], limit=limit)
+        keys = list(dict.fromkeys(e["name"] for e in popular))
 
     d.update({"most_popular": popular, "keys": (keys if d["type"] == "genre" else [])})
-    return jsonify(d)
+    return d
 
 
-@app.route("/<version>/artists")
+@app.route("/<version>/most_popular")
 @cross_origin()
-def _artists(version):
-    limit = request.args.get("limit")
+@cache.cached
+def _most_popular(version):
+    """ Return a list of most popular genre|artist|track per year """
+    return jsonify(most_popular_result(most_popular_query(request.args)))
+
+
+def artists_query(args):
+    limit = args.get("limit")
     d = {}
     pipeline = [
         {"$project": {"name": "$name", "popularity": "$popularity", "_id": 0}},
@@ -238,23 +285,29 @@ def _artists(version):
         d["limit"] = topk
         pipeline.append({"$sort": {"popularity": ma.DESC}})
         pipeline.append({"$limit": topk})
+    return ma.coll_artists, pipeline, d
 
-    artists = list(ma.coll_artists.aggregate(pipeline))
 
+def artists_result(d, artists):
     # TODO: pre compute the number of distinct artists
     # str(round(len(list(ma.coll_artists.aggregate(pipeline))) / 1000)) + "K"
 
     d.update(
         {"artists": artists, "total": len(artists),}
     )
-    return jsonify(d)
+    return d
 
 
-@app.route("/<version>/genres")
+@app.route("/<version>/artists")
 @cross_origin()
-def _genres(version):
+@cache.cached
+def _artists(version):
+    return jsonify(run_query(artists_query, artists_result))
+
+
+def genres_query(args):
     """ Return a list of all genres and their popularity for the wordcloud """
-    limit = request.args.get("limit")
+    limit = args.get("limit")
     d = {}
     pipeline = [
         {"$project": {"name": "$name", "popularity": "$popularity", "_id": 0}},
@@ -265,19 +318,27 @@ def _genres(version):
         # d["limit"] = topk
         pipeline.append({"$sort": {"popularity": ma.DESC}})
         pipeline.append({"$limit": topk})
+    return ma.coll_genres, pipeline, d
 
-    genres = list(ma.coll_genres.aggregate(pipeline))
+
+def genres_result(d, genres):
     d.update(
         {"genres": genres, "total": len(genres),}
     )
-    return jsonify(d)
+    return d
 
 
-@app.route("/<version>/years")
+@app.route("/<version>/genres")
 @cross_origin()
-def _years(version):
+@cache.cached
+def _genres(version):
+    """ Return a list of all genres and their popularity for the wordcloud """
+    return jsonify(run_query(genres_query, genres_result))
+
+
+def years_query(args):
     """ Return a detailed info of music through different years for heatmap """
-    limit = request.args.get("limit")
+    limit = args.get("limit")
     d = {}
     pipeline = [
         {
@@ -305,8 +366,20 @@ def _years(version):
         d["limit"] = topk
         pipeline.append({"$sort": {"year": ma.DESC}})
         pipeline.append({"$limit": topk})
-    d.update({"data": list(ma.coll_years.aggregate(pipeline))})
-    return jsonify(d)
+    return ma.coll_years, pipeline, d
+
+
+def years_result(d, data):
+    d.update({"data": data})
+    return d
+
+
+@app.route("/<version>/years")
+@cross_origin()
+@cache.cached
+def _years(version):
+    """ Return a detailed info of music through different years for heatmap """
+    return jsonify(run_query(years_query, years_result))
 
 
 def vis_to_mongo(dim, val_vis):
@@ -342,33 +415,139 @@ def viszoomregion_to_mongo(
     return vis_to_mongo(dim, val_zoom_min), vis_to_mongo(dim, val_zoom_max)
 
 
-@app.route("/<version>/select")
-@cross_origin()
-def _select(version):
-    """ Return the node ids that should be highlighted based on a user selection """
+def make_viewport(version, x, y, zoom, dimx, dimy, typ, limit=None):
+    """ Everything that determines the nodes /graph returns """
+    return {
+        "version": version,
+        "x": x,
+        "y": y,
+        "zoom": zoom,
+        "dimx": dimx,
+        "dimy": dimy,
+        "type": typ,
+        "limit": limit,
+    }
+
+
+def viewport_token(viewport):
+    """ Opaque token for a viewport that /graph returns and /select accepts """
+    data = json.dumps(viewport, sort_keys=True, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def valid_viewport(v):
+    """ Whether the values of a decoded viewport are the ones /graph accepts """
+    return (
+        isinstance(v["version"], str)
+        and all(_is_number(v[key]) and np.isfinite(v[key]) for key in ["x", "y", "zoom"])
+        and v["dimx"] in ma.dimensions
+        and v["dimy"] in ma.dimensions
+        and v["dimx"] != v["dimy"]
+        and isinstance(v["type"], str)
+        and v["type"].lower() in ["genre", "artist", "track"]
+        and (v["limit"] is None or (_is_integer(v["limit"]) and v["limit"] >= 0))
+    )
+
+
+def parse_viewport_token(token):
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        viewport = json.loads(data.decode("utf-8"))
+        viewport = {key: viewport[key] for key in make_viewport(*[None] * 7)}
+    except (ValueError, TypeError, KeyError):
+        return abort(400, description="invalid viewport token")
+    if not valid_viewport(viewport):
+        return abort(400, description="invalid viewport token")
+    return viewport
+
+
+def visible_nodes_pipeline(viewport):
+    """ Pipeline for the ids of the nodes that /graph v2 returned for a viewport """
+    v = viewport
+    zoom_level, bounds = zoom_viewport(v["x"], v["y"], v["zoom"])
+    return tiles.nodes_pipeline(
+        v["dimx"],
+        v["dimy"],
+        v["type"],
+        zoom_level,
+        *bounds,
+        {"id": "$id", "_id": 0},
+        limit=v["limit"],
+    )
+
+
+def visible_node_rows(table, viewport, visible_ids=None):
+    """ Rows of the nodes that /graph returned for a viewport, recomputed so that no
+    state has to be kept between requests. The ids of v2 viewports can be given if
+    visible_nodes_pipeline was already run.
+    """
+    v = viewport
+    if v["version"] == "v2":
+        if visible_ids is None:
+            nodes = tiles.nodes_collection().aggregate(visible_nodes_pipeline(v))
+            visible_ids = [node["id"] for node in nodes]
+        return table.rows(visible_ids)
+    rows, _ = visible_rows(
+        table, v["x"], v["y"], v["dimx"], v["dimy"], v["zoom"], v["limit"]
+    )
+    return rows
 
+
+def select_query(version, args):
+    """ Parse and validate the arguments of /select """
     d = {}
-    node_id = request.args.get("node")  # either genre/artist/track ID
-    _limit = request.args.get("limit")
-    # _zoom = request.args.get("zoom") # don't think zoom makes sense here if we have a way to determine genre/artist/track level
-    dimx = request.args.get("dimx")
-    dimy = request.args.get("dimy")
-    d["type"] = request.args.get("type")
+    node_id = args.get("node")  # either genre/artist/track ID
+    _limit = args.get("limit")
+    # _zoom = args.get("zoom") # don't think zoom makes sense here if we have a way to determine genre/artist/track level
+    dimx = args.get("dimx")
+    dimy = args.get("dimy")
+    d["type"] = args.get("type")
 
     topk = 6
     if _limit:
         topk = int(_limit)
         d["limit"] = topk
 
+    # whole catalogue queries ignore the nodes that are currently displayed
+    scope = args.get("scope", "visible")
+
     # zoom = 4
     # if _zoom:
     #     zoom = float(_zoom)
     #     d["zoom"] = zoom
-    global graph_state
-    if len(graph_state) == 0:
-        return abort(
-            400,
-            description="Graph endpoint needs to be hit before a selection recommendation can be given",
+
+    # the displayed nodes are recomputed from the viewport, either given as the
+    # token returned by /graph or with the same parameters as /graph
+    viewport = None
+    if args.get("viewport"):
+        viewport = parse_viewport_token(args["viewport"])
+        dimx, dimy, d["type"] = viewport["dimx"], viewport["dimy"], viewport["type"]
+    elif scope != "all":
+        try:
+            x, y, zoom = [float(args[arg]) for arg in ["x", "y", "zoom"]]
+        except (KeyError, ValueError):
+            return abort(
+                400,
+                description="The viewport of the graph is needed to recommend displayed nodes, pass the viewport token returned by /graph or x, y and zoom (and graph_limit) of the /graph request",
+            )
+        graph_limit = args.get("graph_limit")
+        viewport = make_viewport(
+            version,
+            x,
+            y,
+            zoom,
+            dimx,
+            dimy,
+            d["type"],
+            int(graph_limit) if graph_limit else None,
         )
 
     if not (node_id and dimx and dimy and d["type"]):
@@ -377,94 +556,115 @@ def _select(version):
             description="Node ID, type, and the x and y dimensions are required to make a selection, e.g. /select?node=19Lc5SfJJ5O1oaxY0fpwfh&dimx=acousticness&dimy=loudness&type=track",
         )
 
-    collection = get_collection(d["type"])
-
-    project_stage = {"$project": {"id": "$id", "_id": 0,}}
-    # include all dimensions/features
-    [project_stage["$project"].update({dim: 1}) for dim in ma.dimensions]
+    get_collection(d["type"])  # validates the node type
+    if scope == "all":
+        viewport = None
+    return {
+        "d": d,
+        "node_id": node_id,
+        "dimx": dimx,
+        "dimy": dimy,
+        "topk": topk,
+        "viewport": viewport,
+    }
 
-    node_ids = node_id.split("|")
-    selectable_state = list(set(graph_state) - set(node_ids))
-    pipeline = [
-        # { '$limit': 10},
-        {
-            "$match": {"id": {"$in": selectable_state}}
-        },  # only recommend nodes that are currently in displayed graph
-        project_stage,
-    ]
 
-    res = list(collection.aggregate(pipeline))
+def select_result(q, visible_ids=None):
+    """ Recommend the nodes most similar to the selection, see select_query """
+    d, node_id, dimx, dimy = q["d"], q["node_id"], q["dimx"], q["dimy"]
+    index = similarity.get_index(d["type"].lower())
+    table = index.table
 
-    selected = list(
-        collection.aggregate([{"$match": {"id": {"$in": node_ids}}}, project_stage])
-    )
+    node_ids = node_id.split("|")
+    selected = table.rows(node_ids)
     if len(selected) < 1:
         return abort(404, description=f"node with ID '{node_id}' was not found.")
 
-    # one of the most similar nodes is the node itself, can be excluded using processing/different method if needed
-    cos_sim = cosine_similarity(
-        np.array([dbutils.create_vector_sim(doc) for doc in res]),
-        np.array(
-            [np.mean([dbutils.create_vector_sim(doc) for doc in selected], axis=0)]
-        ),
-    ).squeeze()
-
-    # think this is supposed to be faster, but it isn't (using %timeit) coulds probs be optimized
-    # selected_np = np.array([create_vector(selected)],dtype=np.float64).reshape(1, -1)
-    # res_cos_func = (lambda a: np.dot(a.reshape(-1, 1), selected_np)/(np.linalg.norm(a.reshape(1, -1))*np.linalg.norm(selected_np)))(np.array(list(map(lambda doc: create_vector(doc), res)), dtype=np.float64))
-
-    # get indices of top n similar nodes
-    topk_idx = np.argpartition(cos_sim, -topk)[-topk:]
-
-    # retrieving doc info and actual similarity value
-    similar_nodes = [(res[i], cos_sim[i]) for i in topk_idx]
-    # dissim_nodes = [
-    #     (res[i], cos_sim[i]) for i in np.argpartition(cos_sim, -topk)[:topk]
-    # ]
-    # print(dissim_nodes)
-    # print(selected_vectors)
-    # print(min(cos_sim))
-    # print(max(cos_sim), flush=True)
-
-    max_x_i, min_x_i, max_y_i, min_y_i = 0, 0, 0, 0
+    # only recommend nodes that are currently in displayed graph
+    candidates = None
+    if q["viewport"] is not None:
+        candidates = visible_node_rows(table, q["viewport"], visible_ids)
+    similar_rows, cos_sim = index.topk(selected, q["topk"], candidates=candidates)
+    if len(similar_rows) < 1:
+        return abort(404, description="no other nodes to recommend")
 
-    # find max and min values for dimensions for regions of interest (not sure if that is what is intended)
-    for i in range(1, len(similar_nodes)):
-        curr_node = similar_nodes[i][0]
-        if curr_node[dimx] > similar_nodes[max_x_i][0][dimx]:
-            max_x_i = i
-        if curr_node[dimy] > similar_nodes[max_y_i][0][dimy]:
-            max_y_i = i
-        if curr_node[dimx] < similar_nodes[min_x_i][0][dimx]:
-            min_x_i = i
-        if curr_node[dimy] < similar_nodes[min_y_i][0][dimy]:
-            min_y_i = i
+    xs = table.column(dimx)[similar_rows].astype(float)
+    ys = table.column(dimy)[similar_rows].astype(float)
 
+    # find max and min values for dimensions for regions of interest (not sure if that is what is intended)
     d.update(
         {
-            "nodes": [tpl[0]["id"] for tpl in similar_nodes],
+            "nodes": list(table.ids[similar_rows]),
             "regions_of_interest": {
                 "dimensions": {
-                    "width": (
-                        similar_nodes[max_x_i][0][dimx]
-                        - similar_nodes[min_x_i][0][dimx]
-                    ),
-                    "height": (
-                        similar_nodes[max_y_i][0][dimy]
-                        - similar_nodes[min_y_i][0][dimy]
-                    ),
+                    "width": float(xs.max() - xs.min()),
+                    "height": float(ys.max() - ys.min()),
                 },
                 "interest": [
-                    {"x": tpl[0][dimx], "y": tpl[0][dimy], "value": tpl[1],}
-                    for tpl in similar_nodes
+                    {"x": x, "y": y, "value": float(value),}
+                    for x, y, value in zip(xs, ys, cos_sim)
                 ],
             },
         }
     )
-    return jsonify(d)
+    return d
 
 
-def graph_impl_2(x, y, dimx, dimy, zoom=None, limit=None, typ=None):
+@app.route("/<version>/select")
+@cross_origin()
+def _select(version):
+    """ Return the node ids that should be highlighted based on a user selection """
+    return jsonify(select_result(select_query(version, request.args)))
+
+
+def zoom_viewport(x, y, zoom):
+    """ Pyramid level and (x_min, x_max, y_min, y_max) of a viewport in the
+    normalized space of the precomputed layers
+    """
+    zoom_level = min(
+        int(zoom // (1 / dbutils.N_ZOOM_LEVELS)), dbutils.N_ZOOM_LEVELS - 1
+    )
+    zoom = 1 - zoom
+
+    x_min, y_min = np.clip(np.array([x - zoom / 2, y - zoom / 2]), zoom_min, zoom_max)
+    x_max, y_max = np.clip(np.array([x + zoom / 2, y + zoom / 2]), zoom_min, zoom_max)
+    return zoom_level, (float(x_min), float(x_max), float(y_min), float(y_max))
+
+
+# we want to use only lookups as much as possible
+def node_projection(typ):
+    """ Fields of the precomputed nodes returned by /graph v2 and the tiles """
+    return {
+        "id": "$id",
+        "x": "$x",
+        "y": "$y",
+        "name": "$name",
+        "preview_url": "$preview_url",
+        "color": "$genre_color",
+        "artists": "$artists",
+        "size": "$popularity",
+        "type": typ,
+        "subgenres": "$genres",
+        "genre": "$genre_super",
+        "_id": 0,
+    }
+
+
+link_projection = {
+    "id": "$id",
+    "src": "$src",
+    "dest": "$dest",
+    "x1": "$x1",
+    "y1": "$y1",
+    "x2": "$x2",
+    "y2": "$y2",
+    "color": "$color",
+    "name": "$name",
+    "_id": 0,
+}
+
+
+def graph_header(x, y, dimx, dimy, zoom=None, limit=None, typ=None):
     d = {
         "x": x,
         "y": y,
@@ -477,89 +677,31 @@ def graph_impl_2(x, y, dimx, dimy, zoom=None, limit=None, typ=None):
         d["limit"] = limit
     if typ:
         d["type"] = typ
+    return d
 
-    zoom_level = int(zoom // (1 / dbutils.N_ZOOM_LEVELS))
-    zoom = 1 - zoom
 
-    x_min, y_min = np.clip(np.array([x - zoom / 2, y - zoom / 2]), zoom_min, zoom_max)
-    x_max, y_max = np.clip(np.array([x + zoom / 2, y + zoom / 2]), zoom_min, zoom_max)
+def graph_2_pipelines(x, y, dimx, dimy, zoom, limit, typ):
+    """ Viewport bounds and the node and link pipelines of /graph v2 """
+    zoom_level, bounds = zoom_viewport(x, y, zoom)
 
-    # we want to use only lookups as much as possible
-    node_pipeline = [
-        {
-            "$match": {
-                "$and": [
-                    {"x": {"$gte": x_min, "$lte": x_max}},
-                    {"y": {"$gte": y_min, "$lte": y_max}},
-                ]
-            }
-        },
-        {
-            "$project": {
-                "id": "$id",
-                "x": "$x",
-                "y": "$y",
-                "name": "$name",
-                "preview_url": "$preview_url",
-                "color": "$genre_color",
-                "artists": "$artists",
-                "size": "$popularity",
-                "type": typ,
-                "subgenres": "$genres",
-                "genre": "$genre_super",
-                "_id": 0,
-            }
-        },
-    ]
+    # the tile store only touches the tiles that overlap the viewport
+    nodes = tiles.nodes_pipeline(
+        dimx, dimy, typ, zoom_level, *bounds, node_projection(typ), limit=limit
+    )
+    links = tiles.links_pipeline(
+        dimx, dimy, typ, zoom_level, *bounds, link_projection
+    )
+    return bounds, nodes, links
 
-    if limit:
-        node_pipeline.append({"$limit": int(limit)})
 
-    link_pipeline = [
-        {
-            "$match": {
-                "$and": [  # Note: use $or when including edges with only one endpoint in te viewport
-                    {
-                        "$and": [
-                            {"x1": {"$gte": x_min, "$lte": x_max}},
-                            {"y1": {"$gte": y_min, "$lte": y_max}},
-                        ]
-                    },
-                    {
-                        "$and": [
-                            {"x2": {"$gte": x_min, "$lte": x_max}},
-                            {"y2": {"$gte": y_min, "$lte": y_max}},
-                        ]
-                    },
-                ]
-            }
-        },
-        {
-            "$project": {
-                "id": "$id",
-                "src": "$src",
-                "dest": "$dest",
-                "x1": "$x1",
-                "y1": "$y1",
-                "x2": "$x2",
-                "y2": "$y2",
-                "color": "$color",
-                "name": "$name",
-                "_id": 0,
-            }
-        },
-    ]
-
-    precomputed_nodes = dbutils.precomputed_nodes_collection(
-        dimx, dimy, typ, zoom_level
-    )
-    precomputed_links = dbutils.precomputed_links_collection(
-        dimx, dimy, typ, zoom_level
+def graph_impl_2(x, y, dimx, dimy, zoom=None, limit=None, typ=None):
+    d = graph_header(x, y, dimx, dimy, zoom=zoom, limit=limit, typ=typ)
+    bounds, node_pipeline, link_pipeline = graph_2_pipelines(
+        x, y, dimx, dimy, zoom, limit, typ
     )
-    nodes = list(precomputed_nodes.aggregate(node_pipeline))
-    global graph_state
-    graph_state = [doc["id"] for doc in nodes]
-    links = list(precomputed_links.aggregate(link_pipeline))
+    nodes = list(tiles.nodes_collection().aggregate(node_pipeline))
+    links = list(tiles.links_collection().aggregate(link_pipeline))
+    links = tiles.crossing_links(links, dimx, dimy, *bounds)
     d.update(
         {"nodes": nodes, "links": links,}
     )
@@ -567,152 +709,187 @@ def graph_impl_2(x, y, dimx, dimy, zoom=None, limit=None, typ=None):
     return d
 
 
-def graph_impl_1(x, y, dimx, dimy, zoom=None, limit=None, typ=None):
-    d = {
-        "x": x,
-        "y": y,
-        "dimx": dimx,
-        "dimy": dimy,
-    }
+def viewport_seed(*args):
+    """ Stable seed for the random choices made for a viewport, the same in every
+    process (unlike hash())
+    """
+    return zlib.crc32(json.dumps(args).encode("utf-8"))
 
-    if zoom:
-        d["zoom"] = zoom
-    if limit:
-        d["limit"] = limit
-    if typ:
-        d["type"] = typ
 
-    # this assumes that x and y are normalized to range 0, 1 also called normalized frontend visualization space
-    # x_min, x_max = viszoomregion_to_mongo(dimx, d["x"], d["zoom"])
-    # y_min, y_max = viszoomregion_to_mongo(dimy, d["y"], d["zoom"])
+def visible_rows(table, x, y, dimx, dimy, zoom, limit=None):
+    """ Rows and distances to (x, y) of the nodes that /graph v1 shows for a viewport.
 
+    With a limit the closest node and a sample of the others are kept, the sample
+    is seeded with the viewport so that it can be recomputed by /select.
+    """
     # this assumes x and y are in MongoDB space, for scaling and zoom it is easier to normalize to this space
     x_min, x_max = viszoomregion_to_mongo(dimx, mongo_to_vis(dimx, x), zoom)
     y_min, y_max = viszoomregion_to_mongo(dimy, mongo_to_vis(dimy, y), zoom)
+    rows = table.viewport(dimx, dimy, x_min, x_max, y_min, y_max)
+
+    if not limit or len(rows) == 0:
+        return rows, table.distances(rows, dimx, dimy, x, y)
+
+    rows_sorted, dists = table.nearest(rows, dimx, dimy, x, y)
+    if len(rows_sorted) == 1:
+        # nothing to sample, the probabilities below would all be 0
+        return rows_sorted[:1], dists[:1]
+    limit = min(
+        limit, len(rows_sorted)
+    )  # limit doesn't make sense otherwise and choice call will error out
+    rng = np.random.default_rng(viewport_seed(table.typ, dimx, dimy, x, y, zoom, limit))
+    indices = list(
+        rng.choice(
+            len(rows_sorted),
+            limit - 1,
+            replace=False,
+            p=np.linspace(0, 2 / len(rows_sorted), len(rows_sorted)),
+        )
+    )
+    indices.append(
+        0
+    )  # always add node closest to current position, will have prob 0 in choice so no chance of dups
+    indices = np.array(indices, dtype=np.int64)
+    return rows_sorted[indices], dists[indices]
+
+
+def graph_impl_1(
+    x,
+    y,
+    dimx,
+    dimy,
+    zoom=None,
+    limit=None,
+    typ=None,
+    link_mode=linkutils.DEFAULT_LINK_MODE,
+    max_links=linkutils.DEFAULT_LINK_BUDGET,
+    link_k=linkutils.DEFAULT_KNN,
+):
+    d = graph_header(x, y, dimx, dimy, zoom=zoom, limit=limit, typ=typ)
 
-    # strings correspond to names of fields in {genre,artist,track}_api collections
-    collection = get_collection(typ)
+    # this assumes that x and y are normalized to range 0, 1 also called normalized frontend visualization space
+    # x_min, x_max = viszoomregion_to_mongo(dimx, d["x"], d["zoom"])
+    # y_min, y_max = viszoomregion_to_mongo(dimy, d["y"], d["zoom"])
 
-    pipeline = [
-        {
-            "$match": {
-                "$and": [
-                    {dimx: {"$gte": x_min, "$lte": x_max}},
-                    {dimy: {"$gte": y_min, "$lte": y_max}},
-                ]
-            }
-        },
-        {
-            "$project": {
-                "id": "$id",
-                # returning nodes in MongoDB space, cannot really perform interpolation in aggregation stage but if needed can be done in coll.update_one() for loop
-                "dimx": dimx,
-                "dimy": dimy,
-                "x": f"${dimx}",
-                "y": f"${dimy}",
-                "name": "$name",
-                "size": "$popularity",
-                "preview_url": "$preview_url",
-                "type": d[
-                    "type"
-                ].capitalize(),  # can be one of Genre, Artist or Track (does this need to be capitalized)
-                "genre": "$genres",
-                "labels": "$labels",
-                "color": "$genre_color",
-                "dist": {
-                    "$add": [
-                        {"$pow": [{"$subtract": [f"${dimx}", d["x"]]}, 2]},
-                        {"$pow": [{"$subtract": [f"${dimy}", d["y"]]}, 2]},
-                    ]
-                },
-                "_id": 0,
-            }
-        },
+    # nodes are served from the in-memory feature store, MongoDB stays the source of truth
+    get_collection(typ)  # validates the node type
+    table = featurestore.get_table(typ.lower())
+    rows_keep, dists_keep = visible_rows(table, x, y, dimx, dimy, zoom, limit)
+    if limit and len(rows_keep) > 0:
+        d["limit"] = len(rows_keep)
+
+    nodes_keep = [
+        table.node(row, dimx, dimy, dist=dist)
+        for row, dist in zip(rows_keep, dists_keep)
     ]
 
-    if limit:
-        pipeline.append({"$sort": {"dist": 1}})  # 1 is ascending, -1 descending
+    links, d["links_elided"] = linkutils.build_links(
+        table.label_groups(rows_keep),
+        table,
+        dimx,
+        dimy,
+        mode=link_mode,
+        budget=max_links,
+        k=link_k,
+    )
+    d["links_mode"] = link_mode
+    d.update({"nodes": nodes_keep, "links": links})
+    # d = jsonify(d)
+    return d
 
-    nodes_sorted = list(collection.aggregate(pipeline, allowDiskUse=True))
 
-    if limit:
-        limit = min(
-            limit, len(nodes_sorted)
-        )  # limit doesn't make sense otherwise and choice call will error out
-        indices = list(
-            np.random.choice(
-                len(nodes_sorted),
-                limit - 1,
-                replace=False,
-                p=np.linspace(
-                    0,
-                    2 / len(nodes_sorted) if len(nodes_sorted) != 0 else 0,
-                    len(nodes_sorted),
-                ),
-            )
-        )
-        indices.append(
-            0
-        )  # always add node closest to current position, will have prob 0 in choice so no chance of dups
-        nodes_keep = list(itemgetter(*indices)(nodes_sorted))
-        d["limit"] = limit
-    else:
-        nodes_keep = nodes_sorted
+@app.route("/<version>/metrics")
+@cross_origin()
+def _metrics(version):
+    """ Connection pool metrics of this worker process and the response cache stats """
+    return jsonify({"mongo": connection.metrics(), "cache": cache.stats})
 
-    global graph_state
-    graph_state = [doc["id"] for doc in nodes_keep]
-    pipeline = [
-        {"$match": {"$expr": {"$in": ["$id", graph_state]}}},
-        {"$unwind": "$labels"},
-        {
-            "$group": {
-                "_id": "$labels",
-                "members": {"$addToSet": "$id"},
-                "nodes": {"$first": "$nodes"},
-            }
-        },
-        {"$project": {"id": "$_id", "members": "$members", "color": "black",}},
-        {"$project": {"_id": 0}},
+
+def cached_preview(track_id):
+    """ Path of the cached preview of a track, None if it is not cached yet """
+    if not previews.valid_track_id(track_id):
+        abort(404, description=f"unknown track {track_id}")
+    path = previews.preview_path(track_id, previews.CACHE_DIR)
+    return path if path.is_file() else None
+
+
+def preview_url_pipeline(track_id):
+    return [
+        {"$match": {"id": track_id}},
+        {"$project": {"preview_url": 1, "_id": 0}},
+        {"$limit": 1},
     ]
 
-    links_data = list(collection.aggregate(pipeline, allowDiskUse=True))
-    links = []
-    for label in links_data:
-        for src, dest in itertools.combinations(label["members"], 2):
-            links.append(
-                {
-                    "src": src,
-                    "dest": dest,
-                    # "name": label["id"],
-                }
-            )
-    for node in nodes_keep:
-        del node["labels"]
-    d.update({"nodes": nodes_keep, "links": links})
-    # d = jsonify(d)
-    return d
 
+def fetch_preview(track_id, tracks):
+    """ Fetch the preview of a track into the cache, tracks is the result of
+    preview_url_pipeline. Blocks until the preview is downloaded.
+    """
+    url = tracks[0].get("preview_url") if tracks else None
+    if not url:
+        abort(404, description=f"no preview for track {track_id}")
+    try:
+        return previews.fetch_and_cache(track_id, url, previews.CACHE_DIR)
+    except Exception as e:
+        print(f"failed to fetch the preview of {track_id}: {e!r}")
+        abort(502, description=f"could not fetch the preview of {track_id}")
 
-@app.route("/<version>/graph")
+
+@app.route("/<version>/preview/<track_id>")
 @cross_origin()
-def _graph(version):
-    """ Return a the graph data for a specific zoom level and postion """
-    x = request.args.get("x")
+def _preview(version, track_id):
+    """ The mp3 preview of a track from the cache, supports range requests """
+    path = cached_preview(track_id)
+    if path is None:
+        tracks = list(ma.coll_tracks.aggregate(preview_url_pipeline(track_id)))
+        path = fetch_preview(track_id, tracks)
+    # the file is sent with wsgi.file_wrapper, i.e. sendfile under gunicorn
+    response = send_file(
+        path,
+        mimetype=previews.MIMETYPE,
+        conditional=True,
+        etag=previews.etag(path.stat()),
+        max_age=previews.MAX_AGE,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def int_arg(args, name, default, minimum=0):
+    """ An integer request argument of at least minimum, aborts with 400 otherwise """
+    value = args.get(name)
+    if not value:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        return abort(
+            400, description=f"{name} needs to be an integer of at least {minimum}"
+        )
+    return value
+
+
+def graph_query(version, args):
+    """ Parse and validate the arguments of /graph """
+    x = args.get("x")
     if x:
         x = float(x)
-    y = request.args.get("y")
+    y = args.get("y")
     if y:
         y = float(y)
-    zoom = request.args.get("zoom")
+    zoom = args.get("zoom")
     if zoom:
         zoom = float(zoom)
-    limit = request.args.get("limit")
+    limit = args.get("limit")
     if limit:
         limit = int(limit)
 
-    dimx = request.args.get("dimx")
-    dimy = request.args.get("dimy")
-    typ = request.args.get("type")
+    dimx = args.get("dimx")
+    dimy = args.get("dimy")
+    typ = args.get("type")
 
     if None in [x, y, zoom, dimx, dimy, typ]:
         return abort(
@@ -726,6 +903,110 @@ def _graph(version):
             description=f"dimensions need to be different and one of {ma.dimensions}",
         )
 
-    impl = graph_impl_2 if version == "v2" else graph_impl_1
-    d = impl(x, y, dimx, dimy, zoom=zoom, limit=limit, typ=typ)
-    return jsonify(d)
+    q = dict(x=x, y=y, dimx=dimx, dimy=dimy, zoom=zoom, limit=limit, typ=typ)
+    # /select recomputes the displayed nodes from this token
+    q["viewport"] = viewport_token(
+        make_viewport(version, x, y, zoom, dimx, dimy, typ, limit)
+    )
+    if version == "v2":
+        return q
+
+    # how the members of a record label are linked, see infovis21.links
+    link_mode = args.get("links", linkutils.DEFAULT_LINK_MODE)
+    if link_mode not in linkutils.LINK_MODES:
+        return abort(
+            400, description=f"links needs to be one of {linkutils.LINK_MODES}",
+        )
+    q["max_links"] = int_arg(args, "max_links", linkutils.DEFAULT_LINK_BUDGET)
+    q["link_k"] = int_arg(args, "link_k", linkutils.DEFAULT_KNN, minimum=1)
+    q["link_mode"] = link_mode
+    return q
+
+
+@app.route("/<version>/graph")
+@cross_origin()
+def _graph(version):
+    """ Return a the graph data for a specific zoom level and postion """
+    q = graph_query(version, request.args)
+    viewport = q.pop("viewport")
+    if version == "v2":
+        d = graph_impl_2(**q)
+    else:
+        d = graph_impl_1(**q)
+    d["viewport"] = viewport
+    return columnar.respond(d)
+
+
+def graph_tiles(args):
+    try:
+        x, y, zoom = [float(args[arg]) for arg in ["x", "y", "zoom"]]
+    except (KeyError, ValueError):
+        return abort(
+            400,
+            description="Please specify x and y coordinates and zoom level, e.g. /graph/tiles?x=0.5&y=0.5&zoom=0.2",
+        )
+    zoom_level, bounds = zoom_viewport(x, y, zoom)
+    return {
+        "z": zoom_level,
+        "n_tiles": spatial.grid_size(zoom_level, dbutils.N_ZOOM_LEVELS),
+        "tiles": tiles.viewport_tiles(zoom_level, *bounds),
+    }
+
+
+@app.route("/<version>/graph/tiles")
+@cross_origin()
+def _graph_tiles(version):
+    """ Return the zoom level and the tiles that cover a viewport, the tiles can be
+    fetched from /graph/tile/<dimx>/<dimy>/<type>/<z>/<tx>/<ty>
+    """
+    return jsonify(graph_tiles(request.args))
+
+
+def graph_tile_query(dimx, dimy, typ, z, tx, ty):
+    """ Validate a tile address, returns the response without the nodes and links
+    and the pipelines to find them
+    """
+    if dimx not in ma.dimensions or dimy not in ma.dimensions or dimx == dimy:
+        return abort(
+            400,
+            description=f"dimensions need to be different and one of {ma.dimensions}",
+        )
+    get_collection(typ)  # validates the node type
+    if not 0 <= z < dbutils.N_ZOOM_LEVELS:
+        return abort(404, description=f"z needs to be in [0, {dbutils.N_ZOOM_LEVELS})")
+    n_tiles = spatial.grid_size(z, dbutils.N_ZOOM_LEVELS)
+    if not (0 <= tx < n_tiles and 0 <= ty < n_tiles):
+        return abort(
+            404, description=f"tx and ty need to be in [0, {n_tiles}) at z={z}"
+        )
+
+    typ = typ.lower()
+    nodes, links = tiles.tile_pipelines(
+        dimx, dimy, typ, z, tx, ty, node_projection(typ), link_projection
+    )
+    x_min, x_max, y_min, y_max = tiles.tile_bounds(z, tx, ty)
+    d = {
+        "dimx": dimx,
+        "dimy": dimy,
+        "type": typ,
+        "z": z,
+        "tx": tx,
+        "ty": ty,
+        "n_tiles": n_tiles,
+        "bounds": {"x_min": x_min, "x_max": x_max, "y_min": y_min, "y_max": y_max},
+    }
+    return d, nodes, links
+
+
+@app.route("/<version>/graph/tile/<dimx>/<dimy>/<typ>/<int:z>/<int:tx>/<int:ty>")
+@cross_origin()
+@cache.cached
+def _graph_tile(version, dimx, dimy, typ, z, tx, ty):
+    """ Return the precomputed nodes and links of a single tile, tile (tx, ty) of
+    zoom level z covers [tx / n, (tx + 1) / n] x [ty / n, (ty + 1) / n] with n
+    tiles per axis
+    """
+    d, nodes, links = graph_tile_query(dimx, dimy, typ, z, tx, ty)
+    d["nodes"] = list(tiles.nodes_collection().aggregate(nodes))
+    d["links"] = list(tiles.links_collection().aggregate(links))
+    return columnar.respond(d)
@@ -7,7 +7,7 @@ from pprint import pprint
 import datetime
 import itertools
 
-from invoke import task
+from invoke import Exit, task
 import webbrowser
 from pathlib import Path
 
@@ -63,6 +63,23 @@ def start(c, _open=False, debug=True):
     )
 
 
+@task(help={"port": "Port to listen on", "workers": "Number of worker processes"})
+def start_asgi(c, port=5000, workers=1):
+    """Start the asyncio api server, serves the same routes as the flask server"""
+    c.run(
+        f"pipenv run uvicorn infovis21.asgi:app --port {port} --workers {workers}"
+    )
+
+
+@task
+def bump_dataset_version(c):
+    """Mark the data as changed, cached api responses are invalidated"""
+    from infovis21.mongodb import MongoAccess as ma
+
+    doc = ma.bump_dataset_version("invoke")
+    print("dataset version", doc["version"])
+
+
 @task(help={"sudo": "Use sudo"})
 def snapshot(c, sudo=False):
     """Create a snapshot of the current mongodb database"""
@@ -73,7 +90,7 @@ def snapshot(c, sudo=False):
     c.run(f"tar -C {DATA_DIR} -cJf db.tar.xz db.dump && mv db.tar.xz ../data")
 
 
-@task(help={"sudo": "Use sudo"})
+@task(help={"sudo": "Use sudo"}, post=[bump_dataset_version])
 def restore(c, sudo=False):
     """Restore the database from a snapshot"""
     _sudo = "sudo" if sudo else ""
@@ -94,7 +111,75 @@ def restore(c, sudo=False):
         f"{_sudo} docker exec -i $({_sudo} docker ps -a | grep musexmongodb | awk '{{print $1}}') sh -c 'mongorestore  --drop --db kaggle --authenticationDatabase admin --username root --password example --archive' < {DATA_DIR}/db.dump"
     )
 
-@task
+@task(
+    help={
+        "resume": "Keep the collections of an interrupted run and only fetch what is missing",
+        "workers": "Number of concurrent Spotify requests",
+    },
+    post=[bump_dataset_version],
+)
+def load_kaggle(c, resume=False, workers=None):
+    """Load the kaggle csvs into MongoDB and enrich them with Spotify data"""
+    from infovis21.mongodb import MongoAccess as ma
+
+    ma.load_kaggle_csvs_into_mongodb(
+        resume=resume, workers=int(workers) if workers else None
+    )
+
+
+@task(
+    help={
+        "csv": "The new version of the kaggle csv",
+        "workers": "Number of concurrent Spotify requests",
+    },
+)
+def refresh_kaggle(c, csv="../data/kaggle/data.csv", workers=None):
+    """Apply a new version of the kaggle csv, only the changed tracks and what depends on them are updated"""
+    import dotenv
+
+    from infovis21.mongodb import incremental
+
+    dotenv.load_dotenv()
+    try:
+        result = incremental.refresh(csv, workers=int(workers) if workers else None)
+    except RuntimeError as e:
+        raise Exit(str(e), code=1)
+    pprint(result)
+
+
+@task(
+    help={
+        "targets": "Comma separated stages to bring up to date, with the stages they depend on (default: all)",
+        "force": "Comma separated stages to run even if they are up to date, or all",
+        "workers": "Number of stages that run at the same time",
+        "csv": "The kaggle csv",
+        "list_stages": "Only list the stages with their inputs and outputs",
+    },
+    post=[bump_dataset_version],
+)
+def etl(c, targets=None, force=None, workers=None, csv="../data/kaggle/data.csv", list_stages=False):
+    """Run the stages of the ETL whose inputs changed since their last run"""
+    from infovis21.mongodb import dag
+
+    stages = dag.etl_stages(csv)
+    if list_stages:
+        for stage in dag.plan(stages):
+            print(f"{stage.name}: {', '.join(stage.inputs)} -> {', '.join(stage.outputs)}")
+        return
+    entries = dag.run(
+        stages,
+        targets=targets.split(",") if targets else None,
+        workers=int(workers) if workers else dag.WORKERS,
+        force=True if force == "all" else (force.split(",") if force else ()),
+    )
+    failed = [entry for entry in entries if entry["status"] == dag.FAILED]
+    for entry in failed:
+        print(f"{entry['stage']} failed: {entry['error']}")
+    if failed:
+        raise Exit(code=1)
+
+
+@task(post=[bump_dataset_version])
 def add_genre_super_info(c):
     '''Adds the genre_super and genre_color fields to the genre and artist per year collections'''
     from infovis21.mongodb import utils as dbutils
@@ -102,20 +187,20 @@ def add_genre_super_info(c):
     dbutils.add_genre_super_info('artist', 'artist', 'id')
     # dbutils.add_genre_super_info('artist', 'artist', 'id')
 
-@task
+@task(post=[bump_dataset_version])
 def update_tracks_api_to_include_artists(c):
     '''Adds the genre_super and genre_color fields to the genre and artist per year collections'''
     from infovis21.mongodb import utils as dbutils
     dbutils.update_tracks_api_to_include_artists()
 
-@task
+@task(post=[bump_dataset_version])
 def compute_track_api(
     c,
 ):
     from infovis21.mongodb import utils as dbutils
     dbutils.compute_track_api()
 
-@task
+@task(post=[bump_dataset_version])
 def compute_artist_popularity_per_year(
     c,
 ):
@@ -130,7 +215,7 @@ def compute_artist_popularity_per_year(
     print("done")
 
 
-@task
+@task(post=[bump_dataset_version])
 def compute_genre_popularity_per_year(
     c,
 ):
@@ -145,7 +230,13 @@ def compute_genre_popularity_per_year(
     print("done")
 
 
-@task
+@task(
+    help={
+        "workers": "Number of worker processes (default: number of CPUs)",
+        "fresh": "Recompute all layers instead of resuming the last run",
+    },
+    post=[bump_dataset_version],
+)
 def precompute(
     c,
     _dimx=None,
@@ -155,8 +246,12 @@ def precompute(
     limit=None,
     offset=None,
     plot=False,
+    workers=None,
+    fresh=False,
 ):
+    """Precompute the zoom level layers for all dimension pairs"""
     from infovis21.mongodb import MongoAccess as ma
+    from infovis21.mongodb import precompute as runner
     from infovis21.mongodb import utils as dbutils
 
     x_dims = [_dimx] if _dimx else ma.dimensions
@@ -164,20 +259,233 @@ def precompute(
     types = [_typ] if _typ else ["genre", "artist", "track"]
     zoomes = [int(_zoom)] if _zoom else range(dbutils.N_ZOOM_LEVELS)
 
+    jobs = runner.plan_jobs(x_dims, y_dims, types, zoomes)
+    if plot:
+        for dimx, dimy, typ, zooms in jobs:
+            dbutils.precompute_pyramid(
+                dimx, dimy, typ, zooms, offset=offset or 0, limit=limit, plot=plot
+            )
+        return
+    runner.run(
+        jobs,
+        workers=int(workers) if workers else None,
+        resume=not fresh,
+        offset=offset or 0,
+        limit=limit,
+    )
+
+
+@task(
+    help={
+        "sizes": "Comma separated numbers of points (default 10000,170000,1000000)",
+        "max_old": "Largest size for which the old KD-tree filtering is run",
+    }
+)
+def benchmark_filtering(c, sizes=None, max_old=170_000):
+    """Benchmark the node filtering used by precompute"""
+    from benchmarks import filtering
+
+    sizes = [int(s) for s in sizes.split(",")] if sizes else filtering.SIZES
+    filtering.run(sizes=sizes, max_old=int(max_old))
+
+
+@task(
+    help={
+        "concurrency": "Comma separated numbers of concurrent clients (default 1,8,32,64)",
+        "requests": "Number of requests per run",
+        "version": "api version (v1 or v2)",
+        "servers": "Comma separated servers to compare (flask,asgi)",
+    }
+)
+def benchmark_concurrency(
+    c, concurrency=None, requests=None, version="v2", servers="flask,asgi"
+):
+    """Benchmark the flask server against the asyncio server under concurrent load"""
+    from benchmarks import concurrency as bench
+
+    bench.run(
+        concurrency=[int(n) for n in concurrency.split(",")]
+        if concurrency
+        else bench.CONCURRENCY,
+        n=int(requests) if requests else bench.N_REQUESTS,
+        version=version,
+        servers=servers.split(","),
+    )
+
+
+@task(
+    help={
+        "sizes": "Comma separated numbers of tracks of the synthetic datasets (default 10000,170000,1000000)",
+        "requests": "Number of requests per endpoint",
+        "endpoints": "Comma separated endpoints (graph_v1,graph_v2,select,search,most_popular)",
+        "seed": "Seed of the datasets and the requests",
+        "force": "Seed the datasets and precompute their layers again",
+        "save_baseline": "Save the results as the new baselines instead of comparing",
+        "threshold": "Relative growth of a metric that counts as a regression (default 0.2)",
+    }
+)
+def benchmark_endpoints(
+    c,
+    sizes=None,
+    requests=None,
+    endpoints=None,
+    seed=0,
+    force=False,
+    save_baseline=False,
+    threshold=None,
+):
+    """Benchmark the endpoints on synthetic datasets, fails on regressions"""
+    from benchmarks import endpoints as bench
+
+    regressions = bench.run(
+        sizes=[int(s) for s in sizes.split(",")] if sizes else bench.SIZES,
+        n=int(requests) if requests else bench.N_REQUESTS,
+        seed=int(seed),
+        endpoints=endpoints.split(",") if endpoints else bench.ENDPOINTS,
+        force=force,
+        save_baseline=save_baseline,
+        threshold=float(threshold) if threshold else bench.THRESHOLD,
+    )
+    if regressions:
+        sizes = ", ".join(str(n) for n in regressions)
+        raise Exit(f"endpoints slower than the baseline at {sizes} tracks", code=1)
+
+
+@task(
+    help={
+        "tracks": "Number of tracks of the catalogue",
+        "seed": "Seed of the catalogue, the same seed gives the same catalogue",
+        "db": "Database to write to (default musex_synthetic_<tracks>_<seed>)",
+        "allow_production": "Allow replacing the catalogue of the database configured for the api",
+        "profile": "Profile (JSON) of the feature distributions, see synthetic-profile (default: built in)",
+        "api": "Create the api collections from the catalogue as well",
+        "batch_size": "Documents per insert_many",
+        "writers": "Number of insert_many calls at the same time",
+    },
+    post=[bump_dataset_version],
+)
+def synthetic_catalogue(
+    c,
+    tracks=170_000,
+    seed=0,
+    db=None,
+    allow_production=False,
+    profile=None,
+    api=False,
+    batch_size=None,
+    writers=None,
+):
+    """Write a synthetic tracks_full, artists_full, genres_full and labels_full to a database of its own"""
+    from infovis21.mongodb import synthetic
+
+    tracks, seed = int(tracks), int(seed)
+    synthetic.use_database(db or synthetic.database_name(tracks, seed))
+    try:
+        synthetic.write(
+            tracks,
+            seed=seed,
+            profile=synthetic.load_profile(profile) if profile else None,
+            batch_size=int(batch_size) if batch_size else synthetic.BATCH_SIZE,
+            writers=int(writers) if writers else synthetic.WRITERS,
+            allow_production=allow_production,
+        )
+    except ValueError as e:
+        raise Exit(str(e), code=1)
+    if api:
+        synthetic.create_api_collections(allow_production=allow_production)
+
+
+@task(
+    help={
+        "out": "Where to save the profile",
+        "sample": "Number of tracks the profile is fitted to",
+    }
+)
+def synthetic_profile(c, out="../data/synthetic_profile.json", sample=200_000):
+    """Fit the feature distributions of synthetic catalogues to the tracks in tracks_full"""
+    from infovis21.mongodb import MongoAccess as ma
+    from infovis21.mongodb import synthetic
+
+    docs = ma.db["tracks_full"].aggregate(
+        [
+            {"$sample": {"size": int(sample)}},
+            {"$project": {f: 1 for f in synthetic.FEATURES}},
+        ]
+    )
+    synthetic.save_profile(synthetic.fit_profile(list(docs)), out)
+    print(f"saved the profile to {out}")
+
+
+@task(
+    help={
+        "module": "Module to profile (default: the api modules infovis21.views and infovis21.asgi)",
+        "budget": "Maximum import time in seconds (default 1.5 or MUSEX_IMPORT_BUDGET)",
+        "top": "Number of packages and modules to list",
+    }
+)
+def profile_startup(c, module=None, budget=None, top=15):
+    """Report the import time of the api per module, fails above the budget"""
+    from benchmarks import startup
+
+    over = startup.run(
+        modules=[module] if module else startup.SERVING_MODULES,
+        budget=float(budget) if budget else startup.BUDGET,
+        top=int(top),
+    )
+    if over:
+        raise Exit(f"import time over budget: {', '.join(over)}", code=1)
+
+
+@task(
+    help={"drop": "Drop the old per layer collections after copying them"},
+    post=[bump_dataset_version],
+)
+def migrate_precomputed(c, _dimx=None, _dimy=None, _typ=None, _zoom=None, drop=False):
+    """ Move layers from the old per layer collections into the tile store """
+    from infovis21.mongodb import MongoAccess as ma
+    from infovis21.mongodb import tiles
+    from infovis21.mongodb import utils as dbutils
+
+    x_dims = [_dimx] if _dimx else ma.dimensions
+    y_dims = [_dimy] if _dimy else ma.dimensions
+    types = [_typ] if _typ else ["genre", "artist", "track"]
+    zoomes = [int(_zoom)] if _zoom else range(dbutils.N_ZOOM_LEVELS)
+
+    tiles.create_indexes()
+    migrated = set()
     for dimx, dimy, typ, zoom in itertools.product(x_dims, y_dims, types, zoomes):
+        # (dimy, dimx) is stored as (dimx, dimy), its old copy is only dropped
+        layer = (min(dimx, dimy), max(dimx, dimy), typ, zoom)
         if dimx != dimy:
-            dbutils.precompute_nodes(
-                dimx, dimy, typ, zoom, offset=offset or 0, limit=limit, plot=plot
+            if layer in migrated:
+                if drop:
+                    dbutils.migrate_precomputed_layer(
+                        dimx, dimy, typ, zoom, drop=True, copy=False
+                    )
+                continue
+            migrated.add(layer)
+            n_nodes, n_links = dbutils.migrate_precomputed_layer(
+                dimx, dimy, typ, zoom, drop=drop
             )
+            print("migrated", dimx, dimy, typ, zoom, n_nodes, "nodes", n_links, "links")
 
 
-@task
-def download_audio_previews(c, limit=None, offset=None):
+@task(
+    help={
+        "limit": "Number of tracks",
+        "offset": "Number of tracks to skip",
+        "workers": "Number of concurrent downloads",
+        "verify": "Check the sha1 of the cached previews and download the broken ones again",
+    }
+)
+def download_audio_previews(c, limit=None, offset=None, workers=None, verify=False):
     """ Download audio file previews via the spotify API """
-    import requests
-    from infovis21 import spotifyapi as api
+    import dotenv
+
+    from infovis21 import previews
     from infovis21.mongodb import MongoAccess as ma
 
+    dotenv.load_dotenv()
     offset = int(offset) if offset else 0
     pipeline = [
         {"$match": {}},  # all tracks
@@ -186,31 +494,20 @@ def download_audio_previews(c, limit=None, offset=None):
     ]
     if limit is not None:
         pipeline.append({"$limit": int(limit)})
-
-    for idx, track in enumerate(ma.coll_tracks.aggregate(pipeline)):
-        track_id = track.get("id")
-        current = offset + idx + 1
-        current = (
-            f"({current}{'/' + str(offset + int(limit)) if limit is not None else ''})"
+    pipeline.append({"$project": {"id": 1, "_id": 0}})
+
+    track_ids = [t["id"] for t in ma.coll_tracks.aggregate(pipeline) if t.get("id")]
+    pprint(
+        previews.download(
+            track_ids,
+            cache_dir=PREVIEW_CACHE_DIR,
+            workers=int(workers) if workers else previews.WORKERS,
+            verify=verify,
         )
-
-        print(current, f"Processing {track_id} ...")
-        if track_id is not None:
-            track = api.get_spotify_track(track_id)
-            preview_url = track.get("preview_url")
-            # pprint(track)
-            if preview_url is not None:
-                preview_file = PREVIEW_CACHE_DIR / (track_id + ".mp3")
-                if preview_file.exists():
-                    continue
-                preview_file.parent.mkdir(parents=True, exist_ok=True)
-                print(current, f"Downloading {preview_file} ...")
-                preview = requests.get(preview_url)
-                with open(preview_file, "wb") as f:
-                    f.write(preview.content)
+    )
 
 
-@task
+@task(post=[bump_dataset_version])
 def compute_min_max(c):
     """Compute min and max ranges of values in the dataset"""
     from infovis21.mongodb import utils as dbutils
@@ -219,7 +516,7 @@ def compute_min_max(c):
     pprint(res)
 
 
-@task
+@task(post=[bump_dataset_version])
 def add_labels_to_genres(c):
     """Add labels to genres"""
     from infovis21.mongodb import utils as dbutils
@@ -228,7 +525,7 @@ def add_labels_to_genres(c):
     pprint(res)
 
 
-@task
+@task(post=[bump_dataset_version])
 def create_album_collection(c):
     """Create album collection"""
     from infovis21.mongodb import utils as dbutils
@@ -345,7 +642,33 @@ def release(c):
 
 
 @task(
-    pre=[restore, compute_artist_popularity_per_year, compute_genre_popularity_per_year]
+    help={
+        "k": "Entries per year and type",
+        "matrix_k": "Keys of the popularity matrix per year",
+    },
+    post=[bump_dataset_version],
+)
+def materialize_most_popular(c, k=None, matrix_k=None):
+    """Materialize the per year top lists served by /most_popular"""
+    from infovis21.mongodb import popularity
+
+    pprint(
+        popularity.materialize(
+            k=int(k) if k else popularity.TOP_K,
+            matrix_k=int(matrix_k) if matrix_k else popularity.MATRIX_TOP_K,
+        )
+    )
+
+
+@task(
+    pre=[
+        restore,
+        compute_artist_popularity_per_year,
+        compute_genre_popularity_per_year,
+        materialize_most_popular,
+    ]
 )
 def bootstrap(c):
     print("Bootrapping ...")
+    # post tasks run only once per invocation, the pre tasks changed the data again
+    bump_dataset_version(c)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from starlette.testclient import TestClient
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import BadRequest
+from werkzeug.http import parse_accept_header
+
+from infovis21 import asgi, columnar
+from infovis21.app import app as flask_app
+
+# these routes do not query MongoDB
+PATHS = [
+    "/v2/graph/tiles?x=0.5&y=0.5&zoom=0.2",
+    "/v2/graph/tiles?x=0.5",
+    "/v1/graph?x=0.5&y=0.5&zoom=0.2&dimx=energy&dimy=energy&type=track",
+    "/v2/graph?x=0.5&y=0.5",
+    "/v1/select?node=a&dimx=energy&dimy=valence&type=track",
+]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_same_responses_as_flask(path: str) -> None:
+    expected = flask_app.test_client().get(path)
+    response = TestClient(asgi.app).get(path)
+    assert response.status_code == expected.status_code
+    assert response.json() == expected.get_json()
+
+
+def test_negotiate() -> None:
+    accept = parse_accept_header(
+        f"{columnar.MIMETYPE}, application/json;q=0.5", MIMEAccept
+    )
+    assert columnar.negotiate(None, accept) == "columnar"
+    assert columnar.negotiate("json", accept) == "json"
+    assert columnar.negotiate(None, parse_accept_header(None, MIMEAccept)) == "json"
+    with pytest.raises(BadRequest):
+        columnar.negotiate("xml", accept)
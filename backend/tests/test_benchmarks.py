@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+from benchmarks import endpoints
+
+
+def test_compare_with_baseline() -> None:
+    def results(p50: float, size: float) -> typing.Dict[str, typing.Any]:
+        summary = {"p50": p50, "p90": p50, "p99": p50, "bytes_mean": size}
+        return {"endpoints": {"search": summary, "select": dict(summary)}}
+
+    baseline = results(10.0, 1000)
+    rows, regressions = endpoints.compare(results(11.0, 1000), baseline)
+    assert len(rows) == 8 and regressions == []
+    _, regressions = endpoints.compare(results(15.0, 1000), baseline)
+    assert {(r[0], r[1]) for r in regressions} == {
+        (endpoint, metric)
+        for endpoint in ["search", "select"]
+        for metric in ["p50", "p90", "p99"]
+    }
+    # growing by a fraction of a millisecond is noise
+    _, regressions = endpoints.compare(results(0.6, 1300), results(0.2, 1000))
+    assert [r[1] for r in regressions] == ["bytes_mean", "bytes_mean"]
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.results import BulkWriteResult
+
+from infovis21.mongodb import bulk
+
+
+class FakeCollection:
+    name = "fake"
+
+    def __init__(self) -> None:
+        self.calls: typing.List[typing.Tuple[typing.List[typing.Any], bool]] = []
+
+    def bulk_write(self, ops: typing.List[typing.Any], ordered: bool) -> typing.Any:
+        self.calls.append((ops, ordered))
+        inserted = sum(isinstance(op, InsertOne) for op in ops)
+        updated = sum(isinstance(op, UpdateOne) for op in ops)
+        return BulkWriteResult(
+            {
+                "nInserted": inserted,
+                "nMatched": updated,
+                "nModified": updated,
+                "nUpserted": 0,
+                "nRemoved": 0,
+                "upserted": [],
+            },
+            True,
+        )
+
+
+def test_batches_are_written_unordered() -> None:
+    coll = FakeCollection()
+    with bulk.BulkWriter(coll, batch_size=4, verbose=False) as writer:
+        for i in range(6):
+            writer.insert({"i": i})
+        writer.update({"i": 0}, {"$set": {"j": 1}})
+        assert len(coll.calls) == 1
+    assert [len(ops) for ops, _ in coll.calls] == [4, 3]
+    assert not any(ordered for _, ordered in coll.calls)
+    assert writer.stats["ops"] == 7
+    assert writer.stats["batches"] == 2
+    assert writer.stats["inserted"] == 6
+    assert writer.stats["modified"] == 1
+
+
+def test_insert_all() -> None:
+    coll = FakeCollection()
+    stats = bulk.insert_all(coll, ({"i": i} for i in range(2500)), verbose=False)
+    assert [len(ops) for ops, _ in coll.calls] == [1000, 1000, 500]
+    assert stats["inserted"] == 2500
+    assert bulk.insert_all(FakeCollection(), [], verbose=False)["batches"] == 0
+
+
+def test_nothing_more_is_written_after_an_error() -> None:
+    coll = FakeCollection()
+    with pytest.raises(RuntimeError):
+        with bulk.BulkWriter(coll, batch_size=10, verbose=False) as writer:
+            writer.insert({"i": 0})
+            raise RuntimeError()
+    assert coll.calls == []
+
+
+def test_batches_are_written_by_workers() -> None:
+    coll = FakeCollection()
+    stats = bulk.insert_all(
+        coll, ({"i": i} for i in range(2500)), verbose=False, workers=3
+    )
+    assert sorted(len(ops) for ops, _ in coll.calls) == [500, 1000, 1000]
+    assert stats["inserted"] == 2500 and stats["batches"] == 3
+    written = [op._doc["i"] for ops, _ in coll.calls for op in ops]
+    assert sorted(written) == list(range(2500))
+
+
+class FailingCollection(FakeCollection):
+    def bulk_write(self, ops: typing.List[typing.Any], ordered: bool) -> typing.Any:
+        raise ValueError("write failed")
+
+
+def test_ordered_writes_need_one_worker() -> None:
+    with pytest.raises(ValueError):
+        bulk.BulkWriter(FakeCollection(), ordered=True, workers=2)
+    bulk.BulkWriter(FakeCollection(), ordered=True).close()
+
+
+def test_errors_of_workers_do_not_hide_the_error() -> None:
+    with pytest.raises(RuntimeError):
+        with bulk.BulkWriter(
+            FailingCollection(), batch_size=1, verbose=False, workers=2
+        ) as writer:
+            writer.insert({"i": 0})
+            raise RuntimeError()
+    with pytest.raises(ValueError):
+        bulk.insert_all(FailingCollection(), [{"i": 0}], verbose=False, workers=2)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+from datetime import datetime
+
+import pytest
+from flask import Flask, jsonify
+
+from infovis21 import cache
+from infovis21.mongodb import MongoAccess as ma
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> typing.Any:
+    stamp = {"version": "a" * 32, "updated_at": datetime(2021, 1, 1)}
+    monkeypatch.setattr(ma, "get_dataset_version", lambda: dict(stamp))
+    monkeypatch.setattr(ma, "VERSION_TTL", -1)
+    ma.reset_cache()
+    cache.clear()
+
+    app = Flask(__name__)
+    calls = []
+
+    @app.route("/items")
+    @cache.cached
+    def items() -> typing.Any:
+        calls.append(1)
+        return jsonify({"n": len(calls)})
+
+    client = app.test_client()
+    client.stamp, client.calls = stamp, calls
+    yield client
+    ma.reset_cache()
+
+
+def test_cached_until_version_changes(client: typing.Any) -> None:
+    first = client.get("/items?b=2&a=1")
+    assert first.get_json() == {"n": 1}
+    # same normalized parameters
+    assert client.get("/items?a=1&b=2&c=").get_json() == {"n": 1}
+    assert client.get("/items?a=2").get_json() == {"n": 2}
+
+    client.stamp["version"] = "b" * 32
+    assert client.get("/items?a=1&b=2").get_json() == {"n": 3}
+
+
+def test_conditional_requests(client: typing.Any) -> None:
+    first = client.get("/items")
+    assert first.headers["ETag"] and first.headers["Last-Modified"]
+    etag = first.headers["ETag"]
+    assert client.get("/items", headers={"If-None-Match": etag}).status_code == 304
+    since = first.headers["Last-Modified"]
+    assert client.get("/items", headers={"If-Modified-Since": since}).status_code == 304
+
+    client.stamp["version"] = "b" * 32
+    assert client.get("/items", headers={"If-None-Match": etag}).status_code == 200
+    assert len(client.calls) == 2
+
+
+def test_lru_is_bounded(client: typing.Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(cache, "MAX_ENTRIES", 2)
+    for i in range(3):
+        client.get(f"/items?i={i}")
+    assert len(cache._entries) == 2
+    client.get("/items?i=0")
+    assert len(client.calls) == 4
+
+
+def test_minmax_follows_the_version(client: typing.Any) -> None:
+    client.get("/items")
+    ma._cache["dim_minmax"] = {"energy": {"min": 0, "max": 1}}
+    client.get("/items")
+    assert "dim_minmax" in ma._cache
+    # read again on first use after the ETL changed the data
+    client.stamp["version"] = "b" * 32
+    client.get("/items")
+    assert "dim_minmax" not in ma._cache
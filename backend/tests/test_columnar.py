@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from infovis21 import columnar
+
+
+def test_roundtrip() -> None:
+    d = {
+        "x": 0.5,
+        "type": "track",
+        "nodes": [
+            {
+                "id": "t1",
+                "x": 0.25,
+                "size": 10,
+                "color": "#fff",
+                "genre": ["pop", "rock"],
+                "artists": [{"name": "a"}],
+            },
+            {
+                "id": "t2",
+                "x": np.float32(0.75),
+                "size": None,
+                "color": "#fff",
+                "genre": ["pop"],
+                "artists": [],
+            },
+        ],
+        "links": [],
+    }
+    data = columnar.encode(d)
+    assert data[:4] == columnar.MAGIC
+    assert columnar.decode(data) == {
+        **d,
+        "nodes": [
+            {**d["nodes"][0], "size": 10.0},
+            {**d["nodes"][1], "x": 0.75},
+        ],
+    }
+
+
+def test_strings_are_shared_and_buffers_aligned() -> None:
+    nodes = [{"color": "#fff", "genre": ["pop"], "x": float(i)} for i in range(3)]
+    data = columnar.encode({"nodes": nodes})
+    length = int.from_bytes(data[4:8], "little")
+    assert (8 + length) % 4 == 0
+    assert data.count(b"#fff") == 1 and data.count(b"pop") == 1
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import types
+import typing
+
+import pytest
+
+from infovis21.mongodb import connection
+
+
+class FakeClient:
+    def __init__(self, uri: str, **kwargs: typing.Any) -> None:
+        self.uri, self.kwargs, self.closed = uri, kwargs, False
+
+    def __getitem__(self, name: str) -> str:
+        return name
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def fake_client(monkeypatch: pytest.MonkeyPatch) -> typing.Any:
+    monkeypatch.setattr(connection, "MongoClient", FakeClient)
+    monkeypatch.setattr(
+        connection,
+        "_state",
+        {"settings": None, "overrides": dict(), "client": None, "pid": None},
+    )
+    for key in connection.DEFAULTS:
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setattr(connection.dotenv, "load_dotenv", lambda: None)
+    return FakeClient
+
+
+def test_client_is_created_lazily_from_settings(
+    fake_client: typing.Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("MONGO_URI", "mongodb://db:27017/")
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "8")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zlib")
+    assert connection._state["client"] is None
+
+    client = connection.client()
+    assert client is connection.client()
+    assert client.uri == "mongodb://db:27017/"
+    assert client.kwargs["maxPoolSize"] == 8
+    assert client.kwargs["compressors"] == "zlib"
+    assert "socketTimeoutMS" not in client.kwargs
+    assert connection.db() == "kaggle"
+
+    connection.configure(MONGO_MAX_POOL_SIZE=2, MONGO_DB="test")
+    assert client.closed
+    assert connection.client().kwargs["maxPoolSize"] == 2
+    assert connection.db() == "test"
+    assert connection.configured("MONGO_DB") == "kaggle"
+    with pytest.raises(ValueError):
+        connection.configure(MONGO_POOL=1)
+
+
+def test_new_client_after_fork(fake_client: typing.Any) -> None:
+    client = connection.client()
+    connection._after_fork_in_child()
+    assert connection.client() is not client
+    # the parent's client is left alone
+    assert not client.closed
+
+
+def test_pool_metrics() -> None:
+    metrics = connection.PoolMetrics()
+    event = types.SimpleNamespace(duration=0.5, reason="timeout")
+    metrics.pool_created(event)
+    metrics.connection_created(event)
+    for _ in range(3):
+        metrics.connection_check_out_started(event)
+    metrics.connection_checked_out(event)
+    metrics.connection_check_out_failed(event)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["open"] == 1
+    assert snapshot["in_use"] == 1
+    assert snapshot["waiting"] == 1
+    assert snapshot["failure_reasons"] == {"timeout": 1}
+    assert snapshot["wait_seconds_max"] == 0.5
+
+    metrics.connection_checked_in(event)
+    assert metrics.snapshot()["in_use"] == 0
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import typing
+
+import pytest
+
+from infovis21.mongodb import dag
+
+
+class FakeState:
+    """ The calls of the runner to the state collection """
+
+    def __init__(self) -> None:
+        self.docs: typing.Dict[str, typing.Dict[str, typing.Any]] = dict()
+
+    def find(self, query: typing.Any) -> typing.List[typing.Dict[str, typing.Any]]:
+        return [{"_id": name, **doc} for name, doc in self.docs.items()]
+
+    def replace_one(
+        self, query: typing.Dict[str, str], doc: typing.Any, upsert: bool = False
+    ) -> None:
+        self.docs[query["_id"]] = doc
+
+
+class Collections:
+    """ Collections as versioned values, a stage writes its outputs from its inputs """
+
+    def __init__(self, **values: int) -> None:
+        self.values = dict(values)
+        self.runs: typing.List[str] = []
+
+    def stage(
+        self, name: str, inputs: typing.List[str], outputs: typing.List[str]
+    ) -> dag.Stage:
+        def fn() -> None:
+            self.runs.append(name)
+            for output in outputs:
+                self.values[output] = sum(self.values.get(i, 0) for i in inputs)
+
+        return dag.Stage(name, fn, inputs, outputs)
+
+    def fingerprint(self, names: typing.List[str]) -> typing.Dict[str, typing.Any]:
+        return {name: self.values.get(name) for name in names}
+
+
+def etl(collections: Collections) -> typing.List[dag.Stage]:
+    return [
+        collections.stage("genres", ["full"], ["genres"]),
+        collections.stage("full", ["raw"], ["full"]),
+        collections.stage("years", ["full"], ["years"]),
+        collections.stage("api", ["genres", "years"], ["api"]),
+    ]
+
+
+def test_plan_orders_by_dependencies() -> None:
+    stages = etl(Collections())
+    assert [s.name for s in dag.plan(stages)] == ["full", "genres", "years", "api"]
+    assert [s.name for s in dag.plan(stages, ["genres"])] == ["full", "genres"]
+    with pytest.raises(ValueError):
+        dag.plan(stages, ["nope"])
+    with pytest.raises(ValueError):
+        dag.plan(stages + [dag.Stage("again", print, ["raw"], ["years"])])
+    with pytest.raises(ValueError):
+        dag.plan(
+            [dag.Stage("a", print, ["b"], ["a"]), dag.Stage("b", print, ["a"], ["b"])]
+        )
+
+
+def test_skips_stages_with_unchanged_inputs() -> None:
+    collections, state = Collections(raw=1), FakeState()
+
+    def run(**kwargs: typing.Any) -> typing.Dict[str, str]:
+        collections.runs = []
+        entries = dag.run(
+            etl(collections),
+            fingerprint=collections.fingerprint,
+            state=state,
+            **kwargs,
+        )
+        return {entry["stage"]: entry["status"] for entry in entries}
+
+    assert set(run().values()) == {dag.RAN}
+    assert set(run().values()) == {dag.SKIPPED}
+
+    collections.values["raw"] = 2
+    assert run() == {name: dag.RAN for name in ["full", "genres", "years", "api"]}
+
+    # an output that was changed by hand is written again
+    collections.values["years"] = 0
+    assert run()["years"] == dag.RAN
+    assert collections.runs == ["years"]
+
+    assert run(force=["genres"])["genres"] == dag.RAN
+    assert collections.runs == ["genres"]
+    assert set(run(force=True).values()) == {dag.RAN}
+
+
+def test_failed_stage_blocks_its_dependents() -> None:
+    collections = Collections(raw=1)
+    stages = etl(collections)
+
+    def fail() -> None:
+        raise RuntimeError("no genres")
+
+    stages[0].fn = fail
+    entries = dag.run(stages, fingerprint=collections.fingerprint, state=FakeState())
+    status = {entry["stage"]: entry["status"] for entry in entries}
+    assert status == {
+        "full": dag.RAN,
+        "genres": dag.FAILED,
+        "years": dag.RAN,
+        "api": dag.BLOCKED,
+    }
+
+
+def test_independent_stages_run_concurrently() -> None:
+    collections = Collections(raw=1)
+    stages = etl(collections)
+    # both wait for each other, which only works when they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    for stage in stages:
+        if stage.name in ("genres", "years"):
+            fn = stage.fn
+            stage.fn = lambda fn=fn: (barrier.wait(), fn())
+    entries = dag.run(
+        stages, workers=2, fingerprint=collections.fingerprint, state=FakeState()
+    )
+    assert {entry["status"] for entry in entries} == {dag.RAN}
+
+    # an exclusive stage does not
+    barrier = threading.Barrier(2, timeout=0.5)
+    stages[0].exclusive = True
+    entries = dag.run(
+        stages, workers=2, fingerprint=collections.fingerprint, state=FakeState()
+    )
+    status = {entry["stage"]: entry["status"] for entry in entries}
+    assert status["genres"] == dag.FAILED
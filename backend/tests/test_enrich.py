@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from infovis21.mongodb import enrich
+
+KNOWN = {f"t{i}" for i in range(120)}
+
+
+class StubSpotify(BaseHTTPRequestHandler):
+    """ Answers GET /v1/tracks/?ids=... like Spotify, the first request is rate limited """
+
+    requests: typing.List[typing.List[str]] = []
+    rate_limited = 0
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        ids = parse_qs(url.query)["ids"][0].split(",")
+        if StubSpotify.rate_limited == 0:
+            StubSpotify.rate_limited += 1
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        assert url.path == "/v1/tracks/"
+        assert self.headers["Authorization"] == "Bearer token"
+        StubSpotify.requests.append(ids)
+        body = json.dumps(
+            {
+                "tracks": [
+                    {"id": _id, "available_markets": ["NL"]} if _id in KNOWN else None
+                    for _id in ids
+                ]
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: typing.Any) -> None:
+        pass
+
+
+@pytest.fixture
+def stub() -> typing.Any:
+    StubSpotify.requests, StubSpotify.rate_limited = [], 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSpotify)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/"
+    server.shutdown()
+
+
+def test_batches_through_the_multi_id_endpoint(stub: str) -> None:
+    sp = enrich.spotify_client(prefix=stub, auth="token")
+    ids = [f"t{i}" for i in range(130)]
+    written = dict()
+    backoff = enrich.Backoff(backoff=0.01)
+
+    def write(batch: typing.List[str], items: typing.List[typing.Any]) -> None:
+        written.update(zip(batch, items))
+
+    n = enrich.run_batches(
+        "tracks",
+        ids,
+        lambda batch: sp.tracks(batch)["tracks"],
+        write,
+        workers=3,
+        backoff=backoff,
+    )
+    assert n == 3
+    assert sorted(len(batch) for batch in StubSpotify.requests) == [30, 50, 50]
+    assert set(written) == set(ids)
+    assert written["t0"]["id"] == "t0"
+    assert written["t125"] is None
+    assert backoff.stats["rate_limited"] == 1
+
+
+def test_backoff_gives_up() -> None:
+    calls = []
+
+    def fail() -> None:
+        calls.append(1)
+        raise enrich.SpotifyException(503, -1, "unavailable")
+
+    with pytest.raises(enrich.SpotifyException):
+        enrich.Backoff(retries=2, backoff=0.001).call(fail)
+    assert len(calls) == 3
+
+    def not_found() -> None:
+        calls.append(1)
+        raise enrich.SpotifyException(404, -1, "not found")
+
+    with pytest.raises(enrich.SpotifyException):
+        enrich.Backoff(retries=2, backoff=0.001).call(not_found)
+    assert len(calls) == 4
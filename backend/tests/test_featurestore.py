@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import featurestore
+from infovis21.mongodb.featurestore import FeatureTable
+
+
+@pytest.fixture
+def table() -> FeatureTable:
+    docs = []
+    for i in range(10):
+        doc = {dim: float(i) for dim in ma.dimensions}
+        doc.update({"id": f"t{i}", "name": f"track {i}", "labels": [f"l{i % 3}"]})
+        docs.append(doc)
+    docs[0]["energy"] = None
+    return FeatureTable("track", docs)
+
+
+def test_viewport(table: FeatureTable) -> None:
+    rows = table.viewport("energy", "tempo", 0, 4, 0, 4)
+    # the missing energy value of t0 never matches a range
+    assert list(table.ids[rows]) == ["t1", "t2", "t3", "t4"]
+
+
+def test_nearest(table: FeatureTable) -> None:
+    rows = np.arange(1, len(table))
+    nearest, dist = table.nearest(rows, "energy", "tempo", 5.2, 5.2, k=3)
+    assert list(table.ids[nearest]) == ["t5", "t6", "t4"]
+    assert np.all(np.diff(dist) >= 0)
+
+
+def test_node_and_label_groups(table: FeatureTable) -> None:
+    node = table.node(2, "energy", "tempo", dist=1.0)
+    assert node["id"] == "t2" and node["x"] == 2.0 and node["type"] == "Track"
+    groups = table.label_groups(table.rows(["t1", "t4", "t2", "unknown"]))
+    assert groups == {"l1": [1, 4], "l2": [2]}
+
+
+def test_tables_follow_the_version(
+    table: FeatureTable, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stamp = {"version": "a"}
+    monkeypatch.setattr(ma, "current_dataset_version", lambda: stamp)
+    monkeypatch.setattr(featurestore, "_tables", dict())
+    loads = []
+    monkeypatch.setattr(
+        featurestore, "load_table", lambda typ: loads.append(typ) or table
+    )
+    assert featurestore.get_table("track") is table
+    featurestore.get_table("track")
+    assert loads == ["track"]
+    # every worker loads the table again after the ETL bumped the version
+    stamp["version"] = "b"
+    featurestore.get_table("track")
+    assert loads == ["track", "track"]
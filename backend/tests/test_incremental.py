@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+from pathlib import Path
+
+import pytest
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import incremental
+
+CSV = """id,name,artists,year,popularity
+t1,One,['A'],1990,10
+t2,Two,"['A', 'B']",1991,20
+"""
+
+
+def track(
+    _id: str, artists: typing.List[str], genres: typing.List[str], year: int, label: str
+) -> typing.Dict[str, typing.Any]:
+    return {
+        "id": _id,
+        "artists": [{"id": a} for a in artists],
+        "genres": genres,
+        "year": year,
+        "labels": label,
+    }
+
+
+def test_diff_tracks() -> None:
+    stored = {"t1": "a", "t2": "b", "t3": "c"}
+    incoming = {"t1": "a", "t2": "changed", "t4": "d"}
+    assert incremental.diff_tracks(incoming, stored) == (["t2", "t4"], ["t3"])
+    assert incremental.diff_tracks(stored, stored) == ([], [])
+
+
+def test_affected_keys_of_old_and_new_documents() -> None:
+    old = track("t2", ["a1"], ["rock"], 1990, "L1")
+    new = track("t2", ["a1", "a2"], ["rock", "pop"], 1991, "L2")
+    keys = incremental.affected_keys([old, new, {"id": "t3", "artists": None}])
+    assert keys == {
+        "tracks": ["t2", "t3"],
+        "artists": ["a1", "a2"],
+        "genres": ["pop", "rock"],
+        "years": [1990, 1991],
+        "labels": ["L1", "L2"],
+    }
+    assert incremental.stale_types(keys) == ["genre", "artist", "track"]
+    assert incremental.stale_types(incremental.affected_keys([])) == []
+
+
+def test_content_hash_changes_with_the_row(tmp_path: Path) -> None:
+    path = tmp_path / "data.csv"
+    path.write_text(CSV)
+    before = ma.read_kaggle_csv(path)
+    path.write_text(CSV.replace("1991,20", "1991,21"))
+    after = ma.read_kaggle_csv(path)
+    assert list(before["csv_id"]) == ["t1", "t2"]
+    assert before["artists"][1] == ["A", "B"]
+    assert before["content_hash"][0] == after["content_hash"][0]
+    assert before["content_hash"][1] != after["content_hash"][1]
+
+
+class Collection:
+    def __init__(self, docs: typing.List[typing.Dict[str, typing.Any]]) -> None:
+        self.docs = docs
+
+    def estimated_document_count(self) -> int:
+        return len(self.docs)
+
+    def find(
+        self, query: typing.Any = None, projection: typing.Any = None
+    ) -> typing.Any:
+        return [doc for doc in self.docs if all(key in doc for key in (query or {}))]
+
+    def find_one(self, query: typing.Any = None) -> typing.Any:
+        return next(iter(self.find(query)), None)
+
+
+def test_stored_hashes_of_older_loads(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ma, "coll_track_hashes", Collection([]), raising=False)
+    tracks = [{"id": "s1", "csv_id": "t1", "content_hash": "a"}]
+    assert incremental.stored_hashes({"tracks": Collection(tracks)}) == {"t1": "a"}
+    # without any hashes every track would be fetched again
+    tracks_full = Collection([{"id": "s1", "csv_id": "t1"}])
+    with pytest.raises(RuntimeError):
+        incremental.stored_hashes(
+            {"tracks": Collection([]), "tracks_full": tracks_full}
+        )
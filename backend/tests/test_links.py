@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+import pytest
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest
+
+from infovis21 import links as linkutils
+from infovis21 import views
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb.featurestore import FeatureTable
+
+
+@pytest.fixture
+def table(monkeypatch: typing.Any) -> FeatureTable:
+    monkeypatch.setitem(
+        ma._cache, "dim_minmax", {dim: {"min": 0, "max": 100} for dim in ma.dimensions}
+    )
+    docs = []
+    for i in range(20):
+        doc = {dim: float(i) for dim in ma.dimensions}
+        doc.update({"id": f"t{i}", "popularity": 100 - abs(i - 7) * 5})
+        doc["labels"] = ["big"] if i < 12 else ["small"]
+        docs.append(doc)
+    return FeatureTable("track", docs)
+
+
+def groups(table: FeatureTable) -> typing.Dict[str, typing.List[int]]:
+    return table.label_groups(range(len(table)))
+
+
+def test_clique_is_the_default(table: FeatureTable) -> None:
+    links, elided = linkutils.build_links(groups(table), table, "energy", "tempo")
+    assert len(links) == 12 * 11 // 2 + 8 * 7 // 2 and elided == 0
+
+
+def test_star_uses_most_popular_member(table: FeatureTable) -> None:
+    links, elided = linkutils.build_links(
+        groups(table), table, "energy", "tempo", mode="star"
+    )
+    big = [link for link in links if link["src"] == "t7"]
+    assert len(big) == 11 and len(links) == 11 + 7
+    assert elided == 66 + 28 - len(links)
+
+
+def test_chain_follows_dimx(table: FeatureTable) -> None:
+    links, _ = linkutils.build_links(
+        {"small": [15, 12, 19, 13]}, table, "energy", "tempo", mode="chain"
+    )
+    assert [(link["src"], link["dest"]) for link in links] == [
+        ("t12", "t13"),
+        ("t13", "t15"),
+        ("t15", "t19"),
+    ]
+
+
+def test_knn_has_no_duplicate_pairs(table: FeatureTable) -> None:
+    links, _ = linkutils.build_links(
+        groups(table), table, "energy", "tempo", mode="knn", k=2
+    )
+    pairs = {frozenset((link["src"], link["dest"])) for link in links}
+    assert len(pairs) == len(links)
+    assert frozenset(("t0", "t1")) in pairs
+
+
+def test_budget_is_shared_between_labels(table: FeatureTable) -> None:
+    links, elided = linkutils.build_links(
+        groups(table), table, "energy", "tempo", mode="clique", budget=10
+    )
+    assert len(links) == 10 and elided == 66 + 28 - 10
+    # both labels keep links although the big one alone would fill the budget
+    assert {link["src"] for link in links} & {"t12", "t13"}
+
+
+def test_link_arguments_are_validated() -> None:
+    args = {"x": "1", "y": "1", "zoom": "0.5", "dimx": "energy", "dimy": "tempo"}
+    args["type"] = "track"
+    q = views.graph_query("v1", MultiDict({**args, "max_links": "0", "link_k": "3"}))
+    assert q["max_links"] == 0 and q["link_k"] == 3
+    q = views.graph_query("v1", MultiDict(args))
+    assert q["max_links"] == linkutils.DEFAULT_LINK_BUDGET
+    for bad in [{"max_links": "abc"}, {"max_links": "-1"}, {"link_k": "0"}]:
+        with pytest.raises(BadRequest):
+            views.graph_query("v1", MultiDict({**args, **bad}))
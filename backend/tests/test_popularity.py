@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+import numpy as np
+import pytest
+from bson import Binary
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import popularity
+
+# popularity of the genres per year, 0 for years without the genre
+POPULARITY = {
+    1999: {"rock": 50.0, "pop": 40.0, "jazz": 10.0},
+    2000: {"pop": 60.0, "rock": 30.0, "jazz": 20.0},
+    2002: {"jazz": 70.0, "pop": 5.0},
+}
+
+
+def toplist(k: int) -> popularity.TopList:
+    year_docs = [
+        {
+            "year": year,
+            "entries": [
+                {"name": name, "year": year, "popularity": value}
+                for name, value in sorted(genres.items(), key=lambda g: -g[1])
+            ][:k],
+        }
+        for year, genres in POPULARITY.items()
+    ]
+    keys = ["rock", "pop", "jazz"]
+    matrix = np.array(
+        [[genres.get(key, 0) for key in keys] for genres in POPULARITY.values()],
+        dtype="<f4",
+    )
+    matrix_doc = {
+        "years": list(POPULARITY),
+        "keys": keys,
+        "colors": [None] * len(keys),
+        "popularity": Binary(matrix.tobytes()),
+    }
+    return popularity.TopList(year_docs, matrix_doc)
+
+
+def names(entries: typing.List[typing.Dict[str, typing.Any]]) -> typing.List[str]:
+    return [e["name"] for e in entries]
+
+
+def test_top_per_year() -> None:
+    top = toplist(k=3)
+    assert names(top.top(2000, 2000, limit=2)) == ["pop", "rock"]
+    assert names(top.top(1999, 2002, limit=1)) == ["rock", "pop", "jazz"]
+    # 2001 is missing, ranges outside of the data are empty
+    assert names(top.top(2001, 2001)) == []
+    assert top.top(1900, 1950) == []
+
+
+def test_streams() -> None:
+    top = toplist(k=3)
+    keys, rows = top.streams(2000, 2002)
+    assert keys == ["jazz", "pop", "rock"]
+    assert rows == [
+        {"year": 2000, "jazz": 20.0, "pop": 60.0, "rock": 30.0},
+        {"year": 2002, "jazz": 70.0, "pop": 5.0, "rock": 0.0},
+    ]
+    keys, rows = top.streams(1999, 2000, limit=1)
+    assert keys == ["pop", "rock"]
+    assert [row["year"] for row in rows] == [1999, 2000]
+
+
+def test_toplists_follow_the_version(monkeypatch: pytest.MonkeyPatch) -> None:
+    stamp = {"version": "a"}
+    loads = []
+    monkeypatch.setattr(ma, "current_dataset_version", lambda: stamp)
+    monkeypatch.setattr(
+        popularity, "load_toplist", lambda *key: loads.append(key) or toplist(2)
+    )
+    popularity.reload()
+    first = popularity.get_toplist("genre", False)
+    assert popularity.get_toplist("genre", 0) is first
+    # materialized again by another process
+    stamp["version"] = "b"
+    assert popularity.get_toplist("genre", False) is not first
+    assert loads == [("genre", False), ("genre", False)]
+    assert len(popularity._toplists) == 1
+    popularity.reload()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from infovis21.mongodb import precompute
+
+
+def test_layers_only_count_for_the_same_data_and_rows() -> None:
+    stamp = {"source_version": "v2", "offset": 0, "limit": None}
+    entry = {"_id": "energy_tempo_track_0", "type": "track", "zoom": 0}
+    assert precompute.is_finished({**entry, **stamp}, stamp)
+    # written before the ETL changed the data, by a debugging run or by an older version
+    assert not precompute.is_finished({**entry, **stamp, "source_version": "v1"}, stamp)
+    assert not precompute.is_finished({**entry, **stamp, "limit": 1000}, stamp)
+    assert not precompute.is_finished(entry, stamp)
+
+
+def test_layers_only_count_while_they_are_stored() -> None:
+    entry = {"_id": "energy_tempo_track_0", "nodes": 10, "links": 4}
+    assert precompute.is_stored(entry, {"energy_tempo_track_0": [10, 4]})
+    assert not precompute.is_stored(entry, {"energy_tempo_track_0": [10, 0]})
+    assert not precompute.is_stored(entry, {})
+    # a layer without links
+    assert precompute.is_stored(
+        {**entry, "links": 0}, {"energy_tempo_track_0": [10, 0]}
+    )
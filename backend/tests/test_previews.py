@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from infovis21 import previews
+from infovis21.mongodb import enrich
+
+# t0 ... t9 have a preview, t9 fails once on the server side, t10 has none
+TRACKS = [f"t{i}" for i in range(11)]
+
+
+def audio(track_id: str) -> bytes:
+    return f"ID3 preview of {track_id} ".encode() * 100
+
+
+class StubServer(BaseHTTPRequestHandler):
+    """ Spotify's GET /v1/tracks/?ids=... and the preview files """
+
+    requests: typing.List[str] = []
+    failed: typing.Set[str] = set()
+
+    def send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        StubServer.requests.append(url.path)
+        if url.path == "/v1/tracks/":
+            ids = parse_qs(url.query)["ids"][0].split(",")
+            host = f"http://127.0.0.1:{self.server.server_address[1]}"
+            tracks = [
+                {
+                    "id": _id,
+                    "preview_url": f"{host}/previews/{_id}" if _id != "t10" else None,
+                }
+                for _id in ids
+            ]
+            self.send(200, json.dumps({"tracks": tracks}).encode(), "application/json")
+            return
+        track_id = url.path.rsplit("/", 1)[-1]
+        if track_id == "t9" and track_id not in StubServer.failed:
+            StubServer.failed.add(track_id)
+            self.send(503, b"", "text/plain")
+            return
+        self.send(200, audio(track_id), "audio/mpeg")
+
+    def log_message(self, *args: typing.Any) -> None:
+        pass
+
+
+@pytest.fixture
+def stub() -> typing.Any:
+    StubServer.requests, StubServer.failed = [], set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/"
+    server.shutdown()
+
+
+def download(stub: str, cache: Path, **kwargs: typing.Any) -> typing.Dict[str, int]:
+    sp = enrich.spotify_client(prefix=stub, auth="token")
+    StubServer.requests = []
+    return previews.download(TRACKS, sp=sp, cache_dir=cache, workers=4, **kwargs)
+
+
+def test_downloads_once_and_resumes(stub: str, tmp_path: Path) -> None:
+    stats = download(stub, tmp_path)
+    assert stats["downloaded"] == 10 and stats["missing"] == 1
+    assert stats["failed"] == 0
+    for track_id in TRACKS[:10]:
+        assert previews.preview_path(track_id, tmp_path).read_bytes() == audio(track_id)
+    assert not previews.preview_path("t10", tmp_path).exists()
+    assert list(tmp_path.glob("*.part")) == []
+    manifest = previews.Manifest(tmp_path)
+    assert len(manifest.entries) == 11 and manifest.entries["t10"]["missing"]
+
+    # everything is known, nothing is requested again
+    stats = download(stub, tmp_path)
+    assert stats["cached"] == 10 and stats["missing"] == 1
+    assert StubServer.requests == []
+
+    # a truncated file is noticed by its size, a corrupt one only by its sha1
+    path = previews.preview_path("t1", tmp_path)
+    path.write_bytes(audio("t1")[:10])
+    corrupt = previews.preview_path("t2", tmp_path)
+    corrupt.write_bytes(b"x" * len(audio("t2")))
+    stats = download(stub, tmp_path)
+    assert stats["downloaded"] == 1 and path.read_bytes() == audio("t1")
+    stats = download(stub, tmp_path, verify=True)
+    assert stats["downloaded"] == 1 and corrupt.read_bytes() == audio("t2")
+    assert StubServer.requests == ["/v1/tracks/", "/previews/t2"]
+
+
+def test_manifest_ignores_a_cut_off_line(tmp_path: Path) -> None:
+    manifest = previews.Manifest(tmp_path)
+    manifest.add({"id": "t1", "size": 1, "sha1": "a"})
+    manifest.add({"id": "t2", "size": 2, "sha1": "b"})
+    manifest.remove("t1")
+    manifest.close()
+    with open(tmp_path / previews.MANIFEST, "a") as f:
+        f.write('{"id": "t3", "si')
+    assert list(previews.Manifest(tmp_path).entries) == ["t2"]
+
+
+@pytest.fixture
+def cached(tmp_path: Path, monkeypatch: typing.Any) -> bytes:
+    monkeypatch.setattr(previews, "CACHE_DIR", tmp_path)
+    body = audio("t1")
+    previews.preview_path("t1", tmp_path).write_bytes(body)
+    return body
+
+
+def test_serves_cached_previews(cached: bytes) -> None:
+    from starlette.testclient import TestClient
+
+    from infovis21 import asgi
+    from infovis21.app import app as flask_app
+
+    flask, starlette = flask_app.test_client(), TestClient(asgi.app)
+
+    def get_flask(path: str, **kwargs: typing.Any) -> typing.Any:
+        response = flask.get(path, **kwargs)
+        response.content = response.get_data()
+        return response
+
+    for get in [get_flask, starlette.get]:
+        response = get("/v2/preview/t1")
+        assert response.status_code == 200 and response.content == cached
+        assert response.headers["Content-Type"] == "audio/mpeg"
+        assert "immutable" in response.headers["Cache-Control"]
+        etag = response.headers["ETag"]
+
+        response = get("/v2/preview/t1", headers={"Range": "bytes=10-19"})
+        assert response.status_code == 206 and response.content == cached[10:20]
+        assert response.headers["Content-Range"] == f"bytes 10-19/{len(cached)}"
+
+        response = get("/v2/preview/t1", headers={"If-None-Match": etag})
+        assert response.status_code == 304 and response.content == b""
+
+        assert get("/v2/preview/t1.mp3").status_code == 404
+
+
+def test_fetches_a_preview_that_is_not_cached(stub: str, tmp_path: Path) -> None:
+    from infovis21 import views
+
+    host = stub[: -len("/v1/")]
+    tracks = [{"preview_url": f"{host}/previews/t3"}]
+    previews.CACHE_DIR, cache_dir = tmp_path, previews.CACHE_DIR
+    try:
+        path = views.fetch_preview("t3", tracks)
+        assert path.read_bytes() == audio("t3")
+        views.fetch_preview("t3", tracks)
+    finally:
+        previews.CACHE_DIR = cache_dir
+    assert StubServer.requests == ["/previews/t3"]
+    assert previews.Manifest(tmp_path).entries["t3"]["size"] == len(audio("t3"))
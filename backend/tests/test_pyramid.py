@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+import numpy as np
+import pytest
+
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb import utils as dbutils
+
+MINMAX = {"energy": {"min": 0.0, "max": 1.0}, "valence": {"min": 0.0, "max": 1.0}}
+
+
+@pytest.fixture(autouse=True)
+def dim_minmax(monkeypatch: typing.Any) -> None:
+    monkeypatch.setitem(ma._cache, "dim_minmax", MINMAX)
+
+
+def synthetic_source(n: int = 3000, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    columns = {
+        dim: MINMAX[dim]["min"]
+        + rng.random(n) * (MINMAX[dim]["max"] - MINMAX[dim]["min"])
+        for dim in ("energy", "valence")
+    }
+    # labels with 2 to 5 members
+    sizes = rng.integers(2, 6, size=n // 4)
+    label_members = rng.integers(0, n, size=sizes.sum())
+    return {
+        "docs": [{"id": str(i)} for i in range(n)],
+        "ids": [str(i) for i in range(n)],
+        "columns": columns,
+        "labels": [{"id": "label%d" % i} for i in range(len(sizes))],
+        "label_ptr": np.concatenate([[0], np.cumsum(sizes)]),
+        "label_members": label_members,
+    }
+
+
+def test_pyramid_levels_nest() -> None:
+    source = synthetic_source()
+    points, levels = dbutils.compute_pyramid(source, "energy", "valence", "track")
+    assert sorted(levels) == list(range(dbutils.N_ZOOM_LEVELS))
+    for zoom in range(dbutils.N_ZOOM_LEVELS - 1):
+        assert set(levels[zoom]) <= set(levels[zoom + 1])
+
+
+def test_layer_links_need_exactly_two_kept_members() -> None:
+    source = synthetic_source()
+    points, levels = dbutils.compute_pyramid(source, "energy", "valence", "track")
+    kept = set(levels[2])
+    ptr, members = source["label_ptr"], source["label_members"]
+    expected = [
+        i
+        for i in range(len(ptr) - 1)
+        if sum(m in kept for m in members[ptr[i] : ptr[i + 1]]) == 2
+    ]
+    links = dbutils.layer_links(source, points, levels[2])
+    assert [link["name"] for link in links] == ["label%d" % i for i in expected]
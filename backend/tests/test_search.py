@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+import numpy as np
+import pytest
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest
+
+from infovis21 import search, views
+
+NAMES = [
+    "The Beatles",
+    "Beat It",
+    "Beyoncé",
+    "Heartbeat",
+    "Beatles Tribute Band",
+    "Sigur Rós",
+    "AC/DC",
+    "",
+    None,
+]
+
+
+class Table:
+    def __init__(self, names: typing.List[typing.Any]) -> None:
+        self.names = np.array(names, dtype=object)
+        self.popularity = np.linspace(100, 0, len(names)).astype(np.float32)
+
+    def column(self, dim: str) -> typing.Any:
+        assert dim == "popularity"
+        return self.popularity
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+def names(index: search.SearchIndex, rows: typing.Any) -> typing.List[str]:
+    return [NAMES[row] for row in rows]
+
+
+def test_normalize() -> None:
+    assert search.normalize("  The  BEATLES!") == "the beatles"
+    assert search.normalize("Beyoncé") == "beyonce"
+    assert search.normalize("AC/DC") == "ac dc"
+    assert search.normalize(None) == ""
+
+
+def test_exact_and_prefix_matches_rank_first() -> None:
+    index = search.SearchIndex(Table(NAMES))
+    rows, scores = index.search("the beatles")
+    assert names(index, rows)[0] == "The Beatles"
+    rows, scores = index.search("beatles")
+    assert names(index, rows) == ["Beatles Tribute Band", "The Beatles"]
+    assert np.all(np.diff(scores) <= 0)
+
+    rows, _ = index.search("beat")
+    # the prefix match comes first, the substring match of Heartbeat last
+    assert names(index, rows)[0] == "Beat It"
+    assert names(index, rows)[-1] == "Heartbeat"
+    assert set(names(index, rows)) == {
+        "The Beatles",
+        "Beat It",
+        "Heartbeat",
+        "Beatles Tribute Band",
+    }
+
+
+@pytest.mark.parametrize("query", ["beyonce", "BEYONCÉ", "beyonse", "sigur ros"])
+def test_accents_case_and_typos(query: str) -> None:
+    index = search.SearchIndex(Table(NAMES))
+    rows, _ = index.search(query)
+    assert len(rows) >= 1
+    assert search.normalize(NAMES[rows[0]])[:3] == search.normalize(query)[:3]
+
+
+def test_limit_and_short_queries() -> None:
+    index = search.SearchIndex(Table(NAMES))
+    rows, _ = index.search("beat", limit=2)
+    assert len(rows) == 2
+    # shorter than a trigram, only word prefixes match
+    rows, _ = index.search("be")
+    assert set(names(index, rows)) == {
+        "The Beatles",
+        "Beat It",
+        "Beyoncé",
+        "Beatles Tribute Band",
+    }
+    assert len(index.search("zzz")[0]) == 0
+    assert len(index.search("")[0]) == 0
+
+
+def test_prefix() -> None:
+    index = search.SearchIndex(Table(NAMES))
+    rows, _ = index.prefix("beatles t")
+    assert names(index, rows) == ["Beatles Tribute Band"]
+    rows, _ = index.prefix("dc")
+    assert names(index, rows) == ["AC/DC"]
+
+
+def test_empty_table() -> None:
+    index = search.SearchIndex(Table([]))
+    assert len(index.search("beatles")[0]) == 0
+    assert len(index.prefix("b")[0]) == 0
+
+
+def test_limit_argument() -> None:
+    assert views.search_limit(MultiDict(), 20) == 20
+    assert views.search_limit(MultiDict({"limit": "5"}), 20) == 5
+    assert (
+        views.search_limit(MultiDict({"limit": "1000"}), 20) == views.MAX_SEARCH_LIMIT
+    )
+    for limit in ["abc", "0", "-1"]:
+        with pytest.raises(BadRequest):
+            views.search_limit(MultiDict({"limit": limit}), 20)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+import numpy as np
+import pytest
+
+from infovis21 import similarity
+from infovis21.mongodb import MongoAccess as ma
+
+
+class Table:
+    def __init__(self, n: int) -> None:
+        rng = np.random.default_rng(0)
+        self.columns = {dim: rng.random(n).astype(np.float32) for dim in ma.dimensions}
+
+    def column(self, dim: str) -> typing.Any:
+        return self.columns[dim]
+
+    def __len__(self) -> int:
+        return len(self.columns["energy"])
+
+
+def brute_force(index: similarity.SimilarityIndex, selected: typing.Any) -> typing.Any:
+    query = index.raw[selected].mean(axis=0)
+    norms = np.linalg.norm(index.raw, axis=1) * np.linalg.norm(query)
+    scores = index.raw @ query / norms
+    scores[selected] = -np.inf
+    return np.argsort(-scores)
+
+
+@pytest.mark.parametrize("selected", [[3], [3, 7, 11]])
+def test_topk_matches_brute_force(selected: typing.List[int]) -> None:
+    index = similarity.SimilarityIndex(Table(2000))
+    rows, scores = index.topk(np.array(selected), 10)
+    assert list(rows) == list(brute_force(index, selected)[:10])
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_topk_restricted_to_candidates() -> None:
+    index = similarity.SimilarityIndex(Table(2000))
+    candidates = np.arange(100, 200)
+    rows, _ = index.topk(np.array([150]), 5, candidates=candidates)
+    assert len(rows) == 5 and set(rows) <= set(range(100, 200)) - {150}
+
+
+def test_ivf_probing_every_list_is_exact() -> None:
+    index = similarity.SimilarityIndex(Table(5000), ivf_min_rows=1000)
+    assert index.ivf is not None
+    n_lists = len(index.ivf.centroids)
+    rows, _ = index.topk(np.array([42]), 10, n_probe=n_lists)
+    assert list(rows) == list(brute_force(index, [42])[:10])
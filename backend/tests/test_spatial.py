@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+
+from infovis21.mongodb import spatial
+
+
+def test_grid_covers_viewport_with_few_cells() -> None:
+    n_levels = 6
+    for zoom in range(n_levels):
+        n = spatial.grid_size(zoom, n_levels)
+        # the smallest viewport width at this zoom level in graph_impl_2
+        width = 1 - (zoom + 1) / n_levels
+        if width > 0:
+            assert (
+                len(spatial.viewport_cells(0.3, 0.3 + width, 0.3, 0.3 + width, n)) <= 9
+            )
+
+
+def test_cell_ids_clip_border() -> None:
+    assert list(spatial.cell_ids([0.0, 0.5, 1.0], [0.0, 0.5, 1.0], 4)) == [0, 10, 15]
+
+
+def test_segments_intersect_box() -> None:
+    box = (0.4, 0.6, 0.4, 0.6)
+    x1, y1, x2, y2 = np.array(
+        [
+            [0.0, 0.5, 1.0, 0.5],  # crosses without an endpoint inside
+            [0.45, 0.45, 0.9, 0.9],  # one endpoint inside
+            [0.0, 0.0, 0.3, 0.9],  # passes by
+            [0.0, 0.7, 1.0, 0.7],  # parallel, outside
+            [0.5, 0.0, 0.5, 1.0],  # vertical, crosses
+        ]
+    ).T
+    hits = spatial.segments_intersect_box(x1, y1, x2, y2, *box)
+    assert list(hits) == [True, True, False, False, True]
+
+
+def test_segment_cells() -> None:
+    # diagonal crosses the cells on the diagonal and touches their corners only
+    cells = spatial.segment_cells(0.1, 0.1, 0.9, 0.9, 4)
+    assert {0, 5, 10, 15}.issubset(cells)
+    # a horizontal segment stays in one row
+    assert spatial.segment_cells(0.1, 0.3, 0.9, 0.3, 4) == [4, 5, 6, 7]
+
+
+def test_poisson_disk_filtering() -> None:
+    rng = np.random.default_rng(0)
+    points = np.clip(
+        np.concatenate([rng.normal(0.5, 0.05, (1500, 2)), rng.random((1500, 2))]), 0, 1
+    )
+    radius = 0.02
+    kept, discarded, _ = spatial.poisson_disk_filtering(points, radius=radius)
+    kept_points = points[kept]
+    dist = np.sqrt(((points[:, None, :] - kept_points[None, :, :]) ** 2).sum(axis=2))
+    # kept points are more than radius apart ...
+    between = dist[kept]
+    between[np.arange(len(kept)), np.arange(len(kept))] = np.inf
+    assert between.min() > radius
+    # ... and every point is covered by a kept point
+    assert dist.min(axis=1).max() <= radius
+    assert discarded.sum() == len(points)
+    assert discarded.shape == (math.ceil(1 / (2 * radius)) + 1,) * 2
+
+
+def test_poisson_disk_filtering_without_radius() -> None:
+    kept, discarded, _ = spatial.poisson_disk_filtering(np.zeros((3, 2)), radius=0)
+    assert set(kept) == {0, 1, 2} and discarded is None
@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from benchmarks import startup
+
+
+@pytest.mark.parametrize("module", startup.SERVING_MODULES)
+def test_serving_path_does_not_import_heavy_modules(module: str) -> None:
+    total, modules, loaded = startup.import_profile(module)
+    assert module in loaded
+    assert total > 0 and any(name == module for name, _, _ in modules)
+    assert startup.heavy_modules(loaded) == []
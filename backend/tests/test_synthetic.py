@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import types
+import typing
+
+import numpy as np
+import pytest
+
+from infovis21.mongodb import synthetic
+
+
+def catalogue(
+    n_tracks: int, seed: int
+) -> typing.Tuple[synthetic.Catalogue, synthetic.Aggregates, typing.List[dict]]:
+    c = synthetic.Catalogue(n_tracks, seed=seed)
+    aggregates = synthetic.Aggregates(c)
+    tracks = []
+    for rows, columns in c.tracks(chunk_size=1000):
+        aggregates.add(rows, columns)
+        tracks += c.track_documents(rows, columns)
+    return c, aggregates, tracks
+
+
+def ranks(values: np.ndarray) -> np.ndarray:
+    return values.argsort().argsort()
+
+
+def test_catalogue_is_seeded() -> None:
+    _, _, tracks = catalogue(3000, seed=1)
+    assert tracks == catalogue(3000, seed=1)[2]
+    assert tracks != catalogue(3000, seed=2)[2]
+    assert len({t["id"] for t in tracks}) == 3000
+    assert all(isinstance(t["id"], str) and len(t["id"]) == 22 for t in tracks)
+
+
+def test_features_follow_the_profile() -> None:
+    _, _, tracks = catalogue(20_000, seed=3)
+    profile = synthetic.default_profile()
+    columns = {f: np.array([t[f] for t in tracks]) for f in synthetic.FEATURES}
+    for feature, (levels, values) in profile["quantiles"].items():
+        assert (
+            values[0] <= columns[feature].min() <= columns[feature].max() <= values[-1]
+        )
+    assert set(columns["mode"]) == {0, 1} and set(columns["key"]) == set(range(12))
+    assert 0.6 < columns["mode"].mean() < 0.8
+    assert 180_000 < np.median(columns["duration_ms"]) < 240_000
+    # rank correlations of the profile
+    for (a, b), r in [
+        (("energy", "loudness"), 0.78),
+        (("acousticness", "energy"), -0.75),
+        (("popularity", "year"), 0.86),
+        (("danceability", "valence"), 0.56),
+    ]:
+        rho = np.corrcoef(ranks(columns[a]), ranks(columns[b]))[0, 1]
+        assert abs(rho - r) < 0.1, (a, b, rho)
+
+
+def test_artists_genres_and_labels_of_the_tracks() -> None:
+    c, aggregates, tracks = catalogue(5000, seed=4)
+    artists = list(synthetic.artist_documents(c, aggregates))
+    genres = list(synthetic.genre_documents(c, aggregates))
+    labels = list(synthetic.label_documents(c))
+
+    by_artist = {full["id"]: full for _, full in artists}
+    assert {t["artists"][0]["id"] for t in tracks} == set(by_artist)
+    assert sum(len(a["tracks_id"]) for a in by_artist.values()) == len(tracks)
+    assert {g for t in tracks for g in t["genres"]} == {g["_id"] for g in genres}
+    assert {t["labels"] for t in tracks} == {label["_id"] for label in labels}
+    assert sum(label["n_tracks"] for label in labels) == len(tracks)
+    # the features of an artist are the averages of its tracks
+    artist = max(by_artist.values(), key=lambda a: len(a["tracks_id"]))
+    members = [t for t in tracks if t["artists"][0]["id"] == artist["id"]]
+    assert np.isclose(artist["energy"], np.mean([t["energy"] for t in members]))
+
+    # a few artists and labels have most of the tracks
+    for counts in [
+        sorted((len(a["tracks_id"]) for a in by_artist.values()), reverse=True),
+        sorted((label["n_tracks"] for label in labels), reverse=True),
+    ]:
+        assert sum(counts[: len(counts) // 10]) > 0.3 * len(tracks)
+
+
+def test_the_api_database_is_not_overwritten(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(synthetic.connection, "configured", lambda key: "kaggle")
+    production = types.SimpleNamespace(name="kaggle")
+    with pytest.raises(ValueError):
+        synthetic.check_database(production)
+    synthetic.check_database(production, allow_production=True)
+    synthetic.check_database(types.SimpleNamespace(name=synthetic.database_name(10)))
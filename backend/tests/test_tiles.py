@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import typing
+
+import pytest
+
+from infovis21.mongodb import tiles
+
+
+def test_canonical_pair() -> None:
+    assert tiles.canonical_pair("energy", "valence") == ("energy", "valence", False)
+    assert tiles.canonical_pair("valence", "energy") == ("energy", "valence", True)
+
+
+def test_documents_and_swap() -> None:
+    node = {"id": "t1", "x": 0.3, "y": 0.8, "popularity": 5, "danceability": 0.1}
+    doc = tiles.node_document("energy", "valence", "track", 2, node, 4)
+    # only the fields that the graph endpoint returns are stored
+    assert "danceability" not in doc
+    assert (doc["tx"], doc["ty"], doc["tile"]) == (1, 3, 13)
+    assert doc["zoom"] == 2 and doc["dimx"] == "energy"
+
+    link = {"src": "a", "dest": "b", "x1": 0.1, "y1": 0.1, "x2": 0.9, "y2": 0.1}
+    doc = tiles.link_document("energy", "valence", "track", 2, link, 4)
+    assert doc["tiles"] == [0, 1, 2, 3]
+    swapped = tiles.swap_axes(dict(doc))
+    assert (swapped["x1"], swapped["y1"], swapped["x2"], swapped["y2"]) == (
+        0.1,
+        0.1,
+        0.1,
+        0.9,
+    )
+
+
+def test_projection_follows_swapped_axes() -> None:
+    projection = {"x": "$x", "y": "$y", "x1": "$x1", "name": "$name", "_id": 0}
+    assert tiles._project(projection, False) is projection
+    assert tiles._project(projection, True) == {
+        "x": "$y",
+        "y": "$x",
+        "x1": "$y1",
+        "name": "$name",
+        "_id": 0,
+    }
+
+
+def test_viewport_tiles_and_bounds() -> None:
+    # zoom level 3 of 6 has 4 tiles per axis
+    assert tiles.viewport_tiles(3, 0.3, 0.6, 0.1, 0.2) == [(1, 0), (2, 0)]
+    assert tiles.tile_bounds(3, 2, 0) == (0.5, 0.75, 0.0, 0.25)
+
+
+def matches(
+    doc: typing.Dict[str, typing.Any], query: typing.Dict[str, typing.Any]
+) -> bool:
+    for key, value in query.items():
+        if isinstance(value, dict) and "$ne" in value:
+            if doc.get(key) == value["$ne"]:
+                return False
+        elif isinstance(value, dict) and "$exists" in value:
+            if (key in doc) != value["$exists"]:
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+class Collection:
+    """ The part of a collection that write_layer uses """
+
+    def __init__(self) -> None:
+        self.docs: typing.List[typing.Dict[str, typing.Any]] = []
+        self.on_insert: typing.Callable[[], None] = lambda: None
+
+    def insert_many(self, docs: typing.List[typing.Any], ordered: bool) -> None:
+        self.docs += docs
+        self.on_insert()
+
+    def update_many(self, query: typing.Any, update: typing.Any) -> None:
+        for doc in self.docs:
+            if matches(doc, query):
+                for key in update["$unset"]:
+                    doc.pop(key, None)
+
+    def delete_many(self, query: typing.Any) -> None:
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+
+    def live(self) -> typing.List[str]:
+        key = tiles.live_key("energy", "valence", "track", 0)
+        return sorted(doc["id"] for doc in self.docs if matches(doc, key))
+
+
+def test_rewritten_layers_are_served_until_they_are_written(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    nodes, links = Collection(), Collection()
+    monkeypatch.setattr(tiles, "nodes_collection", lambda: nodes)
+    monkeypatch.setattr(tiles, "links_collection", lambda: links)
+    monkeypatch.setattr(tiles, "create_indexes", lambda: pytest.fail("indexes"))
+    old = [{"id": "a", "x": 0.1, "y": 0.1}, {"id": "b", "x": 0.2, "y": 0.2}]
+    tiles.write_layer("energy", "valence", "track", 0, old, [])
+    assert nodes.live() == ["a", "b"]
+
+    seen = []
+    nodes.on_insert = lambda: seen.append(nodes.live())
+    tiles.write_layer(
+        "energy", "valence", "track", 0, [{"id": "c", "x": 0, "y": 0}], []
+    )
+    # the old layer is served while the new one is written
+    assert seen == [["a", "b"]]
+    assert nodes.live() == ["c"] and len(nodes.docs) == 1
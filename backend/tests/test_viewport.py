@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from infovis21 import views
+from infovis21.mongodb import MongoAccess as ma
+from infovis21.mongodb.featurestore import FeatureTable
+
+
+def test_viewport_token_roundtrip() -> None:
+    viewport = views.make_viewport(
+        "v1", 0.4, 0.6, 0.5, "energy", "valence", "track", 50
+    )
+    token = views.viewport_token(viewport)
+    assert "=" not in token
+    assert views.parse_viewport_token(token) == viewport
+
+
+def test_invalid_viewport_token() -> None:
+    with pytest.raises(BadRequest):
+        views.parse_viewport_token("not a token")
+    with pytest.raises(BadRequest):
+        views.parse_viewport_token(views.viewport_token({"x": 1}))
+    # well formed tokens with values /graph does not accept
+    viewport = views.make_viewport("v1", 0.4, 0.6, 0.5, "energy", "valence", "track")
+    for tampered in [
+        {"x": "a"},
+        {"zoom": None},
+        {"dimx": "colour"},
+        {"dimy": "energy"},
+        {"type": "album"},
+        {"limit": "10"},
+        {"limit": -1},
+        {"limit": True},
+    ]:
+        with pytest.raises(BadRequest):
+            views.parse_viewport_token(views.viewport_token({**viewport, **tampered}))
+    assert views.parse_viewport_token(views.viewport_token(viewport)) == viewport
+
+
+def test_viewport_seed_is_stable() -> None:
+    assert views.viewport_seed("track", 0.5, 10) == views.viewport_seed(
+        "track", 0.5, 10
+    )
+    assert views.viewport_seed("track", 0.5, 10) != views.viewport_seed(
+        "track", 0.5, 11
+    )
+
+
+def test_visible_rows_of_a_single_node(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(
+        ma._cache, "dim_minmax", {dim: {"min": 0, "max": 100} for dim in ma.dimensions}
+    )
+    docs = [
+        {**{dim: 50.0 + i for dim in ma.dimensions}, "id": f"t{i}"} for i in range(3)
+    ]
+    table = FeatureTable("track", docs[:1])
+    rows, dists = views.visible_rows(table, 50.0, 50.0, "energy", "valence", 0.1, 10)
+    assert list(table.ids[rows]) == ["t0"] and len(dists) == 1
+
+    table = FeatureTable("track", docs)
+    rows, _ = views.visible_rows(table, 50.0, 50.0, "energy", "valence", 0.1, 2)
+    assert len(rows) == 2 and table.ids[rows[-1]] == "t0"
@@ -161,7 +161,9 @@ export default class Graph extends React.Component<GraphProps, GraphState> {
             Array.from(this.state.selected)[0]
           }&zoom=${this.state.zoom}&dimx=${this.props.dimx}&dimy=${
             this.props.dimy
-          }&type=${this.state.levelType}&limit=10`,
+          }&type=${this.state.levelType}&viewport=${
+            this.state.data.viewport ?? ""
+          }&limit=10`,
           headerConfig
         )
         .then((res) => {
@@ -545,11 +547,16 @@ export default class Graph extends React.Component<GraphProps, GraphState> {
       .on("click", function (event: MouseEvent, d: MusicGraphNode) {
         const clicked = d3.select<SVGGElement, MusicGraphNode>(this);
         if (d.preview_url && event.shiftKey) {
+          // tracks are played from the preview cache of the api
+          const previewURL =
+            d.type === "track"
+              ? `http://localhost:5000/${apiVersion}/preview/${d.id}`
+              : d.preview_url;
           const isPlaying = !s.audio?.paused ?? false;
-          const isNewAudio = !s.audio || s.audio.currentSrc !== d.preview_url;
+          const isNewAudio = !s.audio || s.audio.currentSrc !== previewURL;
           s.audio.pause();
           if (isNewAudio) {
-            s.audio.src = d.preview_url;
+            s.audio.src = previewURL;
             s.audio.load();
             s.audio.play();
             s.musicPlaying(clicked);
@@ -13,6 +13,17 @@ type SearchResult = {
   matches: MusicGraphNode[];
 };
 
+type Suggestion = {
+  id: string;
+  name: string;
+  type: string;
+};
+
+type SuggestResult = {
+  q: string;
+  suggestions: Suggestion[];
+};
+
 type GraphControlProps = {
   sideviewExpanded: boolean;
   mainViewWidthPercent: number;
@@ -27,6 +38,7 @@ type GraphControlState = {
   searchResults: MusicGraphNode[];
   searchQuery: string;
   searchType: string;
+  suggestions: Suggestion[];
 };
 
 class GraphControl extends Component<GraphControlProps, GraphControlState> {
@@ -40,6 +52,7 @@ class GraphControl extends Component<GraphControlProps, GraphControlState> {
       searchResults: [],
       searchQuery: "",
       searchType: "artist",
+      suggestions: [],
     };
   }
 
@@ -68,7 +81,21 @@ class GraphControl extends Component<GraphControlProps, GraphControlState> {
 
   setSearchQuery = (event: React.FormEvent) => {
     const target = event.target as HTMLInputElement;
-    this.setState({ searchQuery: target.value });
+    this.setState({ searchQuery: target.value }, this.suggest);
+  };
+
+  suggest = () => {
+    const query = this.state.searchQuery;
+    if (query.length < 1) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+    let suggestURL = `http://localhost:5000/${apiVersion}/suggest?q=${encodeURIComponent(query)}&type=${this.state.searchType}`;
+    axios.get(suggestURL, headerConfig).then((res: { data: SuggestResult }) => {
+      // responses can arrive out of order, only show the latest
+      if (res.data.q !== this.state.searchQuery) return;
+      this.setState({ suggestions: res.data.suggestions });
+    });
   };
 
   handleDimYChange = (dimy: string) => {
@@ -90,7 +117,7 @@ class GraphControl extends Component<GraphControlProps, GraphControlState> {
     event?.preventDefault();
     event?.nativeEvent.stopImmediatePropagation();
     if (this.state.searchQuery.length < 1) return;
-    let searchURL = `http://localhost:5000/${apiVersion}/search?dimx=${this.state.dimx}&dimy=${this.state.dimy}&searchterm=${this.state.searchQuery}&type=${this.state.searchType}`;
+    let searchURL = `http://localhost:5000/${apiVersion}/search?dimx=${this.state.dimx}&dimy=${this.state.dimy}&searchterm=${encodeURIComponent(this.state.searchQuery)}&type=${this.state.searchType}`;
     console.log(searchURL);
     axios.get(searchURL, headerConfig).then((res: { data: SearchResult }) => {
       this.updateSidePanelZIndex(1);
@@ -232,7 +259,14 @@ class GraphControl extends Component<GraphControlProps, GraphControlState> {
               onChange={this.setSearchQuery}
               id="search-query-input"
               placeholder="Search"
+              list="search-suggestions"
+              autoComplete="off"
             />
+            <datalist id="search-suggestions">
+              {this.state.suggestions.map((suggestion) => (
+                <option key={suggestion.id} value={suggestion.name} />
+              ))}
+            </datalist>
             <Select
               id="search-type-select"
               default="artist"
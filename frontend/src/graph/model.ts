@@ -30,6 +30,8 @@ export interface MusicGraph {
   limit?: number;
   dimx?: string;
   dimy?: string;
+  // opaque token of the viewport, /select recomputes the displayed nodes from it
+  viewport?: string;
   nodes: MusicGraphNode[];
   links: MusicGraphLink[];
 }